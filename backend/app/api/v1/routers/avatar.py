@@ -2,15 +2,18 @@ from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, status
 from sqlalchemy.orm import Session
 import uuid
 from pathlib import Path
+from app.core.config import settings
 from app.core.database import get_db
-from app.core.security import get_current_user
+from app.core.security import get_current_user, invalidate_principal
 from app.core.cloudinary import (
     configure_cloudinary, 
-    upload_to_cloudinary, 
-    delete_from_cloudinary,
     extract_public_id_from_url
 )
+from app.crud.media import queue_media_deletion
+from app.helpers.uploads import spool_upload
 from app.models.user import User
+from app.services.image_pipeline import IMAGE_MIME_TYPES, image_pipeline
+from app.services.storage import storage
 
 # Configure Cloudinary on startup
 configure_cloudinary()
@@ -39,21 +42,19 @@ async def upload_avatar(
                 detail="Invalid file type. Only PNG and JPG files are allowed."
             )
 
-        # Read file content
-        content = await avatar.read()
-        
-        # Validate file size
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="File too large. Maximum size is 2MB."
-            )
+        # Validate file size while streaming through the spooled upload
+        content, _ = await spool_upload(avatar, MAX_FILE_SIZE, "File too large. Maximum size is 2MB.")
+
+        # Check the real content type and resize locally, so only the small variant is uploaded
+        processed = await image_pipeline.prepare(content, IMAGE_MIME_TYPES, settings.IMAGE_VARIANT_SIZE)
+        if processed:
+            content, file_extension = processed.content, processed.extension
 
         # Generate unique filename
         unique_filename = f"{uuid.uuid4().hex}{file_extension}"
 
         # Upload to Cloudinary
-        upload_result = upload_to_cloudinary(content, public_id=unique_filename)
+        upload_result = await storage.upload(content, public_id=unique_filename, transform=processed is None)
         
         if not upload_result or 'secure_url' not in upload_result:
             raise HTTPException(
@@ -61,15 +62,14 @@ async def upload_avatar(
                 detail="Failed to upload avatar to cloud storage."
             )
 
-        # Delete old avatar from Cloudinary if it exists and is not default
+        # Queue the old avatar for deletion from Cloudinary if it exists and is not default
         if current_user.avatar_url and not current_user.avatar_url.startswith('/static/'):
-            public_id = extract_public_id_from_url(current_user.avatar_url)
-            if public_id:
-                delete_from_cloudinary(public_id)
+            queue_media_deletion(db, extract_public_id_from_url(current_user.avatar_url))
 
         # Update user's avatar URL in database
         current_user.avatar_url = upload_result['secure_url']
         db.commit()
+        invalidate_principal(current_user.id)
 
         return {
             "avatar_url": upload_result['secure_url'],
@@ -100,15 +100,14 @@ async def delete_avatar(
                 detail="No avatar to delete"
             )
 
-        # Delete from Cloudinary if it's a Cloudinary URL
+        # Queue for deletion from Cloudinary if it's a Cloudinary URL
         if not current_user.avatar_url.startswith('/static/'):
-            public_id = extract_public_id_from_url(current_user.avatar_url)
-            if public_id:
-                delete_from_cloudinary(public_id)
+            queue_media_deletion(db, extract_public_id_from_url(current_user.avatar_url))
 
         # Set avatar_url to null in database
         current_user.avatar_url = None
         db.commit()
+        invalidate_principal(current_user.id)
 
         return {"message": "Avatar deleted successfully"}
 
@@ -3,27 +3,36 @@ import uuid
 from datetime import datetime, timezone
 from typing import List, Optional
 
-import cloudinary
-import cloudinary.uploader
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Response, UploadFile
 from sqlalchemy.orm import Session, joinedload
 
 from app.core.database import get_db
 from app.core.security import get_current_user
-from app.crud.chat import create_private_message, delete_message_forever, edit_private_message, mark_messages_as_read
+from app.crud.chat import (bulk_mark_as_read, create_private_message, edit_private_message, get_private_chat_page,
+                           mark_messages_as_read, remove_private_message)
+from app.crud.chat_event import get_events_since, get_group_events_since
+from app.crud.conversation import get_conversations_page, get_unread_counts
 from app.crud.friend import is_friend
+from app.crud.realtime_outbox import queue_broadcast
+from app.crud.media import discard_upload, find_media, media_hasher, queue_media_deletion, register_media
+from app.helpers.uploads import spool_upload
+from app.helpers.utils import decode_cursor, encode_cursor
 from app.models.message_seen_status import MessageSeenStatus
-from app.models.private_message import MessageType, PrivateMessage
+from app.models.private_message import PrivateMessage
 from app.models.user import User
-from app.schemas.chat import (MarkMessagesAsReadRequest, MarkMessagesAsReadResponse,
+from app.schemas.chat import (ChatSyncOut, ConversationOut, GroupSyncOut, MarkMessagesAsReadRequest, MarkMessagesAsReadResponse,
                              MessageCreate, MessageOut, MessageSeenByUser, ReplyPreview)
-from app.services.websocket_manager import manager
-from app.utils.chat_helpers import _chat_id, extract_public_id_from_url
-from app.core.cloudinary import check_cloudinary_health, upload_voice_message
+from app.services.group_membership import get_group_ids
+from app.services.storage import storage
+from app.services.unread_counters import unread_counts_frame
+from app.utils.chat_helpers import _chat_id, messages_read_frame
+from app.core.cloudinary import check_cloudinary_health
 from app.core.config import settings
 
 router = APIRouter()
 
+CHAT_IMAGE_MAX_SIZE = 10 * 1024 * 1024  # 10MB
+
 # Mark messages as read endpoint
 @router.post("/messages/read")
 async def mark_messages_as_read_batch(
@@ -35,104 +44,118 @@ async def mark_messages_as_read_batch(
     Mark multiple messages as read with proper seen_by tracking
     """
     try:
-        # Get messages that belong to this user and are unread
-        messages = db.query(PrivateMessage).filter(
-            PrivateMessage.id.in_(request.message_ids),
-            PrivateMessage.receiver_id == current_user.id,
-            PrivateMessage.is_read == False
-        ).all()
-        
-        if not messages:
-            return MarkMessagesAsReadResponse(
-                status="success",
-                marked_count=0,
-                message_ids=request.message_ids
+        read_at, marked = bulk_mark_as_read(db, current_user.id, message_ids=request.message_ids, commit=False)
+
+        # One messages_read frame per conversation touched
+        by_sender = {}
+        for message_id, sender_id in marked:
+            by_sender.setdefault(sender_id, []).append(message_id)
+
+        for sender_id, message_ids in by_sender.items():
+            queue_broadcast(
+                db,
+                _chat_id(sender_id, current_user.id),
+                messages_read_frame(current_user.id, current_user.username, current_user.avatar_url, message_ids, read_at)
             )
-        
-        marked_count = 0
-        for message in messages:
-            # Update message read status
-            message.is_read = True
-            message.read_at = datetime.now(timezone.utc)
-            
-            # Add seen status entry
-            existing_seen = db.query(MessageSeenStatus).filter(
-                MessageSeenStatus.message_id == message.id,
-                MessageSeenStatus.user_id == current_user.id
-            ).first()
-            
-            if not existing_seen:
-                seen_status = MessageSeenStatus(
-                    message_id=message.id,
-                    user_id=current_user.id,
-                    seen_at=datetime.now(timezone.utc)
-                )
-                db.add(seen_status)
-                marked_count += 1
-        
         db.commit()
         
-        # Get updated messages with seen_by information
-        updated_messages = db.query(PrivateMessage).options(
-            joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user)
-        ).filter(PrivateMessage.id.in_([m.id for m in messages])).all()
-        
-        # Prepare WebSocket notification
-        for message in updated_messages:
-            chat_id = _chat_id(message.sender_id, message.receiver_id)
-            
-            # Prepare seen information
-            seen_info = []
-            for status in message.seen_statuses:
-                seen_info.append({
-                    "user_id": status.user.id,
-                    "username": status.user.username,
-                    "avatar_url": status.user.avatar_url,
-                    "seen_at": status.seen_at.isoformat() if status.seen_at else None
-                })
-            
-            await manager.broadcast(chat_id, {
-                "type": "message_updated",
-                "message_id": message.id,
-                "is_read": True,
-                "read_at": message.read_at.isoformat() if message.read_at else None,
-                "seen_by": seen_info
-            })
-        
         return MarkMessagesAsReadResponse(
             status="success",
-            marked_count=marked_count,
+            marked_count=len(marked),
             message_ids=request.message_ids
         )
     except Exception as e:
-        db.rollback()
         raise HTTPException(500, f"Failed to mark messages as read: {str(e)}")
 
+# Inbox: every private and group chat with its last message and unread count
+@router.get("/conversations", response_model=List[ConversationOut])
+def list_conversations(
+    response: Response,
+    before: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    limit: int = Query(30, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Most recently active chats first. Served from the conversations summary table,
+    so a page costs one index scan however long the histories are.
+    """
+    position = None
+    if before:
+        position = decode_cursor(before)
+        if not position:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    conversations, next_position = get_conversations_page(db, current_user.id, position, limit)
+    if next_position:
+        response.headers["X-Next-Cursor"] = encode_cursor(*next_position)
+    return conversations
+
+# Catch-up after a reconnect: only what changed since the client's cursor
+@router.get("/sync", response_model=ChatSyncOut)
+def sync_chats(
+    since: Optional[int] = Query(None, ge=0, description="cursor from the previous sync; omit to get the current one"),
+    groups: Optional[str] = Query(None, description="group_id:cursor pairs from the previous sync, comma separated"),
+    limit: int = Query(500, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    New, edited and deleted messages plus read/seen receipts across all of the user's chats,
+    in the order they happened. Private chats follow `since`, each of the user's groups its own
+    cursor in `groups`. Keep calling with the returned cursors while has_more is set anywhere.
+    """
+    try:
+        group_cursors = {
+            int(group_id): int(cursor)
+            for group_id, cursor in (pair.split(":") for pair in groups.split(",") if pair)
+        } if groups else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid group cursors")
+
+    events, cursor, has_more, reset = get_events_since(db, current_user.id, since, limit)
+    group_pages = get_group_events_since(db, get_group_ids(db, current_user.id), group_cursors, limit)
+    return ChatSyncOut(
+        events=events, cursor=cursor, has_more=has_more, reset=reset,
+        groups=[
+            GroupSyncOut(group_id=group_id, events=group_events, cursor=group_cursor, has_more=group_more, reset=group_reset)
+            for group_id, (group_events, group_cursor, group_more, group_reset) in group_pages.items()
+        ]
+    )
+
+# Badge counts, read from the maintained counters
+@router.get("/unread")
+def get_unread(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Total unread plus per-friend and per-group counts; chats with nothing unread are left out"""
+    counts = get_unread_counts(db, [current_user.id])[current_user.id]
+    return unread_counts_frame(current_user.id, counts)
+
 # Get private chat messages
 @router.get("/private/{friend_id}", response_model=List[MessageOut])
 async def get_private_chat(
     friend_id: int,
+    before_id: Optional[int] = Query(None, description="Return messages older than this message"),
+    after_id: Optional[int] = Query(None, description="Return messages newer than this message"),
+    limit: int = Query(50, ge=1, le=200),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Get private chat messages between current user and friend with Telegram-style replies
+    Get private chat messages between current user and friend with Telegram-style replies.
+    Returns the latest `limit` messages, oldest first; pass the first id as before_id to load older ones.
     """
     try:
         # Verify friendship
         if not is_friend(db, current_user.id, friend_id):
             raise HTTPException(status_code=403, detail="Not friends")
 
-        # FIXED: Query with proper relationship loading for replies
-        messages = db.query(PrivateMessage).options(
-            joinedload(PrivateMessage.sender),
-            joinedload(PrivateMessage.receiver),
-            joinedload(PrivateMessage.reply_to).joinedload(PrivateMessage.sender),  # Load sender of replied message
-            joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user),
-        ).filter(
-            ((PrivateMessage.sender_id == current_user.id) & (PrivateMessage.receiver_id == friend_id)) |
-            ((PrivateMessage.sender_id == friend_id) & (PrivateMessage.receiver_id == current_user.id))
-        ).order_by(PrivateMessage.created_at.asc()).all()
+        messages = get_private_chat_page(
+            db, current_user.id, friend_id,
+            before_id=before_id, after_id=after_id, limit=limit
+        )
 
         result = []
         for msg in messages:
@@ -147,54 +170,9 @@ async def get_private_chat(
                 for status in getattr(msg, "seen_statuses", [])
             ]
 
-            # FIXED: Reply handling with proper null checks
-            reply_to_out = None
-            reply_preview = None
-            
-            if msg.reply_to:  # This should now work with the fixed relationship
-                reply = msg.reply_to
-
-                # Build reply_to message (simplified to avoid recursion)
-                reply_to_out = MessageOut(
-                    id=reply.id,
-                    sender_id=reply.sender_id,
-                    receiver_id=reply.receiver_id,
-                    content=reply.content,
-                    message_type=reply.message_type.value,
-                    is_read=reply.is_read,
-                    read_at=reply.read_at.isoformat() if reply.read_at else None,
-                    delivered_at=reply.delivered_at.isoformat() if reply.delivered_at else None,
-                    reply_to=None,  # avoid infinite recursion
-                    reply_to_id=reply.reply_to_id,  # Add this
-                    is_forwarded=reply.is_forwarded,
-                    original_sender=reply.original_sender,
-                    created_at=reply.created_at.isoformat(),
-                    sender_username=getattr(reply.sender, "username", None),
-                    receiver_username=getattr(reply.receiver, "username", None),
-                    voice_duration=reply.voice_duration,
-                    file_size=reply.file_size,
-                    seen_by=[]  # Simplified to avoid complex nested queries
-                )
-
-                # Build reply preview
-                content_preview = reply.content or ""
-                if reply.message_type == MessageType.voice:
-                    content_preview = "🎤 Voice message"
-                elif reply.message_type == MessageType.image:
-                    content_preview = "🖼️ Photo"
-                elif reply.message_type == MessageType.file:
-                    content_preview = "📎 File"
-                elif len(content_preview) > 100:
-                    content_preview = content_preview[:100] + "..."
-
-                reply_preview = ReplyPreview(
-                    id=reply.id,
-                    sender_username=getattr(reply.sender, "username", "Unknown"),
-                    content=content_preview,
-                    message_type=reply.message_type.value,
-                    voice_duration=reply.voice_duration,
-                    file_size=reply.file_size
-                )
+            # Stored with the message, so history needs no self-join. reply_to_id also goes NULL when the
+            # original disappears in a cascade that skipped the delete hooks, e.g. its sender's account
+            reply_preview = ReplyPreview(**msg.reply_preview) if msg.reply_preview and msg.reply_to_id else None
 
             # Build main message output
             msg_out = MessageOut(
@@ -207,7 +185,6 @@ async def get_private_chat(
                 read_at=msg.read_at.isoformat() if msg.read_at else None,
                 delivered_at=msg.delivered_at.isoformat() if msg.delivered_at else None,
                 reply_to_id=msg.reply_to_id,  # Make sure this is included
-                reply_to=reply_to_out,
                 reply_preview=reply_preview,
                 is_forwarded=msg.is_forwarded,
                 original_sender=msg.original_sender,
@@ -257,26 +234,15 @@ async def send_private_message(
             is_forwarded=msg_in.is_forwarded,
             original_sender=msg_in.original_sender,
             voice_duration=msg_in.voice_duration,
-            file_size=msg_in.file_size
+            file_size=msg_in.file_size,
+            commit=False
         )
-
-        # Get the full message with all relationships
-        full_msg = db.query(PrivateMessage).options(
-            joinedload(PrivateMessage.sender),
-            joinedload(PrivateMessage.receiver),
-            joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user),
-            joinedload(PrivateMessage.reply_to).joinedload(PrivateMessage.sender),
-            joinedload(PrivateMessage.reply_to).joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user)
-        ).filter(PrivateMessage.id == msg.id).first()
-
-        if not full_msg:
-            raise HTTPException(status_code=500, detail="Failed to retrieve created message")
         
         chat_id = _chat_id(current_user.id, friend_id)
         
         # Prepare seen information
         seen_by = []
-        for status in full_msg.seen_statuses:
+        for status in msg.seen_statuses:
             seen_by.append({
                 "user_id": status.user.id,
                 "username": status.user.username,
@@ -287,158 +253,52 @@ async def send_private_message(
         # Prepare broadcast data
         broadcast_data = {
             "type": "message",
-            "id": full_msg.id,
-            "sender_id": full_msg.sender_id,
-            "receiver_id": full_msg.receiver_id,
-            "content": full_msg.content,
-            "message_type": full_msg.message_type.value,
-            "is_read": full_msg.is_read,
-            "read_at": full_msg.read_at.isoformat() if full_msg.read_at else None,
-            "delivered_at": full_msg.delivered_at.isoformat() if full_msg.delivered_at else None,
-            "reply_to_id": full_msg.reply_to_id,
-            "is_forwarded": full_msg.is_forwarded,
-            "original_sender": full_msg.original_sender,
-            "created_at": full_msg.created_at.isoformat(),
-            "sender_username": full_msg.sender.username,
-            "receiver_username": full_msg.receiver.username,
-            "voice_duration": full_msg.voice_duration,
-            "file_size": full_msg.file_size,
+            "id": msg.id,
+            "sender_id": msg.sender_id,
+            "receiver_id": msg.receiver_id,
+            "content": msg.content,
+            "message_type": msg.message_type,
+            "is_read": msg.is_read,
+            "read_at": msg.read_at,
+            "delivered_at": msg.delivered_at,
+            "reply_to_id": msg.reply_to_id,
+            "is_forwarded": msg.is_forwarded,
+            "original_sender": msg.original_sender,
+            "created_at": msg.created_at,
+            "sender_username": msg.sender.username,
+            "receiver_username": msg.receiver.username,
+            "voice_duration": msg.voice_duration,
+            "file_size": msg.file_size,
+            "reply_preview": msg.reply_preview,
             "seen_by": seen_by
         }
         
-        # Add Telegram-style reply data if exists
-        if full_msg.reply_to:
-            # Create compact reply preview (like Telegram)
-            reply_content = full_msg.reply_to.content or ""
-            if full_msg.reply_to.message_type == MessageType.voice:
-                reply_content = "🎤 Voice message"
-            elif full_msg.reply_to.message_type == MessageType.image:
-                reply_content = "🖼️ Photo" 
-            elif full_msg.reply_to.message_type == MessageType.file:
-                reply_content = "📎 File"
-            elif len(reply_content) > 100:
-                reply_content = reply_content[:100] + "..."
-            
-            # Add compact reply preview to broadcast
-            broadcast_data["reply_preview"] = {
-                "id": full_msg.reply_to.id,
-                "sender_username": full_msg.reply_to.sender.username,
-                "content": reply_content,
-                "message_type": full_msg.reply_to.message_type.value,
-                "voice_duration": full_msg.reply_to.voice_duration,
-                "file_size": full_msg.reply_to.file_size
-            }
-            
-            # Also include full reply data for detailed view
-            reply_seen_by = []
-            if full_msg.reply_to.seen_statuses:
-                for status in full_msg.reply_to.seen_statuses:
-                    reply_seen_by.append({
-                        "user_id": status.user.id,
-                        "username": status.user.username,
-                        "avatar_url": status.user.avatar_url,
-                        "seen_at": status.seen_at.isoformat() if status.seen_at else None
-                    })
-            
-            # Include complete replied message information
-            broadcast_data["reply_to"] = {
-                "id": full_msg.reply_to.id,
-                "sender_id": full_msg.reply_to.sender_id,
-                "receiver_id": full_msg.reply_to.receiver_id,
-                "content": full_msg.reply_to.content,
-                "message_type": full_msg.reply_to.message_type.value,
-                "is_read": full_msg.reply_to.is_read,
-                "read_at": full_msg.reply_to.read_at.isoformat() if full_msg.reply_to.read_at else None,
-                "delivered_at": full_msg.reply_to.delivered_at.isoformat() if full_msg.reply_to.delivered_at else None,
-                "reply_to_id": full_msg.reply_to.reply_to_id,
-                "is_forwarded": full_msg.reply_to.is_forwarded,
-                "original_sender": full_msg.reply_to.original_sender,
-                "created_at": full_msg.reply_to.created_at.isoformat(),
-                "sender_username": full_msg.reply_to.sender.username,
-                "receiver_username": full_msg.reply_to.receiver.username if full_msg.reply_to.receiver else None,
-                "voice_duration": full_msg.reply_to.voice_duration,
-                "file_size": full_msg.reply_to.file_size,
-                "seen_by": reply_seen_by
-            }
-        
-        # Broadcast via WebSocket
-        await manager.broadcast(chat_id, broadcast_data)
+        # Broadcast via WebSocket once the message commits
+        queue_broadcast(db, chat_id, broadcast_data)
         
         # Build response with Telegram-style reply preview
         response = MessageOut(
-            id=full_msg.id,
-            sender_id=full_msg.sender_id,
-            receiver_id=full_msg.receiver_id,
-            content=full_msg.content,
-            message_type=full_msg.message_type.value,
-            is_read=full_msg.is_read,
-            read_at=full_msg.read_at.isoformat() if full_msg.read_at else None,
-            delivered_at=full_msg.delivered_at.isoformat() if full_msg.delivered_at else None,
-            reply_to_id=full_msg.reply_to_id,
-            is_forwarded=full_msg.is_forwarded,
-            original_sender=full_msg.original_sender,
-            sender_username=full_msg.sender.username,
-            receiver_username=full_msg.receiver.username,
-            voice_duration=full_msg.voice_duration,
-            file_size=full_msg.file_size,
+            id=msg.id,
+            sender_id=msg.sender_id,
+            receiver_id=msg.receiver_id,
+            content=msg.content,
+            message_type=msg.message_type.value,
+            is_read=msg.is_read,
+            read_at=msg.read_at.isoformat() if msg.read_at else None,
+            delivered_at=msg.delivered_at.isoformat() if msg.delivered_at else None,
+            reply_to_id=msg.reply_to_id,
+            is_forwarded=msg.is_forwarded,
+            original_sender=msg.original_sender,
+            sender_username=msg.sender.username,
+            receiver_username=msg.receiver.username,
+            voice_duration=msg.voice_duration,
+            file_size=msg.file_size,
+            reply_preview=msg.reply_preview,
             seen_by=[MessageSeenByUser(**item) for item in seen_by],
-            created_at=full_msg.created_at.isoformat()
+            created_at=msg.created_at.isoformat()
         )
         
-        # Add Telegram-style reply preview to response if exists
-        if full_msg.reply_to:
-            # Create compact preview for the response
-            reply_content = full_msg.reply_to.content or ""
-            if full_msg.reply_to.message_type == MessageType.voice:
-                reply_content = "🎤 Voice message"
-            elif full_msg.reply_to.message_type == MessageType.image:
-                reply_content = "🖼️ Photo"
-            elif full_msg.reply_to.message_type == MessageType.file:
-                reply_content = "📎 File"
-            elif len(reply_content) > 100:
-                reply_content = reply_content[:100] + "..."
-            
-            # Add reply_preview to response
-            response.reply_preview = ReplyPreview(
-                id=full_msg.reply_to.id,
-                sender_username=full_msg.reply_to.sender.username,
-                content=reply_content,
-                message_type=full_msg.reply_to.message_type.value,
-                voice_duration=full_msg.reply_to.voice_duration,
-                file_size=full_msg.reply_to.file_size
-            )
-            
-            # Also include full reply object for detailed view
-            reply_seen_by = []
-            if full_msg.reply_to.seen_statuses:
-                for status in full_msg.reply_to.seen_statuses:
-                    reply_seen_by.append(MessageSeenByUser(
-                        user_id=status.user.id,
-                        username=status.user.username,
-                        avatar_url=status.user.avatar_url,
-                        seen_at=status.seen_at.isoformat() if status.seen_at else None
-                    ))
-            
-            response.reply_to = MessageOut(
-                id=full_msg.reply_to.id,
-                sender_id=full_msg.reply_to.sender_id,
-                receiver_id=full_msg.reply_to.receiver_id,
-                content=full_msg.reply_to.content,
-                message_type=full_msg.reply_to.message_type.value,
-                is_read=full_msg.reply_to.is_read,
-                read_at=full_msg.reply_to.read_at.isoformat() if full_msg.reply_to.read_at else None,
-                delivered_at=full_msg.reply_to.delivered_at.isoformat() if full_msg.reply_to.delivered_at else None,
-                reply_to_id=full_msg.reply_to.reply_to_id,
-                is_forwarded=full_msg.reply_to.is_forwarded,
-                original_sender=full_msg.reply_to.original_sender,
-                created_at=full_msg.reply_to.created_at.isoformat(),
-                sender_username=full_msg.reply_to.sender.username,
-                receiver_username=full_msg.reply_to.receiver.username if full_msg.reply_to.receiver else None,
-                voice_duration=full_msg.reply_to.voice_duration,
-                file_size=full_msg.reply_to.file_size,
-                seen_by=reply_seen_by
-            )
-        
+        db.commit()
         return response
         
     except HTTPException:
@@ -525,14 +385,11 @@ async def send_voice_message(
         if not is_friend(db, current_user.id, friend_id):
             raise HTTPException(status_code=403, detail="Not friends")
 
-        # Read and validate file
-        contents = await voice_file.read()
-        file_size = len(contents)
+        # Validate the file size without reading it into memory
+        contents, file_size = await spool_upload(voice_file, 15 * 1024 * 1024, "Voice message too large (max 15MB)")
 
         if file_size == 0:
             raise HTTPException(status_code=400, detail="Empty audio file")
-        if file_size > 15 * 1024 * 1024:  # 15MB max
-            raise HTTPException(status_code=400, detail="Voice message too large (max 15MB)")
 
         # Validate duration
         if duration <= 0 or duration > 600:  # max 10 minutes
@@ -542,8 +399,8 @@ async def send_voice_message(
 
         # FIX: Better error handling for upload
         try:
-            upload_result = upload_voice_message(
-                file_content=contents,
+            upload_result = await storage.upload_voice(
+                contents,
                 public_id=f"voice_{current_user.id}_{uuid.uuid4().hex[:8]}",  # shorter ID
                 folder="voice_messages"
             )
@@ -567,23 +424,13 @@ async def send_voice_message(
                 message_type="voice",
                 reply_to_id=reply_to_id,
                 voice_duration=round(duration, 2),
-                file_size=file_size
+                file_size=file_size,
+                commit=False
             )
         except Exception as db_error:
             print(f"❌ Database error: {db_error}")
             raise HTTPException(status_code=500, detail="Failed to save message to database")
 
-        # Load full message with all relations
-        full_msg = db.query(PrivateMessage).options(
-            joinedload(PrivateMessage.sender),
-            joinedload(PrivateMessage.receiver),
-            joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user),
-            joinedload(PrivateMessage.reply_to).joinedload(PrivateMessage.sender),
-        ).filter(PrivateMessage.id == msg.id).first()
-
-        if not full_msg:
-            raise HTTPException(status_code=500, detail="Failed to load sent message")
-
         chat_id = _chat_id(current_user.id, friend_id)
 
         # Prepare WebSocket broadcast
@@ -594,89 +441,50 @@ async def send_voice_message(
                 "avatar_url": s.user.avatar_url,
                 "seen_at": s.seen_at.isoformat() if s.seen_at else None
             }
-            for s in full_msg.seen_statuses
+            for s in msg.seen_statuses
         ]
 
         broadcast_data = {
             "type": "message",
-            "id": full_msg.id,
+            "id": msg.id,
             "temp_id": temp_id,
-            "sender_id": full_msg.sender_id,
-            "receiver_id": full_msg.receiver_id,
+            "sender_id": msg.sender_id,
+            "receiver_id": msg.receiver_id,
             "content": voice_url,
             "message_type": "voice",
             "voice_duration": round(duration, 2),
             "file_size": file_size,
             "is_read": False,
-            "created_at": full_msg.created_at.isoformat(),
-            "sender_username": full_msg.sender.username,
-            "avatar_url": full_msg.sender.avatar_url or "",
+            "created_at": msg.created_at,
+            "sender_username": msg.sender.username,
+            "avatar_url": msg.sender.avatar_url or "",
+            "reply_preview": msg.reply_preview,
             "seen_by": seen_by,
         }
 
-        # Add reply preview (Telegram style)
-        if full_msg.reply_to:
-            reply = full_msg.reply_to
-            reply_text = "Voice message"
-            if reply.message_type == MessageType.text:
-                reply_text = reply.content or "Message"
-                if len(reply_text) > 80:
-                    reply_text = reply_text[:80] + "..."
-            elif reply.message_type == MessageType.image:
-                reply_text = "Photo"
-            elif reply.message_type == MessageType.file:
-                reply_text = "File"
-
-            broadcast_data["reply_preview"] = {
-                "id": reply.id,
-                "sender_username": reply.sender.username,
-                "content": reply_text,
-                "message_type": reply.message_type.value,
-                "voice_duration": reply.voice_duration,
-                "file_size": reply.file_size
-            }
-
-        # Send via WebSocket
-        await manager.broadcast(chat_id, broadcast_data)
+        # Send via WebSocket once the message commits
+        queue_broadcast(db, chat_id, broadcast_data)
 
         # Build HTTP response
         response = MessageOut(
-            id=full_msg.id,
+            id=msg.id,
             temp_id=temp_id,
-            sender_id=full_msg.sender_id,
-            receiver_id=full_msg.receiver_id,
+            sender_id=msg.sender_id,
+            receiver_id=msg.receiver_id,
             content=voice_url,
             message_type="voice",
             voice_duration=round(duration, 2),
             file_size=file_size,
             is_read=False,
-            created_at=full_msg.created_at.isoformat(),
-            sender_username=full_msg.sender.username,
-            receiver_username=full_msg.receiver.username,
+            created_at=msg.created_at.isoformat(),
+            sender_username=msg.sender.username,
+            receiver_username=msg.receiver.username,
+            reply_preview=msg.reply_preview,
             seen_by=[MessageSeenByUser(**s) for s in seen_by],
         )
 
-        # Add reply preview to response too
-        if full_msg.reply_to:
-            reply = full_msg.reply_to
-            reply_text = "Voice message"
-            if reply.message_type == MessageType.text:
-                reply_text = (reply.content or "")[:100] + ("..." if len(reply.content or "") > 100 else "")
-            elif reply.message_type == MessageType.image:
-                reply_text = "Photo"
-            elif reply.message_type == MessageType.file:
-                reply_text = "File"
-
-            response.reply_preview = ReplyPreview(
-                id=reply.id,
-                sender_username=reply.sender.username,
-                content=reply_text,
-                message_type=reply.message_type.value,
-                voice_duration=reply.voice_duration,
-                file_size=reply.file_size
-            )
-
-        print(f"VOICE MESSAGE SENT #{full_msg.id} | {duration}s | {file_size/1024:.1f}KB")
+        print(f"VOICE MESSAGE SENT #{msg.id} | {duration}s | {file_size/1024:.1f}KB")
+        db.commit()
         return response
 
     except HTTPException:
@@ -697,7 +505,7 @@ async def cloudinary_health_check():
             try:
                 # Test with a small file
                 test_content = b"test voice message content"
-                test_result = upload_voice_message(
+                test_result = await storage.upload_voice(
                     test_content,
                     public_id=f"health_check_{uuid.uuid4().hex}",
                     folder="health_checks"
@@ -758,24 +566,15 @@ async def send_image_message(
             message_type=message_type,
             reply_to_id=reply_to_id,
             is_forwarded=False,
-            original_sender=None
+            original_sender=None,
+            commit=False
         )
         
-        # Get the full message with user relationships
-        full_msg = db.query(PrivateMessage).options(
-            joinedload(PrivateMessage.sender),
-            joinedload(PrivateMessage.receiver),
-            joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user)
-        ).filter(PrivateMessage.id == msg.id).first()
-        
-        if not full_msg:
-            raise HTTPException(status_code=500, detail="Failed to retrieve created image message")
-        
         chat_id = _chat_id(current_user.id, friend_id)
         
         # Prepare seen information
         seen_by = []
-        for status in full_msg.seen_statuses:
+        for status in msg.seen_statuses:
             seen_by.append({
                 "user_id": status.user.id,
                 "username": status.user.username,
@@ -786,40 +585,41 @@ async def send_image_message(
         # Prepare broadcast data for image message
         broadcast_data = {
             "type": "message",
-            "id": full_msg.id,
-            "sender_id": full_msg.sender_id,
-            "receiver_id": full_msg.receiver_id,
-            "content": full_msg.content,
-            "message_type": full_msg.message_type.value,
-            "is_read": full_msg.is_read,
-            "read_at": full_msg.read_at.isoformat() if full_msg.read_at else None,
-            "delivered_at": full_msg.delivered_at.isoformat() if full_msg.delivered_at else None,
-            "reply_to_id": full_msg.reply_to_id,
-            "is_forwarded": full_msg.is_forwarded,
-            "original_sender": full_msg.original_sender,
-            "created_at": full_msg.created_at.isoformat(),
-            "sender_username": full_msg.sender.username,
-            "receiver_username": full_msg.receiver.username,
+            "id": msg.id,
+            "sender_id": msg.sender_id,
+            "receiver_id": msg.receiver_id,
+            "content": msg.content,
+            "message_type": msg.message_type,
+            "is_read": msg.is_read,
+            "read_at": msg.read_at,
+            "delivered_at": msg.delivered_at,
+            "reply_to_id": msg.reply_to_id,
+            "is_forwarded": msg.is_forwarded,
+            "original_sender": msg.original_sender,
+            "created_at": msg.created_at,
+            "sender_username": msg.sender.username,
+            "receiver_username": msg.receiver.username,
             "seen_by": seen_by
         }
         
-        await manager.broadcast(chat_id, broadcast_data)
+        queue_broadcast(db, chat_id, broadcast_data)
+        db.commit()
         
         return MessageOut(
-            id=full_msg.id,
-            sender_id=full_msg.sender_id,
-            receiver_id=full_msg.receiver_id,
-            content=full_msg.content,
-            message_type=full_msg.message_type.value,
-            is_read=full_msg.is_read,
-            read_at=full_msg.read_at.isoformat() if full_msg.read_at else None,
-            delivered_at=full_msg.delivered_at.isoformat() if full_msg.delivered_at else None,
-            reply_to_id=full_msg.reply_to_id,
-            is_forwarded=full_msg.is_forwarded,
-            original_sender=full_msg.original_sender,
-            sender_username=full_msg.sender.username,
-            receiver_username=full_msg.receiver.username,
-            created_at=full_msg.created_at.isoformat(),
+            id=msg.id,
+            sender_id=msg.sender_id,
+            receiver_id=msg.receiver_id,
+            content=msg.content,
+            message_type=msg.message_type.value,
+            is_read=msg.is_read,
+            read_at=msg.read_at.isoformat() if msg.read_at else None,
+            delivered_at=msg.delivered_at.isoformat() if msg.delivered_at else None,
+            reply_to_id=msg.reply_to_id,
+            is_forwarded=msg.is_forwarded,
+            original_sender=msg.original_sender,
+            sender_username=msg.sender.username,
+            receiver_username=msg.receiver.username,
+            created_at=msg.created_at.isoformat(),
             seen_by=[MessageSeenByUser(**item) for item in seen_by]
         )
         
@@ -846,13 +646,24 @@ async def upload_image_to_cloudinary(
         if not file.content_type or not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="Only image files allowed")
 
+        # The same bytes uploaded before are served from the registry instead of uploaded again
+        hasher = media_hasher()
+        content, file_size = await spool_upload(file, CHAT_IMAGE_MAX_SIZE, "Image too large (max 10MB)", hasher=hasher)
+        digest = hasher.hexdigest()
+        # No reference is taken here: the message that uses the URL claims it when it is written
+        existing = find_media(db, digest, "chat_image")
+        db.commit()
+        if existing:
+            public_id, url = existing
+            return {"url": url, "public_id": public_id}
+
         try:
             # Generate unique filename
             file_extension = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
             unique_filename = f"chat_{current_user.id}_{friend_id}_{uuid.uuid4().hex}.{file_extension}"
             
-            result = cloudinary.uploader.upload(
-                file.file,
+            result = await storage.upload_raw(
+                content,
                 folder="chat_images",
                 public_id=unique_filename,
                 resource_type="image",
@@ -861,9 +672,15 @@ async def upload_image_to_cloudinary(
                     {"quality": "auto"}
                 ]
             )
-            return {"url": result["secure_url"], "public_id": result["public_id"]}
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+        public_id, url, duplicate = register_media(db, digest, "chat_image", result, file_size, uploader_id=current_user.id)
+        if duplicate:
+            # Lost a race with an identical upload; keep theirs
+            queue_media_deletion(db, result["public_id"])
+        db.commit()
+        return {"url": url, "public_id": public_id}
             
     except HTTPException:
         raise
@@ -900,36 +717,17 @@ async def delete_image_message(
         if message.message_type.value != 'image':
             raise HTTPException(status_code=400, detail="Not an image message")
         
-        # Extract public_id from Cloudinary URL
-        image_url = message.content
-        public_id = extract_public_id_from_url(image_url)
-        
-        # Delete from Cloudinary
-        if public_id:
-            try:
-                cloudinary.uploader.destroy(public_id)
-            except Exception as cloudinary_error:
-                print(f"Cloudinary deletion failed: {str(cloudinary_error)}")
-                # Continue with message deletion even if Cloudinary fails
-        
         # Store info for WebSocket broadcast before deletion
         chat_id = _chat_id(message.sender_id, message.receiver_id)
-        
-        # Delete seen statuses first
-        if message.seen_statuses:
-            for seen_status in message.seen_statuses:
-                db.delete(seen_status)
-        
-        # Delete the message from database
-        db.delete(message)
-        db.commit()
-        
-        # Notify via WebSocket
-        await manager.broadcast(chat_id, {
+
+        # Delete the message from database, notifying via WebSocket once it commits
+        remove_private_message(db, message)
+        queue_broadcast(db, chat_id, {
             "type": "message_deleted",
             "message_id": message_id,
-            "deleted_at": datetime.now(timezone.utc).isoformat()
+            "deleted_at": datetime.now(timezone.utc)
         })
+        db.commit()
         
         return {"status": "success", "message": "Image message deleted", "message_id": message_id}
         
@@ -965,34 +763,15 @@ async def delete_message_forever_endpoint(
         # Store info for broadcast before deletion
         chat_id = _chat_id(message.sender_id, message.receiver_id)
         
-        # If it's an image message, delete from Cloudinary first
-        if message.message_type.value == 'image':
-            image_url = message.content
-            public_id = extract_public_id_from_url(image_url)
-            
-            if public_id:
-                try:
-                    cloudinary.uploader.destroy(public_id)
-                except Exception as e:
-                    print(f"Cloudinary deletion failed: {str(e)}")
-                    # Continue with message deletion even if Cloudinary fails
-        
-        # Delete seen statuses first to avoid foreign key constraint
-        if message.seen_statuses:
-            for seen_status in message.seen_statuses:
-                db.delete(seen_status)
-            db.flush()  # Commit the deletion of seen statuses first
-        
-        # Now delete the message
-        db.delete(message)
-        db.commit()
-        
-        # Broadcast deletion
-        await manager.broadcast(chat_id, {
+        # Media references, reply previews, seen statuses and the inbox go with it;
+        # the deletion is broadcast once it commits
+        remove_private_message(db, message)
+        queue_broadcast(db, chat_id, {
             "type": "message_deleted", 
             "message_id": message_id,
-            "deleted_at": datetime.now(timezone.utc).isoformat()
+            "deleted_at": datetime.now(timezone.utc)
         })
+        db.commit()
         
         return {
             "status": "success", 
@@ -1054,7 +833,7 @@ async def edit_message(
     """
     try:
         # Edit the message
-        msg = edit_private_message(db, message_id, current_user.id, data.content.strip())
+        msg = edit_private_message(db, message_id, current_user.id, data.content.strip(), commit=False)
 
         # Get complete message data with all relationships for WebSocket
         full_msg = db.query(PrivateMessage).options(
@@ -1075,7 +854,7 @@ async def edit_message(
                 "user_id": status.user.id,
                 "username": status.user.username,
                 "avatar_url": status.user.avatar_url,
-                "seen_at": status.seen_at.isoformat() if status.seen_at else None
+                "seen_at": status.seen_at
             })
 
         # Complete WebSocket payload
@@ -1084,16 +863,16 @@ async def edit_message(
             "id": full_msg.id,
             "message_id": full_msg.id,  # Both id and message_id for compatibility
             "content": full_msg.content,
-            "message_type": full_msg.message_type.value,
-            "updated_at": full_msg.updated_at.isoformat(),
-            "created_at": full_msg.created_at.isoformat(),
+            "message_type": full_msg.message_type,
+            "updated_at": full_msg.updated_at,
+            "created_at": full_msg.created_at,
             "sender_id": full_msg.sender_id,
             "receiver_id": full_msg.receiver_id,
             "sender_username": full_msg.sender.username,
             "receiver_username": full_msg.receiver.username if full_msg.receiver else None,
             "avatar_url": full_msg.sender.avatar_url,
             "is_read": full_msg.is_read,
-            "read_at": full_msg.read_at.isoformat() if full_msg.read_at else None,
+            "read_at": full_msg.read_at,
             "seen_by": seen_by,
             "voice_duration": full_msg.voice_duration,
             "file_size": full_msg.file_size,
@@ -1101,9 +880,10 @@ async def edit_message(
             "original_sender": full_msg.original_sender,
         }
 
-        # Broadcast to all connected clients in the chat
-        await manager.broadcast(chat_id, payload)
-        print(f"✅ Broadcast message edit: {full_msg.id} to chat {chat_id}")
+        # Broadcast to all connected clients in the chat once the edit commits
+        queue_broadcast(db, chat_id, payload)
+        db.commit()
+        print(f"✅ Queued message edit broadcast: {full_msg.id} to chat {chat_id}")
         
         # HTTP response
         return {
@@ -1125,17 +905,21 @@ async def edit_message(
 @router.post("/delete-image")
 async def delete_cloudinary_image(
     data: dict,
+    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Delete image from Cloudinary only
+    Delete an image uploaded by the current user that no message uses yet
     """
     try:
         public_id = data.get("public_id")
         if not public_id:
             raise HTTPException(status_code=400, detail="public_id required")
 
-        cloudinary.uploader.destroy(public_id)
+        discard_upload(db, public_id, current_user.id)
+        db.commit()
         return {"status": "deleted"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Cloudinary delete failed: {str(e)}")
\ No newline at end of file
@@ -9,8 +9,9 @@ from app.schemas.diary import DiaryCreate, DiaryOut, DiaryCommentCreate, DiaryCo
 from app.services.websocket_manager import manager
 from app.models.diary import Diary
 from app.models.friend import Friend, FriendshipStatus
+from app.services.friend_graph import get_adjacency
+from app.services.group_membership import is_member
 from app.models.diary_like import DiaryLike
-from app.models.group_member import GroupMember
 
 router = APIRouter()
 
@@ -25,20 +26,11 @@ def create_diary_endpoint(
             raise HTTPException(status_code=400, detail="group_ids are required for group share")
 
         for group_id in diary_in.group_ids:
-            check_member = db.query(GroupMember).filter(
-                GroupMember.group_id == group_id,
-                GroupMember.user_id == current_user.id
-            ).all()
-            if not check_member:
+            if not is_member(db, group_id, current_user.id):
                 raise HTTPException(status_code=403, detail=f"You are not a member of group {group_id}")
 
     elif diary_in.share_type == "friends":
-        friends = db.query(Friend).filter(
-            ((Friend.user_id == current_user.id) | (Friend.friend_id == current_user.id)),
-            Friend.status == FriendshipStatus.accepted
-        ).all()
-
-        if not friends:
+        if not get_adjacency(db, current_user.id).friends:
             raise HTTPException(status_code=400, detail="You do not have friend yet")
     
     diary = create_diary(db, current_user.id, diary_in)
@@ -2,9 +2,10 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.security import get_current_user
-from app.crud.friend import create, update_status, get_friends, get_pending_requests, is_friend, get_friend_request, delete
+from app.crud.friend import create, update_status, get_blocked_users_list, get_friends, get_pending_requests, is_friend, get_friend_request, delete
 from app.models.user import User
 from app.models.friend import Friend, FriendshipStatus
+from app.services.friend_graph import invalidate_friendship
 
 router = APIRouter()
 
@@ -116,6 +117,7 @@ def block_user(
             # Update existing relationship to blocked
             existing.status = FriendshipStatus.blocked
             db.commit()
+            invalidate_friendship(current_user.id, user_id)
         else:
             # Create new blocked relationship
             create(db, current_user.id, user_id, FriendshipStatus.blocked)
@@ -200,13 +202,7 @@ def get_blocked_users_route(
     current_user: User = Depends(get_current_user)
 ):
     try:
-        # Direct query without using CRUD function
-        blocked_users = db.query(User).join(
-            Friend, User.id == Friend.friend_id
-        ).filter(
-            Friend.user_id == current_user.id,
-            Friend.status == FriendshipStatus.blocked
-        ).all()
+        blocked_users = get_blocked_users_list(db, current_user.id)
         
         return [{
             "id": user.id,
@@ -1,17 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Response, UploadFile, File, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
-from app.core.database import get_db
+from datetime import datetime, timezone
+from app.core.database import get_async_db, get_db
 from app.core.security import get_current_user
 from app.models.user import User
 from app.schemas.group import GroupCreate, GroupInviteOut, GroupMessageCreate, GroupOut, GroupUpdate, GroupInviteResponse, GroupImageResponse, GroupDetailsOut
-from app.services.websocket_manager import manager
+from app.crud.realtime_outbox import queue_broadcast
 from app.crud.group import accept_group_invite, add_member, create_group_with_invites, get_group_diaries, get_group_invite_link, get_group_invites, get_group_members, get_pending_invites, get_user_groups, get_group, remove_member, leave_group, update_group, invite_user, delete_group_invite, delete_cover, get_group_covers, delete_group
 from app.schemas.diary import DiaryOut
 from app.schemas.user import UserOut
-from app.crud.chat import get_group_messages
+from app.crud.chat import create_group_message, get_group_messages_async, get_group_messages_page_async
+from app.crud.message import get_group_watermarks_async, seen_by_from_watermarks
+from app.helpers.utils import decode_cursor, encode_cursor
 from app.models.group_message import GroupMessage
-from app.schemas.chat import GroupMessageOut
+from app.schemas.chat import GroupMessageOut, GroupMessageSeen
+from app.utils.chat_helpers import is_group_member
 from app.crud.group import get_or_create_invite_link, upload_group_cover
 
 from app.models.group_invite import GroupInvite
@@ -61,9 +66,16 @@ def join_group(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    if(db, group_id, current_user.id):
-        raise HTTPException(400, "Already a member")
-    add_member(db, group_id, current_user.id)
+    # Joining needs a pending invite; accept_group_invite rejects existing members
+    invite = db.query(GroupInvite).filter(
+        GroupInvite.group_id == group_id,
+        GroupInvite.invitee_id == current_user.id,
+        GroupInvite.status == "pending",
+        GroupInvite.expires_at > datetime.now(timezone.utc)
+    ).first()
+    if not invite:
+        raise HTTPException(403, "No pending invite for this group")
+    accept_group_invite(db, invite.id, current_user.id)
     return {"msg": "Joined group"}
 
 
@@ -74,44 +86,51 @@ async def send_group_message(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    if not exists_member(db, group_id, current_user.id):
+    if not is_group_member(db, group_id, current_user.id):
         raise HTTPException(403, "Not a member")
     
-    msg =(db, current_user.id, group_id, msg_in.content, msg_in.message_type)
-
-    groupid = f"private_{min(current_user.id, group_id)}_{max(current_user.id, group_id)}"
-    await manager.broadcast(
-        groupid, 
-        {
-            "id": msg.id,
-            "sender_id": msg.sender_id,
-            "group_id": msg.group_id,
-            "content": msg.content,
-            "message_type": msg.message_type.value,
-            "created_at": msg.created_at.isoformat() if msg.created_at else None
-        }
-    )
-
-    return GroupMessageOut(
-        id=msg.id,
-        sender_id=msg.sender_id,
-        group_id=msg.group_id,
-        content=msg.content,
-        message_type=msg.message_type.value,
-        created_at=msg.created_at
-    )
+    msg = create_group_message(db, current_user.id, group_id, msg_in.content, msg_in.message_type, commit=False)
+    out = GroupMessageOut.model_validate(msg, from_attributes=True)
+    # Broadcast via WebSocket once the message commits
+    queue_broadcast(db, f"group_{group_id}", out.model_dump(mode="json"))
+    db.commit()
+    return out
     
 from typing import List
 
 @router.get("/{group_id}/message", response_model=List[GroupMessageOut])
-def get_group_messages_(
+async def get_group_messages_(
     group_id: int,
-    db: Session = Depends(get_db),
-    limit: int = 50,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    before: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    limit: int = Query(50, ge=1, le=200),
     offset: int = 0,
 ):
-    messages = get_group_messages(db, group_id, limit, offset)
-    return messages
+    # Legacy offset paging, kept for old clients
+    if offset:
+        messages = await get_group_messages_async(db, group_id, limit, offset)
+    else:
+        position = None
+        if before:
+            position = decode_cursor(before)
+            if not position:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+        messages, next_position = await get_group_messages_page_async(db, group_id, position, limit)
+        if next_position:
+            response.headers["X-Next-Cursor"] = encode_cursor(*next_position)
+
+    watermarks = await get_group_watermarks_async(db, group_id)
+    result = []
+    for msg in messages:
+        out = GroupMessageOut.model_validate(msg, from_attributes=True)
+        out.seen_by = [
+            GroupMessageSeen.model_validate(seen, from_attributes=True)
+            for seen in seen_by_from_watermarks(msg, watermarks)
+        ]
+        result.append(out)
+    return result
 
 @router.post("/{token}/accept")
 def accept_invite(token: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -0,0 +1,50 @@
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from app.core.config import settings
+from app.core.db_executor import get_db_stats
+from app.helpers.cache import get_cache_stats
+from app.services.image_pipeline import image_pipeline
+from app.services.media_deleter import media_deleter
+from app.services.realtime_publisher import realtime_publisher
+from app.services.receipt_buffer import receipt_buffer
+from app.services.storage import storage
+from app.services.unread_counters import unread_counters
+
+
+def require_health_token(x_health_token: Optional[str] = Header(None)):
+    """Internal diagnostics are only served to callers holding HEALTH_TOKEN; unset disables them"""
+    if not settings.HEALTH_TOKEN or not x_health_token or not hmac.compare_digest(
+        x_health_token.encode(), settings.HEALTH_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+
+
+router = APIRouter(dependencies=[Depends(require_health_token)])
+
+
+@router.get("/db")
+def db_health():
+    """Timing of DB work offloaded from WebSocket handlers"""
+    return {
+        "operations": get_db_stats(),
+        "receipts": receipt_buffer.stats,
+        "unread": unread_counters.stats,
+        "realtime_outbox": realtime_publisher.stats,
+    }
+
+
+@router.get("/storage")
+async def storage_health():
+    """Cloudinary calls made through the storage facade, the image processing before them and the deletion outbox"""
+    return {
+        "storage": storage.stats,
+        "images": image_pipeline.stats,
+        "deletions": {**media_deleter.stats, "pending": await media_deleter.pending()},
+    }
+
+
+@router.get("/caches")
+def cache_health():
+    """Hit/miss counters of the in-process caches"""
+    return {"caches": get_cache_stats()}
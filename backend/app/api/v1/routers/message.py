@@ -18,10 +18,10 @@ def update_message_by_id(message_id: int,
     return update_message(db, message_id, message_data, current_user.id)
 
 @router.delete("/{message_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_message_by_id(message_id: int,
+def delete_message_by_id(message_id: int,
                          db: Session = Depends(get_db),
                          current_user: User = Depends(get_current_user)):
-    return await delete_message(db, message_id, current_user.id)
+    return delete_message(db, message_id, current_user.id)
 
 @router.post("/groups/{group_id}", response_model=GroupMessageResponse)
 async def upload_file_message_by_id(group_id: int,
@@ -2,28 +2,209 @@ import asyncio
 import json
 import traceback
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from sqlalchemy.orm import Session, joinedload
 
-from app.core.database import get_db
+from app.core.database import get_db, get_session
+from app.core.db_executor import run_db
 from app.core.security import get_current_user_ws
 from app.crud.friend import is_friend
-from app.crud.chat import create_private_message, mark_message_as_read
+from app.crud.chat import bulk_mark_as_read, create_private_message, has_unread_from, remove_private_message
+from app.crud.conversation import get_unread_counts, record_group_message
 from app.models.user import User
 from app.models.message_seen_status import MessageSeenStatus
-from app.models.private_message import PrivateMessage, MessageType
+from app.models.private_message import PrivateMessage
 from app.models.group_message import GroupMessage
-from app.models.group_message_seen import GroupMessageSeen
 from app.schemas.chat import GroupMessageOut, ParentMessageResponse, AuthorResponse
+from app.services.receipt_buffer import receipt_buffer
+from app.services.unread_counters import inbox_room, unread_counts_frame
 from app.services.websocket_manager import manager
-from app.utils.chat_helpers import _chat_id, is_group_member, validate_reply_message
+from app.utils.chat_helpers import _chat_id, is_group_member, messages_read_frame, validate_reply_message
 from app.crud.message import handle_forward_message, update_message, delete_message
 from app.helpers.to_utc_iso import to_local_iso
 
 router = APIRouter()
 
+
+def _seen_by(statuses) -> list:
+    return [
+        {
+            "user_id": status.user.id,
+            "username": status.user.username,
+            "avatar_url": status.user.avatar_url,
+            "seen_at": status.seen_at
+        }
+        for status in statuses
+    ]
+
+
+def _resume_params(websocket: WebSocket) -> Tuple[Optional[int], Optional[str]]:
+    """resume_from/epoch handshake params: the last room seq the client saw and the log it came from"""
+    resume_from = websocket.query_params.get("resume_from")
+    try:
+        resume_from = int(resume_from) if resume_from is not None else None
+    except ValueError:
+        resume_from = None
+    return resume_from, websocket.query_params.get("epoch")
+
+
+def _mark_unread_as_seen(db: Session, user_id: int, username: str, avatar_url: Optional[str], friend_id: int) -> Optional[dict]:
+    """Mark everything the friend sent us as read; returns one messages_read frame, or None if nothing was unread"""
+    # Ask the rows themselves: the maintained counter can lag behind them, and a stale 0 would skip the marking
+    if not has_unread_from(db, user_id, friend_id):
+        return None
+    read_at, marked = bulk_mark_as_read(db, user_id, sender_id=friend_id)
+    if not marked:
+        return None
+    return messages_read_frame(user_id, username, avatar_url, [message_id for message_id, _ in marked], read_at)
+
+
+def _create_private_message_frame(
+    db: Session,
+    sender_id: int,
+    sender_username: str,
+    friend_id: int,
+    content: str,
+    message_type: str,
+    reply_to_id: Optional[int],
+    voice_duration: Optional[float],
+    file_size: Optional[int],
+) -> Optional[dict]:
+    """Store a private message and build the frame broadcast to both users"""
+    msg = create_private_message(
+        db=db,
+        sender_id=sender_id,
+        receiver_id=friend_id,
+        content=content.strip() if message_type == "text" else content,
+        reply_to_id=reply_to_id,
+        message_type=message_type,
+        voice_duration=voice_duration,
+        file_size=file_size
+    )
+
+    # ✅ RELOAD WITH ALL RELATIONSHIPS
+    full_msg = db.query(PrivateMessage).options(
+        joinedload(PrivateMessage.sender),
+        joinedload(PrivateMessage.receiver),
+        joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user)
+    ).filter(PrivateMessage.id == msg.id).first()
+
+    if not full_msg:
+        return None
+
+    # ✅ PREPARE RESPONSE DATA
+    message_data = {
+        "type": "message",
+        "id": full_msg.id,
+        "sender_id": full_msg.sender_id,
+        "sender_username": sender_username,
+        "receiver_id": full_msg.receiver_id,
+        "content": full_msg.content,
+        "message_type": full_msg.message_type,
+        "is_read": full_msg.is_read,
+        "read_at": full_msg.read_at,
+        "created_at": full_msg.created_at,
+        "reply_to_id": full_msg.reply_to_id,
+        "avatar_url": full_msg.sender.avatar_url,
+        "voice_duration": full_msg.voice_duration,
+        "file_size": full_msg.file_size,
+        "reply_preview": full_msg.reply_preview,
+        "seen_by": _seen_by(full_msg.seen_statuses)
+    }
+
+    return message_data
+
+
+def _delete_private_message(db: Session, message_id: int, user_id: int) -> bool:
+    """Delete a message the user sent; False when it does not exist or belongs to someone else"""
+    try:
+        # Get message and verify ownership
+        message = db.query(PrivateMessage).filter(
+            PrivateMessage.id == message_id,
+            PrivateMessage.sender_id == user_id
+        ).first()
+        if not message:
+            return False
+
+        remove_private_message(db, message)
+        db.commit()
+        return True
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _load_group_message(db: Session, message_id) -> Optional[GroupMessage]:
+    return db.query(GroupMessage).options(
+        joinedload(GroupMessage.sender)
+    ).filter(GroupMessage.id == message_id).first()
+
+
+def _edit_group_message(db: Session, message_id: int, content: str, user_id: int) -> datetime:
+    updated = update_message(db=db, message_id=message_id, content=content, current_user_id=user_id)
+    return updated.updated_at
+
+
+def _save_group_message(
+    db: Session,
+    group_id: int,
+    sender_id: int,
+    content: Optional[str],
+    message_type: str,
+    parent_message_id: Optional[int],
+) -> dict:
+    """Store a group message and build its broadcast frame (without the client's temp_id)"""
+    try:
+        msg = GroupMessage(
+            group_id=group_id,
+            sender_id=sender_id,
+            content=content,
+            message_type=message_type,
+            parent_message_id=parent_message_id
+        )
+        db.add(msg)
+        db.flush()
+        record_group_message(db, msg)
+        db.commit()
+        db.refresh(msg)
+    except Exception:
+        db.rollback()
+        raise
+
+    parent_msg_data = None
+    if msg.parent_message:
+        parent = msg.parent_message
+        parent_msg_data = {
+            "id": parent.id,
+            "content": parent.content,
+            "file_url": parent.file_url,
+            "voice_url": parent.voice_url,
+            "sender": {
+                "id": parent.sender.id,
+                "username": parent.sender.username,
+                "avatar_url": parent.sender.avatar_url
+            }
+        }
+
+    # Build message output
+    return {
+        "id": msg.id,
+        "sender": {
+            "id": msg.sender.id,
+            "username": msg.sender.username,
+            "avatar_url": msg.sender.avatar_url
+        },
+        "group_id": msg.group_id,
+        "content": msg.content,
+        "created_at": to_local_iso(msg.created_at, tz_offset_hours=7),
+        "file_url": msg.file_url,
+        "voice_url": msg.voice_url,
+        "parent_message": parent_msg_data
+    }
+
+
 @router.websocket("/private/{friend_id}")
 async def handle_websocket_private(
     websocket: WebSocket,
@@ -43,81 +224,29 @@ async def handle_websocket_private(
             await websocket.close(code=4001, reason="Authentication failed")
             return
 
+        # Commits in the DB pool expire the ORM instance, so keep plain values for the loop
+        user_id, username, avatar_url = current_user.id, current_user.username, current_user.avatar_url
+
         # ✅ VALIDATE FRIENDSHIP
-        if not is_friend(db, current_user.id, friend_id):
+        if not await run_db(is_friend, db, user_id, friend_id):
             await websocket.close(code=4003, reason="Not friends")
             return
         
         # ✅ MARK EXISTING UNREAD MESSAGES AS SEEN ON CONNECTION
-        unread_msgs = db.query(PrivateMessage).filter(
-            PrivateMessage.receiver_id == current_user.id,
-            PrivateMessage.sender_id == friend_id,
-            PrivateMessage.is_read == False
-        ).all()
-
-        seen_ids = []
-        for msg in unread_msgs:
-            # Mark message as read
-            msg.is_read = True
-            msg.read_at = datetime.utcnow()
-            
-            # Add seen status
-            existing_seen = db.query(MessageSeenStatus).filter(
-                MessageSeenStatus.message_id == msg.id,
-                MessageSeenStatus.user_id == current_user.id
-            ).first()
-            
-            if not existing_seen:
-                seen_status = MessageSeenStatus(
-                    message_id=msg.id,
-                    user_id=current_user.id,
-                    seen_at=datetime.utcnow()
-                )
-                db.add(seen_status)
-            
-            seen_ids.append(msg.id)
-
-        db.commit()
+        seen_frame = await run_db(_mark_unread_as_seen, db, user_id, username, avatar_url, friend_id)
         
-        chat_id = _chat_id(current_user.id, friend_id)
+        chat_id = _chat_id(user_id, friend_id)
         
         # ✅ BROADCAST SEEN STATUS FOR ALL MARKED MESSAGES
-        if seen_ids:
-            for msg_id in seen_ids:
-                # Get complete message with seen status
-                message = db.query(PrivateMessage).options(
-                    joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user)
-                ).filter(PrivateMessage.id == msg_id).first()
-                
-                if message:
-                    seen_by = []
-                    for status in message.seen_statuses:
-                        seen_by.append({
-                            "user_id": status.user.id,
-                            "username": status.user.username,
-                            "avatar_url": status.user.avatar_url,
-                            "seen_at": status.seen_at.isoformat() if status.seen_at else None
-                        })
-
-                    # ✅ FIX: Use consistent message_updated type for seen status
-                    await manager.broadcast(
-                        chat_id,
-                        {
-                            "type": "message_updated",
-                            "message_id": msg_id,
-                            "id": msg_id,
-                            "is_read": True,
-                            "read_at": datetime.utcnow().isoformat(),
-                            "seen_by": seen_by,
-                            "reader_id": current_user.id
-                        }
-                    )
-                    print(f"📢 Broadcast initial seen status for message {msg_id}")
+        if seen_frame:
+            await manager.broadcast(chat_id, seen_frame)
+            print(f"📢 Broadcast initial seen status for {len(seen_frame['message_ids'])} messages")
                     
         await websocket.accept()
         
         # ✅ CONNECT TO MANAGER (This calls websocket.accept() internally)
-        await manager.connect(chat_id, websocket, user_id=current_user.id)
+        resume_from, epoch = _resume_params(websocket)
+        await manager.connect(chat_id, websocket, user_id=user_id, resume_from=resume_from, epoch=epoch)
         
         # ✅ HEARTBEAT FUNCTION
         async def send_heartbeat():
@@ -125,13 +254,11 @@ async def handle_websocket_private(
             try:
                 while True:
                     await asyncio.sleep(25)  # Send every 25 seconds
-                    try:
-                        await websocket.send_json({
-                            "type": "ping",
-                            "timestamp": datetime.utcnow().isoformat()
-                        })
-                    except Exception:
-                        break  # Stop heartbeat if send fails
+                    if not manager.send_direct(chat_id, websocket, {
+                        "type": "ping",
+                        "timestamp": datetime.utcnow().isoformat()
+                    }):
+                        break  # Stop heartbeat once the socket is gone
             except asyncio.CancelledError:
                 pass
             except Exception:
@@ -164,13 +291,10 @@ async def handle_websocket_private(
                 try:
                     data = json.loads(raw_data) if raw_data.strip() else {}
                 except json.JSONDecodeError:
-                    try:
-                        await websocket.send_json({
-                            "type": "error",
-                            "error": "Invalid JSON format"
-                        })
-                    except Exception:
-                        pass  # Client may have disconnected
+                    manager.send_direct(chat_id, websocket, {
+                        "type": "error",
+                        "error": "Invalid JSON format"
+                    })
                     continue
 
                 # ✅ EXTRACT MESSAGE DATA
@@ -183,7 +307,7 @@ async def handle_websocket_private(
 
                 # ✅ VALIDATE REQUIRED FIELDS
                 if not msg_type:
-                    await websocket.send_json({
+                    manager.send_direct(chat_id, websocket, {
                         "type": "error", 
                         "error": "Message type is required"
                     })
@@ -197,7 +321,7 @@ async def handle_websocket_private(
                     if message_type == "voice":
                         # For voice messages, content should be a Cloudinary URL
                         if not content or not content.startswith(('http://', 'https://')):
-                            await websocket.send_json({
+                            manager.send_direct(chat_id, websocket, {
                                 "type": "error",
                                 "error": "Voice messages require a valid URL"
                             })
@@ -205,7 +329,7 @@ async def handle_websocket_private(
                     else:
                         # For text messages, validate content
                         if not content or not content.strip():
-                            await websocket.send_json({
+                            manager.send_direct(chat_id, websocket, {
                                 "type": "error",
                                 "error": "Message content cannot be empty"
                             })
@@ -214,15 +338,15 @@ async def handle_websocket_private(
                     # ✅ VALIDATE REPLY MESSAGE
                     if reply_to_id:
                         try:
-                            replied_message = validate_reply_message(db, reply_to_id, current_user.id, friend_id)
+                            replied_message = await run_db(validate_reply_message, db, reply_to_id, user_id, friend_id)
                             if not replied_message:
-                                await websocket.send_json({
+                                manager.send_direct(chat_id, websocket, {
                                     "type": "error",
                                     "error": "Replied message not found"
                                 })
                                 continue
                         except HTTPException as e:
-                            await websocket.send_json({
+                            manager.send_direct(chat_id, websocket, {
                                 "type": "error", 
                                 "error": e.detail
                             })
@@ -230,116 +354,33 @@ async def handle_websocket_private(
 
                     try:
                         # Create message in DB
-                        msg = create_private_message(
-                            db=db,
-                            sender_id=current_user.id,
-                            receiver_id=friend_id,
-                            content=content.strip() if message_type == "text" else content,
-                            reply_to_id=reply_to_id,
-                            message_type=message_type,
-                            voice_duration=voice_duration,
-                            file_size=file_size
+                        message_data = await run_db(
+                            _create_private_message_frame,
+                            db,
+                            user_id,
+                            username,
+                            friend_id,
+                            content,
+                            message_type,
+                            reply_to_id,
+                            voice_duration,
+                            file_size
                         )
 
-                        # ✅ RELOAD WITH ALL RELATIONSHIPS
-                        full_msg = db.query(PrivateMessage).options(
-                            joinedload(PrivateMessage.sender),
-                            joinedload(PrivateMessage.receiver),
-                            joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user),
-                            joinedload(PrivateMessage.reply_to).joinedload(PrivateMessage.sender),
-                            joinedload(PrivateMessage.reply_to).joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user)
-                        ).filter(PrivateMessage.id == msg.id).first()
-
-                        if not full_msg:
-                            await websocket.send_json({
+                        if not message_data:
+                            manager.send_direct(chat_id, websocket, {
                                 "type": "error", 
                                 "error": "Failed to create message"
                             })
                             continue
 
-                        # ✅ PREPARE SEEN_BY INFORMATION
-                        seen_by = []
-                        if full_msg.seen_statuses:
-                            for status in full_msg.seen_statuses:
-                                seen_by.append({
-                                    "user_id": status.user.id,
-                                    "username": status.user.username,
-                                    "avatar_url": status.user.avatar_url,
-                                    "seen_at": status.seen_at.isoformat() if status.seen_at else None
-                                })
-
-                        # ✅ PREPARE RESPONSE DATA
-                        message_data = {
-                            "type": "message",
-                            "id": full_msg.id,
-                            "sender_id": full_msg.sender_id,
-                            "sender_username": current_user.username,
-                            "receiver_id": full_msg.receiver_id,
-                            "content": full_msg.content,
-                            "message_type": full_msg.message_type.value,
-                            "is_read": full_msg.is_read,
-                            "read_at": full_msg.read_at.isoformat() if full_msg.read_at else None,
-                            "created_at": full_msg.created_at.isoformat(),
-                            "reply_to_id": full_msg.reply_to_id,
-                            "avatar_url": full_msg.sender.avatar_url,
-                            "voice_duration": full_msg.voice_duration,
-                            "file_size": full_msg.file_size,
-                            "seen_by": seen_by
-                        }
-
-                        # ✅ ADD REPLY_TO DATA IF EXISTS
-                        if full_msg.reply_to:
-                            # Create compact reply preview (like Telegram)
-                            reply_content = full_msg.reply_to.content or ""
-                            if full_msg.reply_to.message_type == MessageType.voice:
-                                reply_content = "🎤 Voice message"
-                            elif full_msg.reply_to.message_type == MessageType.image:
-                                reply_content = "🖼️ Photo"
-                            elif full_msg.reply_to.message_type == MessageType.file:
-                                reply_content = "📎 File"
-                            elif len(reply_content) > 100:
-                                reply_content = reply_content[:100] + "..."
-                            
-                            # Add compact reply preview
-                            message_data["reply_preview"] = {
-                                "id": full_msg.reply_to.id,
-                                "sender_username": full_msg.reply_to.sender.username,
-                                "content": reply_content,
-                                "message_type": full_msg.reply_to.message_type.value,
-                                "voice_duration": full_msg.reply_to.voice_duration,
-                                "file_size": full_msg.reply_to.file_size
-                            }
-                            reply_seen_by = []
-                            if hasattr(full_msg.reply_to, 'seen_statuses') and full_msg.reply_to.seen_statuses:
-                                for status in full_msg.reply_to.seen_statuses:
-                                    reply_seen_by.append({
-                                        "user_id": status.user.id,
-                                        "username": status.user.username,
-                                        "avatar_url": status.user.avatar_url,
-                                        "seen_at": status.seen_at.isoformat() if status.seen_at else None
-                                    })
-                            
-                            message_data["reply_to"] = {
-                                "id": full_msg.reply_to.id,
-                                "sender_id": full_msg.reply_to.sender_id,
-                                "content": full_msg.reply_to.content,
-                                "message_type": full_msg.reply_to.message_type.value,
-                                "sender_username": full_msg.reply_to.sender.username,
-                                "voice_duration": full_msg.reply_to.voice_duration,
-                                "created_at": full_msg.reply_to.created_at.isoformat(),
-                                "file_size": full_msg.reply_to.file_size,
-                                "is_read": full_msg.reply_to.is_read,
-                                "read_at": full_msg.reply_to.read_at.isoformat() if full_msg.reply_to.read_at else None,
-                                "seen_by": reply_seen_by
-                            }
-
                         # ✅ BROADCAST TO BOTH USERS
                         await manager.broadcast(chat_id, message_data)
-                        print(f"📢 Broadcast new message {full_msg.id} with reply: {full_msg.reply_to_id}")
+                        print(f"📢 Broadcast new message {message_data['id']} with reply: {message_data['reply_to_id']}")
 
                     except Exception as e:
                         print(f"Error sending message: {e}")
-                        await websocket.send_json({
+                        manager.send_direct(chat_id, websocket, {
                             "type": "error",
                             "error": "Failed to send message"
                         })
@@ -348,59 +389,14 @@ async def handle_websocket_private(
                 elif msg_type == "read":
                     message_id = data.get("message_id")
                     if not message_id:
-                        await websocket.send_json({
+                        manager.send_direct(chat_id, websocket, {
                             "type": "error",
                             "error": "Message ID is required for read receipt"
                         })
                         continue
 
-                    try:
-                        # Mark message as read in database
-                        success = mark_message_as_read(db, message_id, current_user.id)
-                        
-                        if success:
-                            # Get the updated message with complete seen status
-                            updated_message = db.query(PrivateMessage).options(
-                                joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user)
-                            ).filter(PrivateMessage.id == message_id).first()
-                            
-                            if updated_message:
-                                # Prepare complete seen_by information
-                                seen_by = []
-                                for status in updated_message.seen_statuses:
-                                    seen_by.append({
-                                        "user_id": status.user.id,
-                                        "username": status.user.username,
-                                        "avatar_url": status.user.avatar_url,
-                                        "seen_at": status.seen_at.isoformat() if status.seen_at else None
-                                    })
-
-                                # ✅ FIX: Use message_updated type for consistency with frontend
-                                broadcast_data = {
-                                    "type": "message_updated",  # Changed from "read_receipt"
-                                    "message_id": message_id,
-                                    "id": message_id,
-                                    "is_read": True,
-                                    "read_at": datetime.utcnow().isoformat(),
-                                    "seen_by": seen_by,
-                                    "reader_id": current_user.id
-                                }
-                                
-                                await manager.broadcast(chat_id, broadcast_data)
-                                print(f"📢 REAL-TIME SEEN: Broadcast seen status for message {message_id} by user {current_user.id}")
-                                
-                        else:
-                            await websocket.send_json({
-                                "type": "error",
-                                "error": "Failed to mark message as read"
-                            })
-                            
-                    except Exception as e:
-                        print(f"Error processing read receipt: {e}")
-                        await websocket.send_json({
-                            "type": "error",
-                            "error": "Failed to process read receipt"
-                        })
+                    # Written and broadcast (as one messages_read frame) with the rest of the batch
+                    receipt_buffer.add_private(chat_id, user_id, username, avatar_url, int(message_id))
 
                 # ✅ TYPING INDICATORS
                 elif msg_type == "typing":
@@ -409,8 +405,8 @@ async def handle_websocket_private(
                         await manager.broadcast(chat_id, {
                             "type": "typing",
                             "is_typing": is_typing,
-                            "user_id": current_user.id,
-                            "username": current_user.username
+                            "user_id": user_id,
+                            "username": username
                         })
                     except Exception as e:
                         print(f"Error broadcasting typing: {e}")
@@ -419,52 +415,36 @@ async def handle_websocket_private(
                 elif msg_type == "delete":
                     message_id = data.get("message_id")
                     if not message_id:
-                        await websocket.send_json({
+                        manager.send_direct(chat_id, websocket, {
                             "type": "error",
                             "error": "Message ID is required for deletion"
                         })
                         continue
 
                     try:
-                        # Get message and verify ownership
-                        message = db.query(PrivateMessage).filter(
-                            PrivateMessage.id == message_id,
-                            PrivateMessage.sender_id == current_user.id
-                        ).first()
-                        
-                        if message:
-                            # Delete seen statuses first
-                            db.query(MessageSeenStatus).filter(
-                                MessageSeenStatus.message_id == message_id
-                            ).delete()
-                            
-                            # Delete message
-                            db.delete(message)
-                            db.commit()
-                            
+                        if await run_db(_delete_private_message, db, message_id, user_id):
                             # Broadcast deletion
                             await manager.broadcast(chat_id, {
                                 "type": "message_deleted",
                                 "message_id": message_id,
-                                "deleted_by": current_user.id,
-                                "deleted_at": datetime.utcnow().isoformat()
+                                "deleted_by": user_id,
+                                "deleted_at": datetime.utcnow()
                             })
                         else:
-                            await websocket.send_json({
+                            manager.send_direct(chat_id, websocket, {
                                 "type": "error",
                                 "error": "Message not found or not authorized to delete"
                             })
                     except Exception as e:
-                        db.rollback()
                         print(f"Error deleting message: {e}")
-                        await websocket.send_json({
+                        manager.send_direct(chat_id, websocket, {
                             "type": "error",
                             "error": "Failed to delete message"
                         })
 
                 # ✅ UNKNOWN MESSAGE TYPE
                 else:
-                    await websocket.send_json({
+                    manager.send_direct(chat_id, websocket, {
                         "type": "error",
                         "error": f"Unknown message type: {msg_type}"
                     })
@@ -479,12 +459,10 @@ async def handle_websocket_private(
                 
             except Exception as e:
                 print(f"WebSocket error: {e}")
-                try:
-                    await websocket.send_json({
-                        "type": "error",
-                        "error": "Internal server error"
-                    })
-                except Exception:
+                if not manager.send_direct(chat_id, websocket, {
+                    "type": "error",
+                    "error": "Internal server error"
+                }):
                     break  # Client disconnected
 
     except WebSocketDisconnect:
@@ -505,9 +483,51 @@ async def handle_websocket_private(
 
         # ✅ DISCONNECT FROM MANAGER
         if current_user:
-            chat_id = _chat_id(current_user.id, friend_id)
-            manager.disconnect(chat_id, websocket, user_id=current_user.id)
+            chat_id = _chat_id(user_id, friend_id)
+            await manager.disconnect(chat_id, websocket, user_id=user_id)
+            await receipt_buffer.flush(chat_id)
             
+@router.websocket("/inbox")
+async def websocket_inbox(websocket: WebSocket):
+    """
+    Per-user socket for badge counts: unread_counts on connect, then an unread_changed
+    frame whenever one of the user's counters moves
+    """
+    await websocket.accept()
+
+    chat_id = user_id = None
+    try:
+        # The session is only needed to authenticate and count, not for the life of the socket
+        with get_session() as db:
+            current_user = await get_current_user_ws(websocket, db)
+            if not current_user:
+                await websocket.close(code=4001, reason="Please login to use chat")
+                return
+
+            user_id = current_user.id
+            chat_id = inbox_room(user_id)
+            # Listen before counting, so a change made in between still arrives as unread_changed
+            await manager.attach(chat_id, websocket, user_id)
+            counts = await run_db(get_unread_counts, db, [user_id])
+
+        manager.send_direct(chat_id, websocket, unread_counts_frame(user_id, counts[user_id]))
+
+        while True:
+            data = await websocket.receive_json()
+            if data.get("type") == "ping":
+                manager.send_direct(chat_id, websocket, {"type": "pong"})
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        traceback.print_exc()
+        print(f"[WS Error] {e}")
+        await websocket.close(code=1011, reason="Server error")
+    finally:
+        if chat_id:
+            await manager.disconnect(chat_id, websocket, user_id=user_id)
+
+
 @router.websocket("/group/{group_id}")
 async def websocket_group_chat(
     websocket: WebSocket,
@@ -522,12 +542,14 @@ async def websocket_group_chat(
             await websocket.close(code=4001, reason="Please login to use chat")
             return
 
-        if not is_group_member(db, group_id, current_user.id):
+        user_id = current_user.id
+        if not await run_db(is_group_member, db, group_id, user_id):
             await websocket.close(code=4003, reason="Not a member of this group")
             return
 
         chat_id = f"group_{group_id}"
-        await manager.connect(chat_id, websocket, user_id=current_user.id)
+        resume_from, epoch = _resume_params(websocket)
+        await manager.connect(chat_id, websocket, user_id=user_id, resume_from=resume_from, epoch=epoch)
 
         try:
             while True:
@@ -541,8 +563,8 @@ async def websocket_group_chat(
                 sdp = data.get("sdp")
                 
                 if action == "online_users":
-                    online_user_ids = list(manager.get_online_users(chat_id))
-                    await websocket.send_json({
+                    online_user_ids = list(await manager.get_online_users(chat_id))
+                    manager.send_direct(chat_id, websocket, {
                         "action": "online_users",
                         "user_ids": online_user_ids
                     })
@@ -550,43 +572,8 @@ async def websocket_group_chat(
                 if action == "seen":
                     message_id = int(data.get("message_id"))
 
-                    msg = db.query(GroupMessage).filter(
-                        GroupMessage.id == message_id,
-                        GroupMessage.group_id == group_id
-                    ).first()
-                    if not msg:
-                        continue
-
-                    seen_record = db.query(GroupMessageSeen).filter_by(
-                        message_id=message_id,
-                        user_id=current_user.id
-                    ).first()
-
-                    now = datetime.utcnow()
-
-                    if not seen_record:
-                        seen_record = GroupMessageSeen(
-                            message_id=message_id,
-                            user_id=current_user.id,
-                            seen=True,
-                            seen_at=to_local_iso(now, tz_offset_hours=7),
-                        )
-                        db.add(seen_record)
-                        db.commit()
-                    else:
-                        if seen_record.seen:
-                            continue
-
-                        seen_record.seen = True
-                        seen_record.seen_at = to_local_iso(now, tz_offset_hours=7)
-                        db.commit()
-
-                    await manager.broadcast(chat_id, {
-                        "action": "seen",
-                        "message_id": message_id,
-                        "user_id": current_user.id,
-                        "seen_at": to_local_iso(now, tz_offset_hours=7)
-                    })
+                    # Buffered; the "seen" broadcast goes out when the batch is written
+                    receipt_buffer.add_group(chat_id, group_id, user_id, message_id)
                     continue
 
                 if action == "forward_to_groups":
@@ -597,12 +584,10 @@ async def websocket_group_chat(
                     if not target_group_ids:
                         continue
                     
-                    await handle_forward_message(
-                        db,
-                        current_user_id=current_user.id,
-                        message_id=message_id,
-                        target_group_ids=target_group_ids
-                    )
+                    try:
+                        await run_db(handle_forward_message, db, user_id, message_id, target_group_ids)
+                    except HTTPException as e:
+                        manager.send_direct(chat_id, websocket, {"error": e.detail, "message_id": message_id})
                     continue
 
                 if action == "edit":
@@ -610,25 +595,24 @@ async def websocket_group_chat(
                     new_content = data.get("new_content")
                     now = datetime.utcnow()
 
-                    updated = update_message(
-                        db=db,
-                        message_id=message_id,
-                        content=new_content,
-                        current_user_id=current_user.id,
-                    )
+                    updated_at = await run_db(_edit_group_message, db, message_id, new_content, user_id)
 
                     await manager.broadcast(chat_id, {
                         "action": "edit",
                         "message_id": message_id,
                         "new_content": new_content,
-                        "updated_at": to_local_iso(updated.updated_at, tz_offset_hours=7)
+                        "updated_at": to_local_iso(updated_at, tz_offset_hours=7)
                     })
                     continue
                 
                 if action == "delete":
                     message_id = int(data.get("message_id"))
-                    await delete_message(db, message_id, current_user.id)
-                    
+                    try:
+                        await run_db(delete_message, db, message_id, user_id)
+                    except HTTPException as e:
+                        manager.send_direct(chat_id, websocket, {"error": e.detail, "message_id": message_id})
+                        continue
+
                     await manager.broadcast(chat_id, {
                         "action": "delete",
                         "message_id": message_id
@@ -639,7 +623,7 @@ async def websocket_group_chat(
                     file_url = data.get("file_url")
                     message_id = data.get("message_id")
                     
-                    msg = db.query(GroupMessage).filter(GroupMessage.id == message_id).first()
+                    msg = await run_db(_load_group_message, db, message_id)
                     if not msg:
                         continue
                     
@@ -661,7 +645,7 @@ async def websocket_group_chat(
                     message_id = data.get("message_id")
                     file_url = data.get("file_url")
                     
-                    msg = db.query(GroupMessage).filter(GroupMessage.id == message_id).first()
+                    msg = await run_db(_load_group_message, db, message_id)
                     if not msg:
                         continue
 
@@ -679,7 +663,7 @@ async def websocket_group_chat(
                     message_id = data.get("message_id")
                     message_type = data.get("message_type", "voice")
                     
-                    msg = db.query(GroupMessage).filter(GroupMessage.id == message_id).first()
+                    msg = await run_db(_load_group_message, db, message_id)
                     if not msg:
                         continue
                     
@@ -701,21 +685,21 @@ async def websocket_group_chat(
                 if action == "call_join":
                     await manager.broadcast(chat_id,{
                         "action": "call_join",
-                        "user_id": current_user.id
+                        "user_id": user_id
                     }, exclude={websocket})
                     continue
                 
                 if action == "call_leave":
                     await manager.broadcast(chat_id,{
                         "action": "call_leave",
-                        "user_id": current_user.id
+                        "user_id": user_id
                     })
                     continue
                 
                 if action == "call_offer":
                     await manager.send_to_user(chat_id, to_user, {
                         "action": "call_offer",
-                        "from_user": current_user.id,
+                        "from_user": user_id,
                         "sdp": sdp
                     })
                     continue
@@ -723,7 +707,7 @@ async def websocket_group_chat(
                 if action == "call_answer":
                     await manager.send_to_user(chat_id, to_user, {
                         "action": "call_answer",
-                        "from_user": current_user.id,
+                        "from_user": user_id,
                         "sdp": sdp
                     })
                     continue
@@ -731,79 +715,45 @@ async def websocket_group_chat(
                 if action == "call_ice":
                     await manager.send_to_user(chat_id, to_user, {
                         "action": "call_ice",
-                        "from_user": current_user.id,
+                        "from_user": user_id,
                         "candidate": data["candidate"]
                     })
                     continue
                 
                 try:
-                    msg = GroupMessage(
-                        group_id=group_id,
-                        sender_id=current_user.id,
-                        content=content,
-                        message_type=message_type,
-                        parent_message_id=parent_message_id
+                    msg_out = await run_db(
+                        _save_group_message, db, group_id, user_id, content, message_type, parent_message_id
                     )
-                    db.add(msg)
-                    db.commit()
-                    db.refresh(msg)
                 except Exception as e:
-                    db.rollback()
                     print(f"[DB Error] {e}")
-                    await websocket.send_json({
+                    manager.send_direct(chat_id, websocket, {
                         "error": "Failed to save message",
                         "temp_id": incoming_temp_id
                     })
                     continue
 
-                parent_msg_data = None
-                if msg.parent_message:
-                    parent = msg.parent_message
-                    parent_msg_data = {
-                        "id": parent.id,
-                        "content": parent.content,
-                        "file_url": parent.file_url,
-                        "voice_url": parent.voice_url,
-                        "sender": {
-                            "id": parent.sender.id,
-                            "username": parent.sender.username,
-                            "avatar_url": parent.sender.avatar_url
-                        }
-                    }
-
-                # Build message output
-                msg_out = {
-                    "id": msg.id,
-                    "temp_id": incoming_temp_id,
-                    "sender": {
-                        "id": msg.sender.id,
-                        "username": msg.sender.username,
-                        "avatar_url": msg.sender.avatar_url
-                    },
-                    "group_id": msg.group_id,
-                    "content": msg.content,
-                    "created_at": to_local_iso(msg.created_at, tz_offset_hours=7),
-                    "file_url": msg.file_url,
-                    "voice_url": msg.voice_url,
-                    "parent_message": parent_msg_data
-                }
+                msg_out["temp_id"] = incoming_temp_id
 
                 try:
                     await manager.broadcast(chat_id, msg_out)
                 except Exception as e:
                     print(f"[Broadcast Error] Group {group_id}: {e}")
-                    await websocket.send_json({
+                    manager.send_direct(chat_id, websocket, {
                         "error": "Failed to broadcast message",
                         "temp_id": incoming_temp_id
                     })
                     continue
 
         except WebSocketDisconnect:
-            manager.disconnect(chat_id, websocket, user_id=current_user.id)
+            pass
         except Exception as e:
             traceback.print_exc()
             print(f"[WS Error] {e}")
             await websocket.close(code=1011, reason="Server error")
+        finally:
+            # Every exit path leaves the room, not only a clean client disconnect
+            await manager.disconnect(chat_id, websocket, user_id=user_id)
+            await receipt_buffer.flush(chat_id)
 
     except Exception as e:
         traceback.print_exc()
@@ -27,16 +27,32 @@ def configure_cloudinary():
 # Call configuration
 configure_cloudinary()
 
-def upload_to_cloudinary(file_content, public_id=None, folder=None, resource_type="image"):
+# Cloudinary's smallest chunk; file objects bigger than this are uploaded chunk by chunk
+LARGE_UPLOAD_CHUNK_SIZE = 6 * 1024 * 1024
+
+def upload_file(file_content, **options):
+    """
+    Upload bytes, a URL or a file object. uploader.upload reads a file object whole,
+    so big ones go through upload_large, which never holds more than one chunk.
+    """
+    if hasattr(file_content, "read"):
+        file_content.seek(0, os.SEEK_END)
+        size = file_content.tell()
+        file_content.seek(0)
+        if size > LARGE_UPLOAD_CHUNK_SIZE:
+            return uploader.upload_large(file_content, chunk_size=LARGE_UPLOAD_CHUNK_SIZE, **options)
+    return uploader.upload(file_content, **options)
+
+def upload_to_cloudinary(file_content, public_id=None, folder=None, resource_type="image", transform=True):
     """
-    Upload file to Cloudinary with support for different resource types
+    Upload file to Cloudinary with support for different resource types.
+    Pass transform=False for images that were already resized locally.
     """
     try:
         # Use consistent folder handling
         base_folder = os.getenv('CLOUDINARY_UPLOAD_FOLDER', 'whisper_space')
         
         upload_kwargs = {
-            "file": file_content,
             "public_id": public_id,
             "folder": f"{base_folder}/{folder}" if folder else base_folder,
             "overwrite": True,
@@ -44,19 +60,19 @@ def upload_to_cloudinary(file_content, public_id=None, folder=None, resource_typ
         }
         
         # Only apply image transformations for images
-        if resource_type == "image":
+        if resource_type == "image" and transform:
             upload_kwargs["transformation"] = [
                 {"width": 400, "height": 400, "crop": "fill"},
                 {"quality": "auto"},
                 {"format": "auto"}
             ]
         
-        upload_result = uploader.upload(**upload_kwargs)
+        upload_result = upload_file(file_content, **upload_kwargs)
         return upload_result
     except Exception as e:
         raise Exception(f"Cloudinary upload failed: {str(e)}")
     
-def upload_voice_message(file_content: bytes, public_id: str = None, folder: str = "voice_messages"):
+def upload_voice_message(file_content, public_id: str = None, folder: str = "voice_messages"):
     """
     FIXED: Consistent folder handling
     """
@@ -69,7 +85,7 @@ def upload_voice_message(file_content: bytes, public_id: str = None, folder: str
 
         print(f"📤 Uploading voice → {full_folder}/{public_id}")
 
-        upload_result = uploader.upload(
+        upload_result = upload_file(
             file_content,
             resource_type="video",  # Use "video" for audio files
             public_id=public_id,
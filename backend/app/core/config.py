@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -26,6 +27,76 @@ class Settings(BaseSettings):
     CLOUDINARY_API_SECRET: str
     CLOUDINARY_UPLOAD_FOLDER: str = "whisper_space"
 
+    # Uploads are size-checked in chunks of this many bytes
+    UPLOAD_CHUNK_SIZE: int = 64 * 1024
+
+    # Avatars and covers are validated and resized to IMAGE_VARIANT_SIZE squares in worker processes
+    IMAGE_WORKERS: int = 2
+    IMAGE_VARIANT_SIZE: int = 400
+    IMAGE_FORMAT: str = "webp"  # webp | jpeg
+    IMAGE_QUALITY: int = 80
+    IMAGE_MAX_PIXELS: int = 40_000_000
+
+    # Cloudinary calls: concurrent calls, timeout per attempt, retries after the first attempt
+    STORAGE_WORKERS: int = 8
+    STORAGE_TIMEOUT_SECONDS: float = 30.0
+    STORAGE_RETRIES: int = 2
+    STORAGE_RETRY_BACKOFF_MS: int = 200
+
+    # Outbox of remote objects to destroy: poll interval, objects per Cloudinary call, retries
+    MEDIA_DELETE_INTERVAL_SECONDS: int = 10
+    MEDIA_DELETE_BATCH_SIZE: int = 100
+    MEDIA_DELETE_MAX_ATTEMPTS: int = 8
+    MEDIA_DELETE_RETRY_SECONDS: int = 60
+    # Uploads no message has claimed after this long are destroyed
+    MEDIA_UNCLAIMED_TTL_SECONDS: int = 3600
+
+    # Frames queued by REST handlers are broadcast in batches; polling only picks up leftovers
+    REALTIME_OUTBOX_BATCH_SIZE: int = 200
+    REALTIME_OUTBOX_POLL_SECONDS: float = 2.0
+
+    # WebSocket fan-out
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"  # drop_oldest | coalesce | disconnect
+    # Recent frames kept per room (and rooms kept) for replaying to sockets that reconnect with resume_from.
+    # Replay is per worker: a socket resuming on a different worker than it left gets resync_required
+    WS_REPLAY_BUFFER_SIZE: int = 200
+    WS_REPLAY_ROOMS: int = 2000
+
+    # Read/seen receipts are buffered this long per chat and written in one batch
+    RECEIPT_FLUSH_MS: int = 150
+
+    # Authenticated users cached by id so get_current_user can skip the users SELECT
+    PRINCIPAL_CACHE_SIZE: int = 4096
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+
+    # Recently verified access tokens (digest -> user id, exp); entries never outlive the token
+    TOKEN_CACHE_SIZE: int = 8192
+    TOKEN_CACHE_TTL_SECONDS: int = 300
+
+    # Per-user friend/blocked/pending sets behind is_friend and friends
+    FRIEND_CACHE_SIZE: int = 10000
+    FRIEND_CACHE_TTL_SECONDS: int = 300
+
+    # Unread counters are recomputed from the message tables this often (0 disables)
+    UNREAD_RECONCILE_SECONDS: int = 900
+
+    # Sync events older than this are pruned; clients further behind get reset=true
+    CHAT_EVENT_RETENTION_DAYS: int = 14
+
+    # Group -> member ids and user -> group ids behind every membership check
+    MEMBERSHIP_CACHE_SIZE: int = 10000
+    MEMBERSHIP_CACHE_TTL_SECONDS: int = 300
+
+    # Pub/sub backplane; leave REDIS_URL unset to keep rooms in-process
+    REDIS_URL: Optional[str] = None
+    BROKER_CHANNEL_PREFIX: str = "whisper:"
+    # Each worker's presence expires this long after its last heartbeat (sent every third of it)
+    BROKER_PRESENCE_TTL_SECONDS: int = 30
+
+    # Shared secret for the /api/v1/health/db, /storage and /caches diagnostics (X-Health-Token); unset disables them
+    HEALTH_TOKEN: Optional[str] = None
+
     class Config:
         env_file = ".env"
 
@@ -1,18 +1,51 @@
-from sqlalchemy import create_engine
+from typing import AsyncIterator, List
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
 from app.core.config import settings
 
+# Connections one worker may hold: 30, split between the sync pool (sync routes and run_db)
+# and the async one, which only the routes moved to AsyncSession use
+POOL_SIZE = 10
+MAX_OVERFLOW = 15
+ASYNC_POOL_SIZE = 2
+ASYNC_MAX_OVERFLOW = 3
+
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
     pool_timeout=30,
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_database_url(url: str):
+    """Same database as DATABASE_URL, through asyncpg (which spells sslmode as ssl)"""
+    url = make_url(url).set(drivername="postgresql+asyncpg")
+    query = dict(url.query)
+    sslmode = query.pop("sslmode", None)
+    if sslmode:
+        query["ssl"] = sslmode
+    return url.set(query=query)
+
+
+# Async engine for routes that have moved to AsyncSession; it has its own pool
+async_engine = create_async_engine(
+    _async_database_url(settings.DATABASE_URL),
+    pool_pre_ping=True,
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=ASYNC_MAX_OVERFLOW,
+    pool_timeout=30,
+)
+
+# expire_on_commit=False: lazy refreshes can't run implicitly under asyncio
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 def get_db() -> Session:
     db = SessionLocal()
     try:
@@ -20,6 +53,68 @@ def get_db() -> Session:
     finally:
         db.close()
 
+def _delete_duplicates(conn, index) -> int:
+    """Keep one row (the first physically) per value of a unique index's columns so the index can be built"""
+    table = index.table.name
+    matches = " AND ".join(f'a."{column.name}" = b."{column.name}"' for column in index.columns)
+    result = conn.execute(text(f'DELETE FROM "{table}" a USING "{table}" b WHERE a.ctid > b.ctid AND {matches}'))
+    return result.rowcount
+
+def ensure_indexes(metadata) -> None:
+    """
+    create_all() skips tables that already exist, so add indexes declared on them afterwards.
+    A unique index marked info={"dedupe": True} is built after the duplicates it would reject
+    are deleted, in the same transaction; any index that still can't be created stops startup.
+    """
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                with engine.begin() as conn:
+                    if index.unique and index.info.get("dedupe"):
+                        removed = _delete_duplicates(conn, index)
+                        if removed:
+                            print(f"[DB] Deleted {removed} duplicate rows from {table.name} before creating {index.name}")
+                    index.create(bind=conn, checkfirst=True)
+            except Exception as e:
+                raise RuntimeError(f"Could not create index {index.name} on {table.name}") from e
+
+def ensure_columns(metadata) -> None:
+    """create_all() doesn't alter existing tables either, so add nullable columns declared since"""
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}'))
+            except Exception as e:
+                print(f"[DB] Could not add column {table.name}.{column.name}: {e}")
+
+def missing_schema(metadata) -> List[str]:
+    """Tables, nullable columns and indexes declared in the models that migrate would still create"""
+    inspector = inspect(engine)
+    missing = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.nullable and column.name not in columns]
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing += [index.name for index in table.indexes if index.name not in indexes]
+    return missing
+
 @contextmanager
 def get_session():
     db = SessionLocal()
@@ -27,3 +122,7 @@ def get_session():
         yield db
     finally:
         db.close()
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
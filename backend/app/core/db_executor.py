@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from app.core.database import MAX_OVERFLOW, POOL_SIZE
+
+# One thread per pooled connection: more threads would only queue on pool_timeout
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE + MAX_OVERFLOW, thread_name_prefix="db")
+
+SLOW_OPERATION_MS = 250
+
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(name: str, exec_ms: float, total_ms: float) -> None:
+    with _stats_lock:
+        entry = _stats.setdefault(name, {"count": 0, "exec_ms_total": 0.0, "wait_ms_total": 0.0, "exec_ms_max": 0.0})
+        entry["count"] += 1
+        entry["exec_ms_total"] += exec_ms
+        entry["wait_ms_total"] += max(total_ms - exec_ms, 0.0)
+        entry["exec_ms_max"] = max(entry["exec_ms_max"], exec_ms)
+
+    if exec_ms > SLOW_OPERATION_MS:
+        print(f"[DB] Slow operation {name}: {exec_ms:.1f}ms")
+
+
+async def run_db(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking SQLAlchemy call on the DB thread pool so the event loop keeps serving sockets.
+    A Session may hop between pool threads, but never pass the same one to concurrent calls.
+    """
+    name = getattr(fn, "__name__", repr(fn))
+    timing = {}
+
+    def timed():
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timing["exec_ms"] = (time.perf_counter() - started) * 1000
+
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, timed)
+    finally:
+        total_ms = (time.perf_counter() - submitted) * 1000
+        _record(name, timing.get("exec_ms", total_ms), total_ms)
+
+
+def get_db_stats() -> Dict[str, Dict[str, float]]:
+    """Per-operation counters: calls, average/max execution time and average time spent queued"""
+    with _stats_lock:
+        return {
+            name: {
+                "count": int(entry["count"]),
+                "avg_exec_ms": round(entry["exec_ms_total"] / entry["count"], 2),
+                "max_exec_ms": round(entry["exec_ms_max"], 2),
+                "avg_wait_ms": round(entry["wait_ms_total"] / entry["count"], 2),
+            }
+            for name, entry in _stats.items()
+        }
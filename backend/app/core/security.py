@@ -1,18 +1,90 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, WebSocket, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 from app.core.config import settings
 from app.core.database import get_db
+from app.core.db_executor import run_db
+from app.helpers.cache import TTLCache
 from app.models.user import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# user id -> column values of the User row. Per process: other workers see changes once the TTL runs out
+principal_cache = TTLCache(
+    "principals",
+    max_size=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+)
+
+def invalidate_principal(user_id: int) -> None:
+    """Call after changing a user's row so the next request reads it fresh"""
+    principal_cache.invalidate(user_id)
+
+# sha256(token) -> (user_id, exp) for access tokens whose signature already checked out
+token_cache = TTLCache(
+    "tokens",
+    max_size=settings.TOKEN_CACHE_SIZE,
+    ttl=settings.TOKEN_CACHE_TTL_SECONDS,
+)
+
+def evict_user_tokens(user_id: int) -> None:
+    """
+    Forget the cached access tokens of one user, e.g. on logout. This only affects this worker's
+    cache, and needs nothing more: the cache merely skips re-checking signatures, so an access
+    token stays valid on every worker until it expires either way (they are short-lived JWTs).
+    """
+    token_cache.invalidate_where(lambda entry: entry[0] == user_id)
+
+def _access_token_user_id(token: str) -> Optional[int]:
+    """User id of a valid access token, or None. Repeat tokens skip the signature check until they expire."""
+    digest = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+
+    cached = token_cache.get(digest)
+    if cached is not None:
+        user_id, exp = cached
+        if exp > now:
+            return user_id
+        token_cache.invalidate(digest)
+        return None
+
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        return None
+
+    if payload.get("sub") is None or payload.get("type") != "access":
+        return None
+    try:
+        user_id = int(payload["sub"])
+    except (ValueError, TypeError):
+        return None
+
+    exp = payload.get("exp")
+    if exp:
+        token_cache.set(digest, (user_id, exp), ttl=min(settings.TOKEN_CACHE_TTL_SECONDS, exp - now))
+    return user_id
+
+def _cache_principal(user: User) -> None:
+    principal_cache.set(user.id, {attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs})
+
+def _cached_principal(db: Session, user_id: int) -> Optional[User]:
+    values = principal_cache.get(user_id)
+    if values is None:
+        return None
+    # Rebuild a clean instance and attach it to this session without a SELECT
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
@@ -47,28 +119,21 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        user_id: str = payload.get("sub")
-        token_type: str = payload.get("type")
-        
-        if user_id is None or token_type != "access":
-            raise credentials_exception
-            
-    except JWTError:
-        raise credentials_exception
-    
-    try:
-        user_id_int = int(user_id)
-    except (ValueError, TypeError):
+    user_id_int = _access_token_user_id(token)
+    if user_id_int is None:
         raise credentials_exception
         
+    user = _cached_principal(db, user_id_int)
+    if user is not None:
+        return user
+
     from app.crud.user import get_by_id
     user = get_by_id(db, user_id_int)
     
     if user is None:
         raise credentials_exception
-        
+
+    _cache_principal(user)
     return user
 
 async def get_current_user_ws(websocket: WebSocket, db: Session):
@@ -77,4 +142,4 @@ async def get_current_user_ws(websocket: WebSocket, db: Session):
         await websocket.close(code=4401, reason="Missing or invalid token")
         return None
     # token = token.split(" ")[1]
-    return get_current_user(token=token, db=db)
\ No newline at end of file
+    return await run_db(get_current_user, token=token, db=db)
\ No newline at end of file
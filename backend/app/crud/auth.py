@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 import random
 from app.core.config import settings
 from app.models.refresh_token import RefreshToken
+from app.core.security import evict_user_tokens
 
 
 def store_refresh_token(db: Session, user_id: int, token: str):
@@ -22,8 +23,11 @@ def get_valid_refresh_token(db: Session, token: str) -> RefreshToken | None:
 
 
 def revoke_refresh_token(db: Session, token: str):
+    user_ids = {user_id for (user_id,) in db.query(RefreshToken.user_id).filter(RefreshToken.token == token)}
     db.query(RefreshToken).filter(RefreshToken.token == token).delete()
     db.commit()
+    for user_id in user_ids:
+        evict_user_tokens(user_id)
 
 
 def create_verification_code(db: Session, user_id: int, code: str = None):
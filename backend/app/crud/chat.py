@@ -1,10 +1,13 @@
 from datetime import datetime, timezone
-from sqlalchemy.orm import Session
+from sqlalchemy import String, case, cast, exists, func, select, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased, noload, selectinload
 from app.models.private_message import MessageType, PrivateMessage
-from app.models.group_message import GroupMessage
+from app.models.group_message import GroupMessage, MessageType as GroupMessageType
 from app.models.group_message_reply import GroupMessageReply
 from app.models.group_member import GroupMember
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime, timezone
 from fastapi import HTTPException,status
 from app.models.user_message_status import UserMessageStatus
@@ -15,7 +18,69 @@ from app.schemas.chat import MessageCreate
 
 from app.models.user_message_status import UserMessageStatus
 from app.models.message_seen_status import MessageSeenStatus
-from app.utils.chat_helpers import validate_reply_message
+from app.models.user import User
+from app.utils.chat_helpers import (
+    REPLY_PREVIEW_LABELS,
+    REPLY_PREVIEW_LENGTH,
+    build_reply_preview,
+    extract_public_id_from_url,
+    validate_reply_message,
+    validate_reply_message_async,
+)
+from app.crud.media import RESOURCE_TYPES, claim_message_media, drop_media
+from app.crud.conversation import private_message_statements, private_read_statements, record_group_message, record_message_edit, record_private_delete
+
+
+def _reply_preview(replied_message: Optional[PrivateMessage]) -> Optional[dict]:
+    if replied_message is None:
+        return None
+    return build_reply_preview(replied_message, getattr(replied_message.sender, "username", None))
+
+
+def reply_previews_statement(message_id: int, preview: Optional[dict]):
+    """
+    Rewrite the preview stored on every reply to message_id: the new preview after an edit,
+    None before it is deleted. Must run before the delete, which nulls reply_to_id.
+    """
+    return (
+        update(PrivateMessage)
+        .where(PrivateMessage.reply_to_id == message_id)
+        # Keep updated_at: the replies themselves weren't edited
+        .values(reply_preview=preview, updated_at=PrivateMessage.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def backfill_reply_previews(db: Session) -> None:
+    """Compute the preview of replies stored without one, in SQL so it's one statement however many there are"""
+    reply = aliased(PrivateMessage)
+    content = case(
+        *[(reply.message_type == message_type, label) for message_type, label in REPLY_PREVIEW_LABELS.items()],
+        (
+            func.char_length(reply.content) > REPLY_PREVIEW_LENGTH,
+            func.concat(func.substr(reply.content, 1, REPLY_PREVIEW_LENGTH), "...")
+        ),
+        else_=func.coalesce(reply.content, "")
+    )
+    preview = func.jsonb_build_object(
+        "id", reply.id,
+        "sender_username", func.coalesce(User.username, "Unknown"),
+        "content", content,
+        "message_type", func.coalesce(cast(reply.message_type, String), MessageType.text.value),
+        "voice_duration", reply.voice_duration,
+        "file_size", reply.file_size
+    )
+    db.execute(
+        update(PrivateMessage)
+        .where(
+            PrivateMessage.reply_to_id == reply.id,
+            reply.sender_id == User.id,
+            PrivateMessage.reply_preview.is_(None)
+        )
+        .values(reply_preview=preview, updated_at=PrivateMessage.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
 
 
 def create_private_message(
@@ -28,10 +93,12 @@ def create_private_message(
     is_forwarded: bool = False,
     original_sender: Optional[str] = None,
     voice_duration: Optional[float] = None,
-    file_size: Optional[int] = None
+    file_size: Optional[int] = None,
+    commit: bool = True
 ) -> PrivateMessage:
     """
-    Create a private message with proper type handling and reply validation
+    Create a private message with proper type handling and reply validation.
+    With commit=False the caller commits, e.g. after queueing the broadcast in the same transaction.
     """
     try:
         # Validate reply message if provided
@@ -52,6 +119,7 @@ def create_private_message(
             content=content,
             message_type=msg_type_enum,
             reply_to_id=reply_to_id,
+            reply_preview=_reply_preview(replied_message),
             is_forwarded=is_forwarded,
             original_sender=original_sender,
             voice_duration=voice_duration if msg_type_enum == MessageType.voice else None,
@@ -61,15 +129,19 @@ def create_private_message(
             is_read=False
         )
         db.add(msg)
-        db.commit()
-        db.refresh(msg)
+        db.flush()
+        for stmt in private_message_statements(db, msg):
+            db.execute(stmt)
+        claim_message_media(db, msg)
+        if commit:
+            db.commit()
+            db.refresh(msg)
         
-        # FIXED: Eager load relationships including reply_to sender
+        # The reply preview is stored on the row, so the replied message needn't be loaded again
         msg = db.query(PrivateMessage).options(
             joinedload(PrivateMessage.sender),
             joinedload(PrivateMessage.receiver),
-            joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user),
-            joinedload(PrivateMessage.reply_to).joinedload(PrivateMessage.sender)  # Load sender of replied message
+            joinedload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user)
         ).filter(PrivateMessage.id == msg.id).first()
         
         return msg
@@ -83,6 +155,76 @@ def create_private_message(
         )
 
 
+async def create_private_message_async(
+    db: AsyncSession,
+    sender_id: int,
+    receiver_id: int,
+    content: str,
+    message_type: str = "text",
+    reply_to_id: Optional[int] = None,
+    is_forwarded: bool = False,
+    original_sender: Optional[str] = None,
+    voice_duration: Optional[float] = None,
+    file_size: Optional[int] = None
+) -> PrivateMessage:
+    """
+    Async counterpart of create_private_message, returning the message with the same relationships loaded
+    """
+    try:
+        replied_message = None
+        if reply_to_id:
+            replied_message = await validate_reply_message_async(db, reply_to_id, sender_id, receiver_id)
+
+        try:
+            msg_type_enum = MessageType(message_type)
+        except ValueError:
+            msg_type_enum = MessageType.text
+
+        now = datetime.now(timezone.utc)
+        msg = PrivateMessage(
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            content=content,
+            message_type=msg_type_enum,
+            reply_to_id=reply_to_id,
+            reply_preview=_reply_preview(replied_message),
+            is_forwarded=is_forwarded,
+            original_sender=original_sender,
+            voice_duration=voice_duration if msg_type_enum == MessageType.voice else None,
+            file_size=file_size if msg_type_enum in [MessageType.voice, MessageType.file] else None,
+            created_at=now,
+            delivered_at=now,
+            is_read=False
+        )
+        db.add(msg)
+        await db.flush()
+        for stmt in private_message_statements(db, msg):
+            await db.execute(stmt)
+        await db.run_sync(claim_message_media, msg)
+        await db.commit()
+
+        # Nothing may lazy-load under asyncio, so fetch every relationship callers touch up front
+        result = await db.execute(
+            select(PrivateMessage)
+            .options(
+                selectinload(PrivateMessage.sender),
+                selectinload(PrivateMessage.receiver),
+                selectinload(PrivateMessage.seen_statuses).selectinload(MessageSeenStatus.user)
+            )
+            .where(PrivateMessage.id == msg.id)
+            .execution_options(populate_existing=True)
+        )
+        return result.scalars().one()
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create message: {str(e)}"
+        )
+
+
 def get_private_messages(db: Session, user_id: int, friend_id: int, limit: int = 50, offset: int = 0) -> List[PrivateMessage]:
     """Get private messages between two users"""
     return db.query(PrivateMessage).options(
@@ -94,6 +236,137 @@ def get_private_messages(db: Session, user_id: int, friend_id: int, limit: int =
         ((PrivateMessage.sender_id == friend_id) & (PrivateMessage.receiver_id == user_id))
     ).order_by(PrivateMessage.created_at.desc()).offset(offset).limit(limit).all()
 
+def get_private_chat_page(
+    db: Session,
+    user_id: int,
+    friend_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = 50
+) -> List[PrivateMessage]:
+    """
+    One page of a conversation, oldest first, keyed on (created_at, id).
+    No cursor returns the latest `limit` messages; before_id/after_id page older/newer from a message.
+    """
+    cursor_id = before_id or after_id
+    cursor = None
+    if cursor_id:
+        cursor = db.query(PrivateMessage.created_at, PrivateMessage.id).filter(
+            PrivateMessage.id == cursor_id,
+            ((PrivateMessage.sender_id == user_id) & (PrivateMessage.receiver_id == friend_id)) |
+            ((PrivateMessage.sender_id == friend_id) & (PrivateMessage.receiver_id == user_id))
+        ).first()
+        if not cursor:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cursor message not found")
+
+    newer = after_id is not None and before_id is None
+    key = tuple_(PrivateMessage.created_at, PrivateMessage.id)
+
+    # One index range scan per direction of the pair instead of an OR the planner can't walk in order
+    branches = []
+    for sender_id, receiver_id in ((user_id, friend_id), (friend_id, user_id)):
+        branch = select(PrivateMessage.id, PrivateMessage.created_at).where(
+            PrivateMessage.sender_id == sender_id,
+            PrivateMessage.receiver_id == receiver_id
+        )
+        if cursor:
+            branch = branch.where(key > tuple(cursor) if newer else key < tuple(cursor))
+        if newer:
+            branch = branch.order_by(PrivateMessage.created_at.asc(), PrivateMessage.id.asc())
+        else:
+            branch = branch.order_by(PrivateMessage.created_at.desc(), PrivateMessage.id.desc())
+        branches.append(branch.limit(limit).subquery().select())
+
+    page = union_all(*branches).subquery()
+    page_order = (page.c.created_at.asc(), page.c.id.asc()) if newer else (page.c.created_at.desc(), page.c.id.desc())
+    page_ids = db.execute(select(page.c.id).order_by(*page_order).limit(limit)).scalars().all()
+    if not page_ids:
+        return []
+
+    return db.query(PrivateMessage).options(
+        joinedload(PrivateMessage.sender),
+        joinedload(PrivateMessage.receiver),
+        selectinload(PrivateMessage.seen_statuses).joinedload(MessageSeenStatus.user),
+    ).filter(
+        PrivateMessage.id.in_(page_ids)
+    ).order_by(PrivateMessage.created_at.asc(), PrivateMessage.id.asc()).all()
+
+def _mark_read_statement(user_id: int, message_ids: Optional[List[int]], sender_id: Optional[int], read_at: datetime):
+    stmt = update(PrivateMessage).where(
+        PrivateMessage.receiver_id == user_id,  # Only receiver can mark as read
+        PrivateMessage.is_read == False
+    )
+    if message_ids is not None:
+        stmt = stmt.where(PrivateMessage.id.in_(message_ids))
+    if sender_id is not None:
+        stmt = stmt.where(PrivateMessage.sender_id == sender_id)
+    return (
+        stmt.values(is_read=True, read_at=read_at)
+        .returning(PrivateMessage.id, PrivateMessage.sender_id)
+        .execution_options(synchronize_session=False)
+    )
+
+def has_unread_from(db: Session, user_id: int, sender_id: int) -> bool:
+    """Whether sender_id sent user_id anything still unread; probes ix_private_messages_unread"""
+    return db.query(exists().where(
+        PrivateMessage.receiver_id == user_id,
+        PrivateMessage.sender_id == sender_id,
+        PrivateMessage.is_read == False
+    )).scalar()
+
+def _seen_status_statement(message_ids: List[int], user_id: int, seen_at: datetime):
+    return pg_insert(MessageSeenStatus).values([
+        {"message_id": message_id, "user_id": user_id, "seen_at": seen_at}
+        for message_id in message_ids
+    ]).on_conflict_do_nothing(index_elements=["message_id", "user_id"])
+
+def bulk_mark_as_read(
+    db: Session,
+    user_id: int,
+    message_ids: Optional[List[int]] = None,
+    sender_id: Optional[int] = None,
+    commit: bool = True
+) -> Tuple[datetime, List[Tuple[int, int]]]:
+    """
+    Mark unread messages addressed to user_id as read in two statements, whatever the count.
+    Scope with message_ids, sender_id (a whole conversation), or both; commit=False leaves the commit to the caller.
+    Returns the read time and the (message_id, sender_id) pairs that were actually unread.
+    """
+    current_time = datetime.now(timezone.utc)
+    try:
+        rows = [tuple(row) for row in db.execute(_mark_read_statement(user_id, message_ids, sender_id, current_time))]
+        if rows:
+            db.execute(_seen_status_statement([message_id for message_id, _ in rows], user_id, current_time))
+            for stmt in private_read_statements(db, user_id, rows, current_time):
+                db.execute(stmt)
+        if commit:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return current_time, rows
+
+async def bulk_mark_as_read_async(
+    db: AsyncSession,
+    user_id: int,
+    message_ids: Optional[List[int]] = None,
+    sender_id: Optional[int] = None
+) -> Tuple[datetime, List[Tuple[int, int]]]:
+    """Async counterpart of bulk_mark_as_read"""
+    current_time = datetime.now(timezone.utc)
+    try:
+        result = await db.execute(_mark_read_statement(user_id, message_ids, sender_id, current_time))
+        rows = [tuple(row) for row in result]
+        if rows:
+            await db.execute(_seen_status_statement([message_id for message_id, _ in rows], user_id, current_time))
+            for stmt in private_read_statements(db, user_id, rows, current_time):
+                await db.execute(stmt)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return current_time, rows
+
 # ADD THIS FUNCTION - Mark messages as read
 def mark_messages_as_read(db: Session, message_ids: List[int], user_id: int) -> int:
     """
@@ -102,45 +375,28 @@ def mark_messages_as_read(db: Session, message_ids: List[int], user_id: int) ->
     try:
         if not message_ids:
             return 0
-            
-        # Get messages that belong to this user and are unread
-        messages = db.query(PrivateMessage).filter(
-            PrivateMessage.id.in_(message_ids),
-            PrivateMessage.receiver_id == user_id,  # Only receiver can mark as read
-            PrivateMessage.is_read == False
-        ).all()
+
+        _, marked = bulk_mark_as_read(db, user_id, message_ids=message_ids)
+        return len(marked)
         
-        if not messages:
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to mark messages as read: {str(e)}"
+        )
+
+async def mark_messages_as_read_async(db: AsyncSession, message_ids: List[int], user_id: int) -> int:
+    """
+    Async counterpart of mark_messages_as_read
+    """
+    try:
+        if not message_ids:
             return 0
-        
-        marked_count = 0
-        current_time = datetime.now(timezone.utc)
-        
-        for message in messages:
-            # Update message read status
-            message.is_read = True
-            message.read_at = current_time
-            
-            # Add seen status entry if not exists
-            existing_seen = db.query(MessageSeenStatus).filter(
-                MessageSeenStatus.message_id == message.id,
-                MessageSeenStatus.user_id == user_id
-            ).first()
-            
-            if not existing_seen:
-                seen_status = MessageSeenStatus(
-                    message_id=message.id,
-                    user_id=user_id,
-                    seen_at=current_time
-                )
-                db.add(seen_status)
-                marked_count += 1
-        
-        db.commit()
-        return marked_count
-        
+
+        _, marked = await bulk_mark_as_read_async(db, user_id, message_ids=message_ids)
+        return len(marked)
+
     except Exception as e:
-        db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to mark messages as read: {str(e)}"
@@ -163,23 +419,28 @@ def create_group_message(
     sender_id: int, 
     group_id: int, 
     content: str, 
-    message_type: MessageType = MessageType.text
+    message_type: str = GroupMessageType.text.value,
+    commit: bool = True
 ) -> GroupMessage:
-    
+    """With commit=False the caller commits, e.g. after queueing the broadcast in the same transaction"""
     msg = GroupMessage(
         sender_id=sender_id, 
         group_id=group_id, 
         content=content, 
-        message_type= message_type,
+        message_type=GroupMessageType(message_type),
         created_at=datetime.utcnow()
     )
     try:
         db.add(msg)
-        db.commit()
-        db.refresh(msg)
+        db.flush()
+        record_group_message(db, msg)
+        if commit:
+            db.commit()
+            db.refresh(msg)
         
-    except Exception as e:
+    except Exception:
         db.rollback()
+        raise
     
     return msg
 
@@ -197,9 +458,61 @@ def get_group_messages(db: Session, group_id: int, limit=50, offset=0):
         .limit(limit)
         .all()
     )
+
+async def get_group_messages_async(db: AsyncSession, group_id: int, limit=50, offset=0) -> List[GroupMessage]:
+    # Loads everything GroupMessageOut reads, since an AsyncSession can't lazy-load during serialization
+    result = await db.execute(
+        select(GroupMessage)
+        .where(GroupMessage.group_id == group_id)
+        .options(
+            selectinload(GroupMessage.sender),
+            selectinload(GroupMessage.forwarded_by),
+            noload(GroupMessage.seen_by),  # derived from read watermarks by the caller
+            selectinload(GroupMessage.replies).selectinload(GroupMessageReply.sender),
+            selectinload(GroupMessage.parent_message).selectinload(GroupMessage.sender)
+        )
+        .order_by(GroupMessage.created_at.desc())
+        .offset(offset)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+async def get_group_messages_page_async(
+    db: AsyncSession,
+    group_id: int,
+    before: Optional[Tuple[datetime, int]] = None,
+    limit: int = 50
+) -> Tuple[List[GroupMessage], Optional[Tuple[datetime, int]]]:
+    """
+    Newest-first page of a group's history strictly older than `before` (created_at, id).
+    Returns the page and the position to pass as `before` next, or None on the last page.
+    """
+    stmt = select(GroupMessage).where(GroupMessage.group_id == group_id)
+    if before:
+        stmt = stmt.where(tuple_(GroupMessage.created_at, GroupMessage.id) < tuple_(*before))
+
+    # Fetch one extra row to know whether another page exists
+    result = await db.execute(
+        stmt.options(
+            selectinload(GroupMessage.sender),
+            selectinload(GroupMessage.forwarded_by),
+            noload(GroupMessage.seen_by),  # derived from read watermarks by the caller
+            selectinload(GroupMessage.replies).selectinload(GroupMessageReply.sender),
+            selectinload(GroupMessage.parent_message).selectinload(GroupMessage.sender)
+        )
+        .order_by(GroupMessage.created_at.desc(), GroupMessage.id.desc())
+        .limit(limit + 1)
+    )
+    messages = list(result.scalars().all())
+
+    next_position = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_position = (messages[-1].created_at, messages[-1].id)
+    return messages, next_position
         
-def edit_private_message(db: Session, message_id: int, user_id: int, new_content: str) -> PrivateMessage:
-    """Edit a private message"""
+def edit_private_message(db: Session, message_id: int, user_id: int, new_content: str, commit: bool = True) -> PrivateMessage:
+    """Edit a private message; with commit=False the change is only flushed"""
     try:
         if not new_content or not new_content.strip():
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Message content cannot be empty.")
@@ -225,9 +538,14 @@ def edit_private_message(db: Session, message_id: int, user_id: int, new_content
         # Update message
         msg.content = new_content.strip()
         msg.updated_at = datetime.now(timezone.utc)
+        record_message_edit(db, msg)
+        db.execute(reply_previews_statement(msg.id, _reply_preview(msg)))
         
-        db.commit()
-        db.refresh(msg)
+        if commit:
+            db.commit()
+            db.refresh(msg)
+        else:
+            db.flush()
         
         return msg
         
@@ -254,6 +572,26 @@ def delete_message_for_user(db: Session, message_id: int, user_id: int):
     db.merge(status)
     db.commit()
     
+def remove_private_message(db: Session, msg: PrivateMessage) -> None:
+    """
+    Delete msg inside the caller's transaction along with what hangs off it: its media reference,
+    the previews on its replies, its seen statuses, and the inbox rows, unread counter and sync event
+    (record_private_delete). Every private delete path goes through here; the caller commits.
+    """
+    resource_type = RESOURCE_TYPES.get(msg.message_type)
+    if resource_type is not None:
+        # Forwards may share the object; only the last reference queues it for deletion
+        drop_media(db, extract_public_id_from_url(msg.content), resource_type)
+
+    # Delete seen statuses first
+    for seen_status in msg.seen_statuses:
+        db.delete(seen_status)
+
+    db.execute(reply_previews_statement(msg.id, None))
+    db.delete(msg)
+    db.flush()
+    record_private_delete(db, msg)
+
 def delete_message_forever(db: Session, message_id: int, user_id: int) -> dict:
     """Permanently delete a message (sender only)"""
     msg = db.query(PrivateMessage).options(
@@ -270,14 +608,7 @@ def delete_message_forever(db: Session, message_id: int, user_id: int) -> dict:
         )
 
     receiver_id = msg.receiver_id
-
-    # Delete seen statuses first
-    if msg.seen_statuses:
-        for seen_status in msg.seen_statuses:
-            db.delete(seen_status)
-
-    # Then delete the message
-    db.delete(msg)
+    remove_private_message(db, msg)
     db.commit()
 
     return {"message_id": message_id, "receiver_id": receiver_id}
@@ -285,31 +616,8 @@ def delete_message_forever(db: Session, message_id: int, user_id: int) -> dict:
 def mark_message_as_read(db: Session, message_id: int, user_id: int) -> bool:
     """Mark a private message as read by the receiver and create seen status"""
     try:
-        message = db.query(PrivateMessage).filter(
-            PrivateMessage.id == message_id,
-            PrivateMessage.receiver_id == user_id  # Only receiver can mark as read
-        ).first()
-        
-        if message and not message.is_read:
-            current_time = datetime.now(timezone.utc)
-            message.is_read = True
-            message.read_at = current_time
-            
-            # Create seen status entry if not exists
-            existing_seen = db.query(MessageSeenStatus).filter(
-                MessageSeenStatus.message_id == message_id,
-                MessageSeenStatus.user_id == user_id
-            ).first()
-            
-            if not existing_seen:
-                seen_status = MessageSeenStatus(
-                    message_id=message_id,
-                    user_id=user_id,
-                    seen_at=current_time
-                )
-                db.add(seen_status)
-            
-            db.commit()
+        _, marked = bulk_mark_as_read(db, user_id, message_ids=[message_id])
+        if marked:
             print(f"[DB] Message {message_id} marked as read by user {user_id}")
             return True
         return False
@@ -0,0 +1,186 @@
+# app/crud/chat_event.py
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import DateTime, Integer, String, insert, literal, select
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.orm import Session
+from app.models.chat_event import ChatEvent
+from app.models.group_event import GroupEvent
+from app.models.group_event_seq import GroupEventSeq
+from app.models.group_message import GroupMessage
+from app.models.private_message import PrivateMessage
+from app.models.user_event_seq import UserEventSeq
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _type(message_type) -> Optional[str]:
+    return getattr(message_type, "value", message_type)
+
+
+def private_message_payload(msg: PrivateMessage) -> dict:
+    return {
+        "id": msg.id,
+        "sender_id": msg.sender_id,
+        "receiver_id": msg.receiver_id,
+        "content": msg.content,
+        "message_type": _type(msg.message_type),
+        "reply_to_id": msg.reply_to_id,
+        "is_forwarded": msg.is_forwarded,
+        "original_sender": msg.original_sender,
+        "voice_duration": msg.voice_duration,
+        "file_size": msg.file_size,
+        "created_at": _iso(msg.created_at),
+    }
+
+
+def group_message_payload(msg: GroupMessage) -> dict:
+    return {
+        "id": msg.id,
+        "group_id": msg.group_id,
+        "sender_id": msg.sender_id,
+        "forwarded_by_id": msg.forwarded_by_id,
+        "content": msg.content,
+        "message_type": _type(msg.message_type),
+        "file_url": msg.file_url,
+        "voice_url": msg.voice_url,
+        "parent_message_id": msg.parent_message_id,
+        "created_at": _iso(msg.created_at),
+    }
+
+
+def edited_payload(msg) -> dict:
+    return {"id": msg.id, "content": msg.content, "updated_at": _iso(msg.updated_at)}
+
+
+def event_statement(user_ids: Iterable[int], kind: str, chat_id: str, payload: dict, message_id: Optional[int] = None):
+    """
+    Append one event to each user's sequence in a single statement: bump every user's head,
+    then insert an event row per returned (user_id, seq). Heads are locked in user id order.
+    """
+    now = datetime.now(timezone.utc)
+    heads = (
+        pg_insert(UserEventSeq)
+        .values([{"user_id": user_id, "seq": 1} for user_id in sorted(set(user_ids))])
+        .on_conflict_do_update(index_elements=[UserEventSeq.user_id], set_={"seq": UserEventSeq.seq + 1})
+        .returning(UserEventSeq.user_id, UserEventSeq.seq)
+        .cte("heads")
+    )
+    source = select(
+        heads.c.user_id,
+        heads.c.seq,
+        literal(kind, String),
+        literal(chat_id, String),
+        literal(message_id, Integer),
+        literal(payload, JSONB),
+        literal(now, DateTime(timezone=True)),
+    )
+    return (
+        insert(ChatEvent)
+        .from_select(["user_id", "seq", "kind", "chat_id", "message_id", "payload", "created_at"], source)
+        .add_cte(heads)
+    )
+
+
+def group_event_statement(group_id: int, kind: str, payload: dict, message_id: Optional[int] = None):
+    """
+    Append one event to the group's sequence: bump the group's head, then insert the row with
+    the new seq. Members read it from the group's sequence, so nothing is written per member.
+    """
+    now = datetime.now(timezone.utc)
+    head = (
+        pg_insert(GroupEventSeq)
+        .values(group_id=group_id, seq=1)
+        .on_conflict_do_update(index_elements=[GroupEventSeq.group_id], set_={"seq": GroupEventSeq.seq + 1})
+        .returning(GroupEventSeq.seq)
+        .cte("head")
+    )
+    source = select(
+        literal(group_id, Integer),
+        head.c.seq,
+        literal(kind, String),
+        literal(message_id, Integer),
+        literal(payload, JSONB),
+        literal(now, DateTime(timezone=True)),
+    )
+    return (
+        insert(GroupEvent)
+        .from_select(["group_id", "seq", "kind", "message_id", "payload", "created_at"], source)
+        .add_cte(head)
+    )
+
+
+EventPage = Tuple[list, int, bool, bool]
+
+
+def _page(query, seq_column, head: int, since: Optional[int], limit: int) -> EventPage:
+    """Events of one sequence after `since`; see get_events_since for the returned tuple"""
+    if since is None or since == head:
+        return [], head, False, False
+    if since > head:
+        return [], head, False, True
+
+    events = query.filter(seq_column > since).order_by(seq_column.asc()).limit(limit).all()
+
+    # Sequences have no gaps, so a missing successor means it was pruned
+    if not events or events[0].seq != since + 1:
+        return [], head, False, True
+    cursor = events[-1].seq
+    return events, cursor, cursor < head, False
+
+
+def get_events_since(
+    db: Session,
+    user_id: int,
+    since: Optional[int],
+    limit: int = 500
+) -> EventPage:
+    """
+    Events after seq `since`, oldest first, at most `limit`.
+    Returns (events, cursor, has_more, reset): cursor is the seq to pass next time; reset means
+    events after `since` were already pruned, so the client has to reload its chats.
+    No `since` just returns the current head to start from.
+    """
+    head = db.query(UserEventSeq.seq).filter(UserEventSeq.user_id == user_id).scalar() or 0
+    query = db.query(ChatEvent).filter(ChatEvent.user_id == user_id)
+    return _page(query, ChatEvent.seq, head, since, limit)
+
+
+def get_group_events_since(
+    db: Session,
+    group_ids: Iterable[int],
+    cursors: Dict[int, int],
+    limit: int = 500
+) -> Dict[int, EventPage]:
+    """
+    get_events_since for each group's own sequence, from cursors[group_id]; groups without
+    a cursor just get their head. Heads come from one query and only groups that moved are read.
+    """
+    group_ids = sorted(set(group_ids))
+    if not group_ids:
+        return {}
+    heads = dict(db.query(GroupEventSeq.group_id, GroupEventSeq.seq).filter(GroupEventSeq.group_id.in_(group_ids)).all())
+    return {
+        group_id: _page(
+            db.query(GroupEvent).filter(GroupEvent.group_id == group_id), GroupEvent.seq,
+            heads.get(group_id, 0), cursors.get(group_id), limit
+        )
+        for group_id in group_ids
+    }
+
+
+def prune_chat_events(db: Session, older_than: datetime) -> int:
+    try:
+        deleted = db.query(ChatEvent).filter(
+            ChatEvent.created_at < older_than
+        ).delete(synchronize_session=False)
+        deleted += db.query(GroupEvent).filter(
+            GroupEvent.created_at < older_than
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return deleted
@@ -0,0 +1,360 @@
+# app/crud/conversation.py
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import case, func, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload
+from app.models.conversation import Conversation
+from app.models.group_message import GroupMessage
+from app.models.group_read_watermark import GroupReadWatermark
+from app.models.private_message import PrivateMessage
+from app.services.group_membership import get_member_ids
+from app.crud.chat_event import edited_payload, event_statement, group_event_statement, group_message_payload, private_message_payload
+from app.utils.chat_helpers import _chat_id
+
+PREVIEW_LENGTH = 200
+
+# Columns describing the latest message; only ever overwritten by a newer message
+_LAST_COLUMNS = ("last_message_id", "last_sender_id", "last_message_type", "last_message_preview", "last_message_at")
+
+# Session.info key collecting (user_id, peer_id, group_id) counters touched by the open transaction
+UNREAD_CHANGED = "unread_changed"
+
+
+def _unread_changed(db, user_id: int, peer_id: Optional[int] = None, group_id: Optional[int] = None) -> None:
+    db.info.setdefault(UNREAD_CHANGED, set()).add((user_id, peer_id, group_id))
+
+
+def _last_message_values(msg) -> dict:
+    """last_* columns for a PrivateMessage or GroupMessage, or all None when the chat is empty"""
+    if msg is None:
+        return {column: None for column in _LAST_COLUMNS}
+    message_type = getattr(msg.message_type, "value", msg.message_type) or "text"
+    return {
+        "last_message_id": msg.id,
+        "last_sender_id": msg.sender_id,
+        "last_message_type": message_type,
+        # Media messages carry a URL as content; clients render a label from the type instead
+        "last_message_preview": (msg.content or "")[:PREVIEW_LENGTH] if message_type == "text" else None,
+        "last_message_at": msg.created_at,
+    }
+
+
+def _upsert(rows: List[dict], key):
+    stmt = pg_insert(Conversation).values(rows)
+    newer = stmt.excluded.last_message_id > func.coalesce(Conversation.last_message_id, 0)
+    set_ = {
+        column: case((newer, stmt.excluded[column]), else_=getattr(Conversation, column))
+        for column in _LAST_COLUMNS
+    }
+    set_["unread_count"] = Conversation.unread_count + stmt.excluded.unread_count
+    set_["updated_at"] = stmt.excluded.updated_at
+    return stmt.on_conflict_do_update(index_elements=[Conversation.user_id, key], set_=set_)
+
+
+def _group_unread_statement(group_id: Optional[int] = None, user_ids: Optional[Iterable[int]] = None):
+    """Recount group unread from each member's read watermark: one group, or every group row when None"""
+    # Nested two levels deep, so the watermark lookup has to be told to correlate to the updated row
+    watermark = select(GroupReadWatermark.last_read_message_id).where(
+        GroupReadWatermark.group_id == Conversation.group_id,
+        GroupReadWatermark.user_id == Conversation.user_id
+    ).correlate(Conversation).scalar_subquery()
+    unread = select(func.count(GroupMessage.id)).where(
+        GroupMessage.group_id == Conversation.group_id,
+        GroupMessage.sender_id != Conversation.user_id,
+        GroupMessage.id > func.coalesce(watermark, 0)
+    ).correlate(Conversation).scalar_subquery()
+
+    stmt = update(Conversation).where(Conversation.group_id.isnot(None), Conversation.unread_count != unread)
+    if group_id is not None:
+        stmt = stmt.where(Conversation.group_id == group_id)
+    if user_ids is not None:
+        stmt = stmt.where(Conversation.user_id.in_(list(user_ids)))
+    return stmt.values(unread_count=unread).execution_options(synchronize_session=False)
+
+
+def _private_unread_statement():
+    """Recount every private row from private_messages.is_read"""
+    unread = select(func.count(PrivateMessage.id)).where(
+        PrivateMessage.sender_id == Conversation.peer_id,
+        PrivateMessage.receiver_id == Conversation.user_id,
+        PrivateMessage.is_read == False
+    ).scalar_subquery()
+    return (
+        update(Conversation)
+        .where(Conversation.peer_id.isnot(None), Conversation.unread_count != unread)
+        .values(unread_count=unread)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Write hooks: each runs inside the caller's transaction, before its commit
+
+def _participants(msg) -> Iterable[int]:
+    return {msg.sender_id, msg.receiver_id} if isinstance(msg, PrivateMessage) else ()
+
+
+def _private_decrement(reader_id: int, sender_id: int, count: int):
+    return (
+        update(Conversation)
+        .where(Conversation.user_id == reader_id, Conversation.peer_id == sender_id)
+        .values(unread_count=func.greatest(Conversation.unread_count - count, 0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def private_message_statements(db, msg: PrivateMessage) -> list:
+    """Upsert for both sides of a new private message (the receiver gains one unread), plus its sync event"""
+    if msg.receiver_id != msg.sender_id:
+        _unread_changed(db, msg.receiver_id, peer_id=msg.sender_id)
+    now = datetime.now(timezone.utc)
+    last = _last_message_values(msg)
+    rows = [{"user_id": msg.sender_id, "peer_id": msg.receiver_id, "unread_count": 0, "updated_at": now, **last}]
+    if msg.receiver_id != msg.sender_id:
+        rows.append({"user_id": msg.receiver_id, "peer_id": msg.sender_id, "unread_count": 1, "updated_at": now, **last})
+    return [
+        _upsert(rows, Conversation.peer_id),
+        event_statement(
+            _participants(msg), "message_created", _chat_id(msg.sender_id, msg.receiver_id),
+            private_message_payload(msg), message_id=msg.id
+        ),
+    ]
+
+
+def record_group_message(db: Session, msg: GroupMessage) -> None:
+    member_ids = get_member_ids(db, msg.group_id)
+    if not member_ids:
+        return
+    now = datetime.now(timezone.utc)
+    last = _last_message_values(msg)
+    rows = [
+        {
+            "user_id": member_id,
+            "group_id": msg.group_id,
+            "unread_count": 0 if member_id == msg.sender_id else 1,
+            "updated_at": now,
+            **last,
+        }
+        for member_id in member_ids
+    ]
+    db.execute(_upsert(rows, Conversation.group_id))
+    db.execute(group_event_statement(msg.group_id, "message_created", group_message_payload(msg), message_id=msg.id))
+    for member_id in member_ids - {msg.sender_id}:
+        _unread_changed(db, member_id, group_id=msg.group_id)
+
+
+def private_read_statements(db, reader_id: int, marked: List[Tuple[int, int]], read_at: datetime) -> list:
+    """Decrements and sync events for the (message_id, sender_id) pairs bulk_mark_as_read just flipped to read"""
+    by_sender = {}
+    for message_id, sender_id in marked:
+        by_sender.setdefault(sender_id, []).append(message_id)
+
+    statements = []
+    for sender_id, message_ids in by_sender.items():
+        statements.append(_private_decrement(reader_id, sender_id, len(message_ids)))
+        statements.append(event_statement(
+            {reader_id, sender_id}, "messages_read", _chat_id(reader_id, sender_id),
+            {"reader_id": reader_id, "message_ids": message_ids, "read_at": read_at.isoformat()}
+        ))
+        _unread_changed(db, reader_id, peer_id=sender_id)
+    return statements
+
+
+def record_group_read(db: Session, group_id: int, moved: List[Tuple[int, int]], seen_at: datetime) -> None:
+    """
+    moved: the (user_id, message_id) watermarks advance_read_watermarks just moved.
+    The whole batch is one event in the group's sequence, not one per member.
+    """
+    user_ids = [user_id for user_id, _ in moved]
+    db.execute(_group_unread_statement(group_id, user_ids))
+    db.execute(group_event_statement(
+        group_id, "seen",
+        {
+            "positions": [{"user_id": user_id, "message_id": message_id} for user_id, message_id in moved],
+            "seen_at": seen_at.isoformat(),
+        },
+        message_id=max(message_id for _, message_id in moved)
+    ))
+    for user_id in user_ids:
+        _unread_changed(db, user_id, group_id=group_id)
+
+
+def record_message_edit(db: Session, msg) -> None:
+    """Refresh the preview wherever the edited message is still the latest one"""
+    kind = Conversation.group_id.isnot(None) if isinstance(msg, GroupMessage) else Conversation.peer_id.isnot(None)
+    db.execute(
+        update(Conversation)
+        .where(Conversation.last_message_id == msg.id, kind)
+        .values(last_message_preview=_last_message_values(msg)["last_message_preview"])
+        .execution_options(synchronize_session=False)
+    )
+    if isinstance(msg, GroupMessage):
+        db.execute(group_event_statement(msg.group_id, "message_edited", edited_payload(msg), message_id=msg.id))
+    else:
+        db.execute(event_statement(
+            _participants(msg), "message_edited", _chat_id(msg.sender_id, msg.receiver_id),
+            edited_payload(msg), message_id=msg.id
+        ))
+
+
+def record_private_delete(db: Session, msg: PrivateMessage) -> None:
+    """Call after deleting msg (flushed, not committed): falls back to the pair's previous message"""
+    pair = or_(
+        (PrivateMessage.sender_id == msg.sender_id) & (PrivateMessage.receiver_id == msg.receiver_id),
+        (PrivateMessage.sender_id == msg.receiver_id) & (PrivateMessage.receiver_id == msg.sender_id)
+    )
+    previous = db.query(PrivateMessage).filter(pair).order_by(PrivateMessage.id.desc()).first()
+    db.execute(
+        update(Conversation)
+        .where(
+            Conversation.last_message_id == msg.id,
+            or_(
+                (Conversation.user_id == msg.sender_id) & (Conversation.peer_id == msg.receiver_id),
+                (Conversation.user_id == msg.receiver_id) & (Conversation.peer_id == msg.sender_id)
+            )
+        )
+        .values(**_last_message_values(previous))
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(event_statement(
+        _participants(msg), "message_deleted", _chat_id(msg.sender_id, msg.receiver_id),
+        {"id": msg.id}, message_id=msg.id
+    ))
+    if not msg.is_read:
+        db.execute(_private_decrement(msg.receiver_id, msg.sender_id, 1))
+        _unread_changed(db, msg.receiver_id, peer_id=msg.sender_id)
+
+
+def record_group_delete(db: Session, msg: GroupMessage) -> None:
+    """Call after deleting msg (flushed, not committed): falls back to the group's previous message"""
+    previous = db.query(GroupMessage).filter(
+        GroupMessage.group_id == msg.group_id
+    ).order_by(GroupMessage.id.desc()).first()
+    db.execute(
+        update(Conversation)
+        .where(Conversation.group_id == msg.group_id, Conversation.last_message_id == msg.id)
+        .values(**_last_message_values(previous))
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(_group_unread_statement(msg.group_id))
+    db.execute(group_event_statement(msg.group_id, "message_deleted", {"id": msg.id}, message_id=msg.id))
+    member_ids = get_member_ids(db, msg.group_id)
+    for member_id in member_ids - {msg.sender_id}:
+        _unread_changed(db, member_id, group_id=msg.group_id)
+
+
+def remove_group_conversation(db: Session, group_id: int, user_id: int) -> None:
+    db.query(Conversation).filter(
+        Conversation.group_id == group_id,
+        Conversation.user_id == user_id
+    ).delete(synchronize_session=False)
+
+
+def get_conversations_page(
+    db: Session,
+    user_id: int,
+    before: Optional[Tuple[datetime, int]] = None,
+    limit: int = 30
+) -> Tuple[List[Conversation], Optional[Tuple[datetime, int]]]:
+    """
+    One page of the user's inbox, most recent chat first, keyed on (last_message_at, id).
+    Returns the rows and the position to pass as `before` for the next page, or None on the last page.
+    """
+    query = db.query(Conversation).options(
+        joinedload(Conversation.peer),
+        joinedload(Conversation.group)
+    ).filter(
+        Conversation.user_id == user_id,
+        Conversation.last_message_at.isnot(None)
+    )
+    if before:
+        query = query.filter(
+            tuple_(Conversation.last_message_at, Conversation.id) < tuple_(*before)
+        )
+    rows = query.order_by(
+        Conversation.last_message_at.desc(), Conversation.id.desc()
+    ).limit(limit + 1).all()
+
+    next_position = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_position = (rows[-1].last_message_at, rows[-1].id)
+    return rows, next_position
+
+
+def get_unread_counts(db: Session, user_ids: Iterable[int]) -> Dict[int, List[Tuple[Optional[int], Optional[int], int]]]:
+    """(peer_id, group_id, unread_count) of every chat with unread messages, per user; walks ix_conversations_user_unread"""
+    counts = {user_id: [] for user_id in user_ids}
+    if not counts:
+        return counts
+    for user_id, peer_id, group_id, unread_count in db.query(
+        Conversation.user_id, Conversation.peer_id, Conversation.group_id, Conversation.unread_count
+    ).filter(
+        Conversation.user_id.in_(list(counts)),
+        Conversation.unread_count > 0
+    ):
+        counts[user_id].append((peer_id, group_id, unread_count))
+    return counts
+
+
+def reconcile_unread_counts(db: Session) -> int:
+    """Recompute every counter from the source tables; returns how many had drifted"""
+    try:
+        fixed = db.execute(_private_unread_statement()).rowcount
+        fixed += db.execute(_group_unread_statement()).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return fixed
+
+
+def backfill_conversations(db: Session) -> None:
+    """Seed the inbox from existing messages the first time the table is used"""
+    if db.query(Conversation.id).first():
+        return
+
+    now = datetime.now(timezone.utc)
+
+    # Private chats: latest message per unordered pair, unread per direction
+    latest = {}
+    for sender_id, receiver_id, message_id in db.query(
+        PrivateMessage.sender_id, PrivateMessage.receiver_id, func.max(PrivateMessage.id)
+    ).group_by(PrivateMessage.sender_id, PrivateMessage.receiver_id):
+        pair = (min(sender_id, receiver_id), max(sender_id, receiver_id))
+        latest[pair] = max(latest.get(pair, 0), message_id)
+    unread = {
+        (receiver_id, sender_id): count
+        for receiver_id, sender_id, count in db.query(
+            PrivateMessage.receiver_id, PrivateMessage.sender_id, func.count(PrivateMessage.id)
+        ).filter(PrivateMessage.is_read == False).group_by(PrivateMessage.receiver_id, PrivateMessage.sender_id)
+    }
+    messages = {
+        msg.id: msg for msg in db.query(PrivateMessage).filter(PrivateMessage.id.in_(list(latest.values())))
+    } if latest else {}
+
+    rows = []
+    for (a, b), message_id in latest.items():
+        last = _last_message_values(messages[message_id])
+        for user_id, peer_id in {(a, b), (b, a)}:
+            rows.append({
+                "user_id": user_id, "peer_id": peer_id,
+                "unread_count": unread.get((user_id, peer_id), 0),
+                "updated_at": now, **last,
+            })
+    if rows:
+        db.execute(pg_insert(Conversation).values(rows).on_conflict_do_nothing())
+
+    # Groups: the latest message for every member, then unread from the watermarks
+    latest_ids = [message_id for (message_id,) in db.query(func.max(GroupMessage.id)).group_by(GroupMessage.group_id)]
+    for msg in db.query(GroupMessage).filter(GroupMessage.id.in_(latest_ids)) if latest_ids else []:
+        last = _last_message_values(msg)
+        rows = [
+            {"user_id": member_id, "group_id": msg.group_id, "unread_count": 0, "updated_at": now, **last}
+            for member_id in get_member_ids(db, msg.group_id)
+        ]
+        if rows:
+            db.execute(pg_insert(Conversation).values(rows).on_conflict_do_nothing())
+            db.execute(_group_unread_statement(msg.group_id))
+
+    db.commit()
@@ -7,6 +7,8 @@ from app.models.diary_group import DiaryGroup
 from app.schemas.diary import DiaryCreate, DiaryUpdate, CreateDiaryForGroup, CommentUpdate, DiaryShare
 from typing import List, Optional
 from app.models.friend import Friend, FriendshipStatus
+from app.services.friend_graph import get_adjacency
+from app.services.group_membership import get_group_ids, is_member
 from app.models.group_member import GroupMember
 from sqlalchemy import or_, and_, select
 from fastapi import HTTPException, status
@@ -73,11 +75,7 @@ def create_diary_for_group(db: Session, group_id: int, diary_data: CreateDiaryFo
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Group not found")
 
-    check_member = db.query(GroupMember).filter(
-        GroupMember.group_id == group_id,
-        GroupMember.user_id == current_user_id
-    ).first()
-    if not check_member:
+    if not is_member(db, group_id, current_user_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Only member can create diary")
     
@@ -159,21 +157,11 @@ def can_view(db: Session, diary: Diary, user_id: int) -> bool:
     if diary.share_type == ShareType.personal:
         return diary.user_id == user_id
     if diary.share_type == ShareType.friends:
-        return db.query(Friend).filter(
-            or_(
-                and_(Friend.user_id == user_id, Friend.friend_id == diary.user_id),
-                and_(Friend.user_id == diary.user_id, Friend.friend_id == user_id)
-            ),
-            Friend.status == FriendshipStatus.accepted
-        ).first() is not None
+        return diary.user_id in get_adjacency(db, user_id).friends
     if diary.share_type == ShareType.group:
-        from app.models.group_member import GroupMember
-        group_ids = [diary.group_id] if diary.group_id else []
-        group_ids += [g.id for g in diary.groups]
-        return db.query(GroupMember).filter(
-            GroupMember.group_id.in_(group_ids),
-            GroupMember.user_id == user_id
-        ).first() is not None
+        group_ids = {diary.group_id} if diary.group_id else set()
+        group_ids.update(g.id for g in diary.groups)
+        return not get_group_ids(db, user_id).isdisjoint(group_ids)
     return False
 
 def update_diary(db: Session, diary_id: int, diary_data: DiaryUpdate, current_user_id: int):
@@ -1,7 +1,9 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Optional, List
 from app.models.friend import Friend, FriendshipStatus
 from app.models.user import User
+from app.services.friend_graph import get_adjacency, get_adjacency_async, invalidate_friendship
 
 
 def create(db: Session, user_id: int, friend_id: int, status: str = "pending") -> Friend:
@@ -13,6 +15,7 @@ def create(db: Session, user_id: int, friend_id: int, status: str = "pending") -
     friendship = Friend(user_id=user_id, friend_id=friend_id, status=FriendshipStatus(status))
     db.add(friendship)
     db.commit()
+    invalidate_friendship(user_id, friend_id)
     db.refresh(friendship)
     return friendship
 
@@ -33,6 +36,7 @@ def update_status(db: Session, user_id: int, friend_id: int, status: str):
     if friendship:
         friendship.status = FriendshipStatus(status)
         db.commit()
+        invalidate_friendship(user_id, friend_id)
         db.refresh(friendship)
     return friendship
 
@@ -47,23 +51,24 @@ def delete(db: Session, user_id: int, friend_id: int):
     if friendship:
         db.delete(friendship)
         db.commit()
+        invalidate_friendship(user_id, friend_id)
         return True
     return False
 
 
 def is_friend(db: Session, user_id: int, friend_id: int) -> bool:
-    return db.query(Friend).filter(
-        ((Friend.user_id == user_id) & (Friend.friend_id == friend_id)) |
-        ((Friend.user_id == friend_id) & (Friend.friend_id == user_id)),
-        Friend.status == FriendshipStatus.accepted
-    ).first() is not None
+    return friend_id in get_adjacency(db, user_id).friends
+
+
+async def is_friend_async(db: AsyncSession, user_id: int, friend_id: int) -> bool:
+    return friend_id in (await get_adjacency_async(db, user_id)).friends
 
 
 def get_friends(db: Session, user_id: int) -> List[User]:
-    return db.query(User).join(Friend,
-        ((Friend.user_id == user_id) & (Friend.friend_id == User.id)) |
-        ((Friend.friend_id == user_id) & (Friend.user_id == User.id))
-    ).filter(Friend.status == FriendshipStatus.accepted).all()
+    friend_ids = get_adjacency(db, user_id).friends
+    if not friend_ids:
+        return []
+    return db.query(User).filter(User.id.in_(friend_ids)).all()
 
 
 def get_pending_requests(db: Session, user_id: int) -> List[User]:
@@ -81,21 +86,10 @@ def get_friend_request(db: Session, user_id: int, friend_id: int) -> Optional[Fr
 def get_blocked_users_list(db: Session, user_id: int) -> List[User]:
     """Get all users blocked by the current user"""
     try:
-        # Get blocked relationships where current user is the blocker
-        blocked_relationships = db.query(Friend).filter(
-            Friend.user_id == user_id,
-            Friend.status == FriendshipStatus.blocked
-        ).all()
-        
-        # Extract the actual User objects
-        blocked_users = []
-        for relationship in blocked_relationships:
-            # The blocked user is the friend_id
-            user = db.query(User).filter(User.id == relationship.friend_id).first()
-            if user:
-                blocked_users.append(user)
-        
-        return blocked_users
+        blocked_ids = get_adjacency(db, user_id).blocked
+        if not blocked_ids:
+            return []
+        return db.query(User).filter(User.id.in_(blocked_ids)).all()
         
     except Exception as e:
         print(f"Error in get_blocked_users_list: {str(e)}")
@@ -104,17 +98,9 @@ def get_blocked_users_list(db: Session, user_id: int) -> List[User]:
 
 def is_blocked(db: Session, user_id: int, target_user_id: int) -> bool:
     """Check if user has blocked target user"""
-    return db.query(Friend).filter(
-        Friend.user_id == user_id,
-        Friend.friend_id == target_user_id,
-        Friend.status == FriendshipStatus.blocked
-    ).first() is not None
+    return target_user_id in get_adjacency(db, user_id).blocked
 
 
 def is_blocked_by(db: Session, user_id: int, target_user_id: int) -> bool:
     """Check if user is blocked by target user"""
-    return db.query(Friend).filter(
-        Friend.user_id == target_user_id,
-        Friend.friend_id == user_id,
-        Friend.status == FriendshipStatus.blocked
-    ).first() is not None
\ No newline at end of file
+    return target_user_id in get_adjacency(db, user_id).blocked_by
\ No newline at end of file
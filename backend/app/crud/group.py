@@ -5,6 +5,10 @@ from sqlalchemy.orm import Session
 from app.models.group import Group
 from app.models.group_member import GroupMember
 from app.crud.friend import is_friend
+from app.services.friend_graph import get_adjacency
+from app.services.group_membership import get_member_ids, invalidate_membership, is_member
+from app.crud.conversation import remove_group_conversation
+from app.crud.media import queue_media_deletion
 from typing import List, Optional
 from datetime import datetime, timedelta
 import uuid
@@ -24,7 +28,11 @@ import string
 from sqlalchemy.orm import joinedload
 
 from app.models.group_invite_link import GroupInviteLink
-from app.core.cloudinary import upload_to_cloudinary, delete_from_cloudinary, configure_cloudinary, extract_public_id_from_url
+from app.core.cloudinary import configure_cloudinary, extract_public_id_from_url
+from app.helpers.uploads import spool_upload
+from app.core.config import settings
+from app.services.image_pipeline import IMAGE_MIME_TYPES, image_pipeline
+from app.services.storage import storage
 
 configure_cloudinary()
 
@@ -36,11 +44,7 @@ def generate_invite_token():
 
 def get_or_create_invite_link(db: Session, group_id: int, user_id: int):
     # Check if user is in group
-    member = db.query(GroupMember).filter(
-        GroupMember.group_id == group_id,
-        GroupMember.user_id == user_id
-    ).first()
-    if not member:
+    if not is_member(db, group_id, user_id):
         raise HTTPException(403, "You are not a member of this group")
 
     # Check if link already exists
@@ -108,8 +112,10 @@ def delete_group(db: Session, group_id: int, current_user_id: int):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Only owner can delete this group")
 
+    member_ids = get_member_ids(db, group_id)
     db.delete(group)
     db.commit()
+    invalidate_membership(group_id, member_ids)
     return {"detail": "Group has been deleted"}
 
 def get_pending_invites(db: Session, user_id: int):
@@ -147,11 +153,7 @@ def accept_group_invite(db: Session, invite_id: int, user_id: int) -> Group:
         raise HTTPException(404, "Invite not found or already processed")
 
     # Check if already a member
-    existing_member = db.query(GroupMember).filter(
-        GroupMember.group_id == invite.group_id,
-        GroupMember.user_id == user_id
-    ).first()
-    if existing_member:
+    if is_member(db, invite.group_id, user_id):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="You are already a member of this group"
@@ -164,23 +166,17 @@ def accept_group_invite(db: Session, invite_id: int, user_id: int) -> Group:
     # Mark invite as accepted
     invite.status = "accepted"
     db.commit()
+    invalidate_membership(invite.group_id, [user_id])
     db.refresh(invite.group)
     return invite.group
     
 def get_group_members(db: Session, group_id: int, user_id: int, search: Optional[str] = None) -> List[User]:
     # Verify user is in group
-    member_check = db.query(GroupMember).filter(
-        GroupMember.group_id == group_id,
-        GroupMember.user_id == user_id
-    ).first()
-    if not member_check:
+    member_ids = get_member_ids(db, group_id)
+    if user_id not in member_ids:
         return []
 
-    query = (
-        db.query(User)
-        .join(GroupMember, User.id == GroupMember.user_id)
-        .filter(GroupMember.group_id == group_id)
-    )
+    query = db.query(User).filter(User.id.in_(member_ids))
     
     if search:
         search_pattern = f"%{search.strip()}%"
@@ -194,11 +190,7 @@ def get_group_members(db: Session, group_id: int, user_id: int, search: Optional
     return query.all()
 
 def get_group_diaries(db: Session, group_id: int, user_id: int, search: Optional[str] = None) -> List[Diary]:
-    member_check = db.query(GroupMember).filter(
-        GroupMember.group_id == group_id,
-        GroupMember.user_id == user_id
-    ).first()
-    if not member_check:
+    if not is_member(db, group_id, user_id):
         return []
 
     diaries = (
@@ -248,6 +240,7 @@ def add_member(db: Session, group_id: int, user_id: int, is_admin: bool = False)
     member = GroupMember(group_id=group_id, user_id=user_id, is_admin=is_admin)
     db.merge(member)
     db.commit()
+    invalidate_membership(group_id, [user_id])
 
 def create_group_with_invites(
     db: Session,
@@ -271,12 +264,7 @@ def create_group_with_invites(
     # 3. Invite friends (if any) - FIXED: Actually create invitations
     if group_in.invite_user_ids:
         # Verify each ID is a friend of the creator
-        friend_ids = (
-            db.query(Friend.friend_id)
-            .filter(Friend.user_id == creator_id, Friend.status == "accepted")
-            .all()
-        )
-        friend_ids = {f[0] for f in friend_ids}
+        friend_ids = get_adjacency(db, creator_id).friends
 
         for uid in group_in.invite_user_ids:
             if uid == creator_id:
@@ -295,6 +283,7 @@ def create_group_with_invites(
             db.add(db_invite)
 
     db.commit()
+    invalidate_membership(db_group.id, [creator_id])
     db.refresh(db_group)
     return db_group
 
@@ -350,6 +339,7 @@ def create_group_with_invites(db: Session, group_in: GroupCreate, creator_id: in
     db.add(db_member)
 
     db.commit()
+    invalidate_membership(db_group.id, [creator_id])
     db.refresh(db_group)
     return db_group
 
@@ -407,7 +397,9 @@ def remove_member(
                             detail="Member not found")
         
     db.delete(member)
+    remove_group_conversation(db, group_id, member_id)
     db.commit()
+    invalidate_membership(group_id, [member_id])
     return None
 
 def leave_group(group_id: int, db: Session, current_user_id: int):
@@ -420,7 +412,9 @@ def leave_group(group_id: int, db: Session, current_user_id: int):
                             detail="You are not member of this group")
         
     db.delete(member)
+    remove_group_conversation(db, group_id, current_user_id)
     db.commit()
+    invalidate_membership(group_id, [current_user_id])
     return None
 
 async def upload_group_cover(group_id: int, db: Session, cover: UploadFile, current_user_id):
@@ -432,12 +426,7 @@ async def upload_group_cover(group_id: int, db: Session, cover: UploadFile, curr
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail="Only png and JPG are allowed")
         
-        content = await cover.read()
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="File is too large, max size is 3MB"
-            )
+        content, _ = await spool_upload(cover, MAX_FILE_SIZE, "File is too large, max size is 3MB")
         
         group = db.query(Group).filter(Group.id == group_id).first()
         if not group:
@@ -448,9 +437,14 @@ async def upload_group_cover(group_id: int, db: Session, cover: UploadFile, curr
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail="Only owner can use this feature")
             
+        # Validate and resize locally; only the small variant is uploaded
+        processed = await image_pipeline.prepare(content, IMAGE_MIME_TYPES, settings.IMAGE_VARIANT_SIZE)
+        if processed:
+            content, file_extension = processed.content, processed.extension
+
         unique_filename = f"groups/{group_id}/cover/{uuid.uuid4().hex}{file_extension}"
             
-        upload_result = upload_to_cloudinary(content, public_id=unique_filename)
+        upload_result = await storage.upload(content, public_id=unique_filename, transform=processed is None)
         if not upload_result or "secure_url" not in upload_result:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                                 detail="Failed to upload cover")
@@ -488,9 +482,8 @@ async def delete_cover(cover_id: int, db: Session, current_user_id: int):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                                 detail="Only owner can use this feature")
         
-        public_id = extract_public_id_from_url(cover.url)
-        if public_id:
-            delete_from_cloudinary(public_id)
+        # Destroyed remotely by the media deleter once this commits
+        queue_media_deletion(db, extract_public_id_from_url(cover.url))
             
         db.delete(cover)
         db.commit()
@@ -0,0 +1,265 @@
+# app/crud/media.py
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from fastapi import HTTPException, status
+from app.models.media_asset import MediaAsset
+from app.models.media_deletion import MediaDeletion
+from app.models.private_message import MessageType, PrivateMessage
+from app.utils.chat_helpers import extract_public_id_from_url
+
+RESOURCE_TYPES = {MessageType.image: "image", MessageType.voice: "video"}
+
+
+def media_hasher():
+    """Feed upload chunks into this (spool_upload(..., hasher=...)) to get the registry digest"""
+    return hashlib.blake2b(digest_size=32)
+
+
+def find_media(db: Session, digest: str, kind: str) -> Optional[Tuple[str, str]]:
+    """
+    The (public_id, url) of an object already uploaded with the same bytes and options, or None
+    when the bytes are new and have to be uploaded. Finding it takes no reference (the message
+    that uses it does, see claim_media) but keeps an unclaimed object from expiring meanwhile.
+    """
+    row = db.execute(
+        update(MediaAsset)
+        .where(MediaAsset.digest == digest, MediaAsset.kind == kind, MediaAsset.url.isnot(None))
+        .values(updated_at=datetime.now(timezone.utc))
+        .returning(MediaAsset.public_id, MediaAsset.url)
+    ).first()
+    return (row.public_id, row.url) if row else None
+
+
+def register_media(
+    db: Session,
+    digest: str,
+    kind: str,
+    upload_result: dict,
+    size: int,
+    resource_type: str = "image",
+    uploader_id: Optional[int] = None,
+) -> Tuple[str, str, bool]:
+    """
+    Record a fresh upload with no references yet. Returns (public_id, url, duplicate): when a
+    concurrent upload of the same bytes registered first, that object is used instead and
+    duplicate is True, so the caller should destroy the copy it just uploaded.
+    Unclaimed objects are destroyed by expire_unclaimed_media if no message takes them up.
+    """
+    now = datetime.now(timezone.utc)
+    row = db.execute(
+        pg_insert(MediaAsset)
+        .values(
+            digest=digest,
+            kind=kind,
+            public_id=upload_result["public_id"],
+            resource_type=resource_type,
+            url=upload_result["secure_url"],
+            size=size,
+            uploader_id=uploader_id,
+            created_at=now,
+            updated_at=now,
+        )
+        .on_conflict_do_update(
+            index_elements=[MediaAsset.digest, MediaAsset.kind],
+            set_={"updated_at": now},
+        )
+        .returning(MediaAsset.public_id, MediaAsset.url)
+    ).first()
+    return row.public_id, row.url, row.public_id != upload_result["public_id"]
+
+
+def claim_media(db: Session, public_id: Optional[str], resource_type: str = "image") -> None:
+    """
+    Take a message's reference on an uploaded object, in the transaction that writes the message.
+    Objects the registry has never seen predate it and belong to this message alone; one whose
+    unclaimed upload already expired is on its way out, so the message is refused.
+    """
+    if not public_id:
+        return
+    row = db.execute(
+        update(MediaAsset)
+        .where(MediaAsset.public_id == public_id)
+        .values(ref_count=MediaAsset.ref_count + 1, updated_at=datetime.now(timezone.utc))
+        .returning(MediaAsset.id)
+    ).first()
+    if row is not None:
+        return
+    expired = db.query(MediaDeletion.id).filter(
+        MediaDeletion.public_id == public_id, MediaDeletion.resource_type == resource_type
+    ).first()
+    if expired:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="The upload has expired, please upload the file again")
+
+
+def claim_message_media(db: Session, msg: PrivateMessage) -> None:
+    """claim_media for a new private image/voice message; a forward shares the original's object"""
+    resource_type = RESOURCE_TYPES.get(msg.message_type)
+    public_id = extract_public_id_from_url(msg.content) if resource_type else None
+    if not public_id:
+        return
+    if msg.is_forwarded:
+        share_media(db, public_id, resource_type)
+    else:
+        claim_media(db, public_id, resource_type)
+
+
+def discard_upload(db: Session, public_id: str, user_id: int) -> None:
+    """
+    Destroy an upload its uploader changed their mind about. Only allowed while no message has
+    claimed it; the row stays locked until the caller commits, so a claim can't slip in between.
+    """
+    asset = db.query(MediaAsset).filter(MediaAsset.public_id == public_id).with_for_update().first()
+    if not asset:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    if asset.uploader_id != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the uploader can delete this upload")
+    if asset.ref_count > 0:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The upload is used by a message")
+    db.delete(asset)
+    queue_media_deletion(db, asset.public_id, asset.resource_type)
+
+
+def expire_unclaimed_media(db: Session, older_than_seconds: int) -> int:
+    """Queue uploads no message took up within older_than_seconds for deletion; returns how many"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than_seconds)
+    try:
+        rows = db.execute(
+            delete(MediaAsset)
+            .where(MediaAsset.ref_count <= 0, MediaAsset.updated_at < cutoff)
+            .returning(MediaAsset.public_id, MediaAsset.resource_type)
+        ).all()
+        for public_id, resource_type in rows:
+            queue_media_deletion(db, public_id, resource_type)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(rows)
+
+
+def share_media(db: Session, public_id: str, resource_type: str = "image") -> None:
+    """
+    One more message points at public_id (a forward). An object uploaded before the registry
+    existed gets its row now, and the one message that already used it claims it first.
+    """
+    now = datetime.now(timezone.utc)
+    adopted = db.execute(
+        pg_insert(MediaAsset)
+        .values(kind="legacy", public_id=public_id, resource_type=resource_type, created_at=now, updated_at=now)
+        .on_conflict_do_nothing(index_elements=[MediaAsset.public_id])
+        .returning(MediaAsset.id)
+    ).first()
+    if adopted:
+        claim_media(db, public_id, resource_type)
+    claim_media(db, public_id, resource_type)
+
+
+def release_media(db: Session, public_id: Optional[str]) -> bool:
+    """
+    Drop one reference inside the caller's transaction. True when nothing uses the object any
+    more and it should be destroyed once the transaction commits; objects the registry has
+    never seen had a single user, so they are always released.
+    """
+    if not public_id:
+        return False
+    row = db.execute(
+        update(MediaAsset)
+        .where(MediaAsset.public_id == public_id)
+        .values(ref_count=MediaAsset.ref_count - 1, updated_at=datetime.now(timezone.utc))
+        .returning(MediaAsset.ref_count)
+    ).first()
+    if row is None:
+        return True
+    if row.ref_count > 0:
+        return False
+    db.execute(delete(MediaAsset).where(MediaAsset.public_id == public_id, MediaAsset.ref_count <= 0))
+    return True
+
+
+def queue_media_deletion(db: Session, public_id: Optional[str], resource_type: str = "image") -> None:
+    """Add the object to the deletion outbox inside the caller's transaction; the media deleter destroys it"""
+    if not public_id:
+        return
+    db.execute(
+        pg_insert(MediaDeletion)
+        .values(public_id=public_id, resource_type=resource_type, attempts=0,
+                next_attempt_at=datetime.now(timezone.utc), created_at=datetime.now(timezone.utc))
+        .on_conflict_do_nothing(index_elements=[MediaDeletion.public_id, MediaDeletion.resource_type])
+    )
+
+
+def drop_media(db: Session, public_id: Optional[str], resource_type: str = "image") -> None:
+    """Release one reference and queue the object for deletion when it was the last one"""
+    if release_media(db, public_id):
+        queue_media_deletion(db, public_id, resource_type)
+
+
+def claim_media_deletions(db: Session, limit: int, lease_seconds: int) -> List[Tuple[int, str, str, int]]:
+    """
+    Take up to `limit` due deletions as (id, public_id, resource_type, attempts). Claimed rows are
+    pushed lease_seconds into the future, so other workers skip them while this one calls Cloudinary.
+    """
+    now = datetime.now(timezone.utc)
+    due = (
+        select(MediaDeletion.id)
+        .where(MediaDeletion.next_attempt_at <= now)
+        .order_by(MediaDeletion.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    try:
+        rows = db.execute(
+            update(MediaDeletion)
+            .where(MediaDeletion.id.in_(due))
+            .values(next_attempt_at=now + timedelta(seconds=lease_seconds))
+            .returning(MediaDeletion.id, MediaDeletion.public_id, MediaDeletion.resource_type, MediaDeletion.attempts)
+        ).all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return [tuple(row) for row in rows]
+
+
+def finish_media_deletions(
+    db: Session,
+    done: List[int],
+    failed: Dict[int, Tuple[int, str]],
+    retry_base_seconds: int,
+    max_attempts: int,
+) -> int:
+    """
+    Remove the rows Cloudinary confirmed and reschedule failures (id -> (attempts, error)) with
+    exponential backoff. Rows out of attempts keep their error but are not retried. Returns how many gave up.
+    """
+    now = datetime.now(timezone.utc)
+    gave_up = 0
+    try:
+        if done:
+            db.execute(delete(MediaDeletion).where(MediaDeletion.id.in_(done)))
+        for deletion_id, (attempts, error) in failed.items():
+            attempts += 1
+            next_attempt_at = None
+            if attempts < max_attempts:
+                next_attempt_at = now + timedelta(seconds=min(retry_base_seconds * 2 ** (attempts - 1), 6 * 3600))
+            else:
+                gave_up += 1
+            db.execute(
+                update(MediaDeletion)
+                .where(MediaDeletion.id == deletion_id)
+                .values(attempts=attempts, next_attempt_at=next_attempt_at, last_error=error[:1000])
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return gave_up
+
+
+def count_pending_deletions(db: Session) -> int:
+    return db.query(MediaDeletion).filter(MediaDeletion.next_attempt_at.isnot(None)).count()
@@ -1,19 +1,27 @@
 from app.models.group_message import GroupMessage, MessageType
-from app.models.group_member import GroupMember
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status, UploadFile
 from app.schemas.group import GroupMessageUpdate
 from app.schemas.chat import ParentMessageResponse, AuthorResponse, GroupMessageOut
 from datetime import datetime, timezone
-from app.core.cloudinary import upload_to_cloudinary, delete_from_cloudinary, configure_cloudinary, extract_public_id_from_url
+from app.core.cloudinary import configure_cloudinary, extract_public_id_from_url
 from pathlib import Path
 import uuid
 from app.models.group_message_seen import GroupMessageSeen
-from app.services.websocket_manager import manager
+from app.models.group_read_watermark import GroupReadWatermark
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from typing import Dict, List, Tuple
+from app.services.storage import storage
 from app.helpers.to_utc_iso import to_local_iso
+from app.helpers.uploads import spool_upload
 from app.models.user import User
-import cloudinary
-import cloudinary.uploader
+from app.services.group_membership import is_member
+from app.crud.media import claim_media, drop_media, find_media, media_hasher, queue_media_deletion, register_media, share_media
+from app.crud.conversation import record_group_delete, record_group_message, record_group_read, record_message_edit
+from app.crud.realtime_outbox import queue_broadcast
 
 configure_cloudinary()
 
@@ -32,13 +40,14 @@ def update_message(db: Session, message_id: int, content: str, current_user_id:
         
     message.content= content
     message.updated_at = datetime.now(timezone.utc)
+    record_message_edit(db, message)
     
     db.commit()
     db.refresh(message)
 
     return message
 
-async def delete_message(db: Session, message_id: int, current_user_id: int):
+def delete_message(db: Session, message_id: int, current_user_id: int):
     message = db.query(GroupMessage).filter(GroupMessage.id == message_id).first()
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
@@ -46,28 +55,51 @@ async def delete_message(db: Session, message_id: int, current_user_id: int):
     if message.sender_id != current_user_id:
         raise HTTPException(status_code=403, detail="Only sender can delete this message")
 
+    # Forwards share the file and voice objects; only the last reference removes them
     if message.file_url:
-        public_id = extract_public_id_from_url(message.file_url)
-        if public_id:
-            delete_from_cloudinary(public_id)
-
+        drop_media(db, message.public_id or extract_public_id_from_url(message.file_url))
     if message.voice_url:
-        await delete_voice_message(message)
+        drop_media(db, message.voice_public_id, "video")
 
     db.query(GroupMessageSeen).filter(GroupMessageSeen.message_id == message.id).delete(synchronize_session=False)
 
     db.delete(message)
+    db.flush()
+    record_group_delete(db, message)
     db.commit()
 
     return {"detail": "Message has been deleted"}
 
 
+async def _upload_group_image(db: Session, file: UploadFile, group_id: int, uploader_id: int) -> Tuple[str, str]:
+    """
+    Upload a message image, or reuse the object already holding the same bytes; returns (public_id, url).
+    Nothing is committed: the caller claims the object and commits along with the message.
+    """
+    file_extension = Path(file.filename).suffix.lower()
+    hasher = media_hasher()
+    content, size = await spool_upload(file, MAX_FILE_SIZE, "File is too large, Max size is 3MB", hasher=hasher)
+    digest = hasher.hexdigest()
+
+    existing = find_media(db, digest, "group_image")
+    if existing:
+        return existing
+
+    unique_filename = f"groups/{group_id}/messages/{uuid.uuid4().hex}{file_extension}"
+    
+    upload_result = await storage.upload(content, public_id=unique_filename)
+    if not upload_result or "secure_url" not in upload_result:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Failed to upload file")
+
+    public_id, url, duplicate = register_media(db, digest, "group_image", upload_result, size, uploader_id=uploader_id)
+    if duplicate:
+        queue_media_deletion(db, upload_result["public_id"])
+    return public_id, url
+
+
 async def upload_file_message(db: Session, group_id: int, file: UploadFile, current_user_id: int):
-    is_member = db.query(GroupMember).filter(
-        GroupMember.group_id == group_id,
-        GroupMember.user_id == current_user_id
-    ).first()
-    if not is_member:
+    if not is_member(db, group_id, current_user_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Only member can upload file")
         
@@ -76,28 +108,21 @@ async def upload_file_message(db: Session, group_id: int, file: UploadFile, curr
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Only png and JPG are allowed")
         
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="File is too large, Max size is 3MB")
-        
-    unique_filename = f"groups/{group_id}/messages/{uuid.uuid4().hex}{file_extension}"
-    
-    upload_result = upload_to_cloudinary(content, public_id=unique_filename)
-    if not upload_result or "secure_url" not in upload_result:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail="Failed to upload file")
+    public_id, file_url = await _upload_group_image(db, file, group_id, current_user_id)
         
     save_message = GroupMessage(
         group_id=group_id,  
         sender_id=current_user_id,
         message_type = MessageType.image,
-        public_id = upload_result["public_id"],
-        file_url = upload_result["secure_url"],    
+        public_id = public_id,
+        file_url = file_url,    
         content = None
     )
     
     db.add(save_message)
+    db.flush()
+    claim_media(db, public_id)
+    record_group_message(db, save_message)
     db.commit()
     db.refresh(save_message)
     return save_message
@@ -113,80 +138,111 @@ async def update_file_message(db: Session, message_id: int, file: UploadFile, cu
         raise HTTPException(status_code.status.HTTP_403_FORBIDDEN,
                             detail="Only sender can update")
     
-    if message.file_url:    
-        public_id = extract_public_id_from_url(message.file_url)
-        delete_from_cloudinary(public_id)
-    
     file_extension = Path(file.filename).suffix.lower()
     if file_extension not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Only png and JPG are allowed")
-        
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail="File is too large, Max size is 3MB")
-        
-    unique_filename = f"groups/{message.group_id}/messages/{uuid.uuid4().hex}{file_extension}"
-    
-    upload_result = upload_to_cloudinary(content, public_id=unique_filename)
-    if not upload_result or "secure_url" not in upload_result:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail="Failed to upload file")
-        
-    message.public_id = upload_result["public_id"]
-    message.file_url = upload_result["secure_url"]
+
+    old_public_id = (message.public_id or extract_public_id_from_url(message.file_url)) if message.file_url else None
+    public_id, file_url = await _upload_group_image(db, file, message.group_id, current_user_id)
+
+    # The old image goes once nothing else (e.g. a forward) points at it; claiming first keeps
+    # a re-upload of the same bytes from dropping to zero in between
+    claim_media(db, public_id)
+    drop_media(db, old_public_id)
+    message.public_id = public_id
+    message.file_url = file_url
         
     db.commit()
     db.refresh(message)
     
     return message
 
-async def handle_seen_message(db, current_user_id, group_id, message_id, chat_id):
-    try:
-    
-        msg = db.query(GroupMessage).filter(
-            GroupMessage.id == message_id,
+def advance_read_watermarks(db: Session, group_id: int, positions: Dict[int, int]) -> Tuple[datetime, List[Tuple[int, int]]]:
+    """
+    Move several members' read positions in the group forward in one statement; they never move backwards.
+    positions maps user_id -> message_id. Returns the time and the (user_id, message_id) pairs that moved.
+    """
+    if not positions:
+        return datetime.now(timezone.utc), []
+
+    known = {
+        message_id for (message_id,) in db.query(GroupMessage.id).filter(
+            GroupMessage.id.in_(set(positions.values())),
             GroupMessage.group_id == group_id
-        ).first()
-        if not msg:
-            return 
-
-        seen_record = db.query(GroupMessageSeen).filter_by(
-            message_id = message_id,
-            user_id=current_user_id
-        ).first()
-        if seen_record and seen_record.seen:
-            return 
-        
-        now = datetime.utcnow()
-        
-        if not seen_record:
-            seen_record = GroupMessageSeen(
-                message_id=message_id,
-                user_id=current_user_id,
-                seen=True,
-                seen_at=now
-            )
-            db.add(seen_record)
-        else:
-            seen_record.seen = True
-            seen_record.seen_at = now
-            
-        db.commit()
+        )
+    }
+    rows = [
+        {"group_id": group_id, "user_id": user_id, "last_read_message_id": message_id}
+        for user_id, message_id in positions.items()
+        if message_id in known
+    ]
+    now = datetime.now(timezone.utc)
+    if not rows:
+        return now, []
 
-        await manager.broadcast(chat_id, {
-            "event": "message_seen",
-            "message_id": message_id,
-            "user_id": current_user_id,
-            "seen_at": now.isoformat(),
-        })
+    for row in rows:
+        row["updated_at"] = now
+    stmt = pg_insert(GroupReadWatermark).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[GroupReadWatermark.group_id, GroupReadWatermark.user_id],
+        set_={
+            "last_read_message_id": stmt.excluded.last_read_message_id,
+            "updated_at": stmt.excluded.updated_at,
+        },
+        where=GroupReadWatermark.last_read_message_id < stmt.excluded.last_read_message_id
+    ).returning(GroupReadWatermark.user_id, GroupReadWatermark.last_read_message_id)
 
-    except Exception as e:
+    try:
+        moved = [tuple(row) for row in db.execute(stmt)]
+        if moved:
+            record_group_read(db, group_id, moved, now)
+        db.commit()
+    except Exception:
         db.rollback()
-        print(f"[Seen Error] {e}")
-        
-async def handle_forward_message(
+        raise
+    return now, moved
+
+async def get_group_watermarks_async(db: AsyncSession, group_id: int) -> List[GroupReadWatermark]:
+    result = await db.execute(
+        select(GroupReadWatermark)
+        .options(selectinload(GroupReadWatermark.user))
+        .where(GroupReadWatermark.group_id == group_id)
+    )
+    return list(result.scalars().all())
+
+def seen_by_from_watermarks(message: GroupMessage, watermarks: List[GroupReadWatermark]) -> List[dict]:
+    """Members whose read position has reached the message, shaped like schemas.chat.GroupMessageSeen"""
+    return [
+        {"id": mark.id, "user": mark.user, "seen_at": mark.updated_at}
+        for mark in watermarks
+        if mark.last_read_message_id >= message.id and mark.user_id != message.sender_id
+    ]
+
+def backfill_read_watermarks(db: Session) -> None:
+    """Seed watermarks from the old per-message group_message_seen rows the first time the table is used"""
+    if db.query(GroupReadWatermark.id).first():
+        return
+
+    latest_seen = (
+        select(
+            GroupMessage.group_id,
+            GroupMessageSeen.user_id,
+            func.max(GroupMessageSeen.message_id),
+            func.max(GroupMessageSeen.seen_at)
+        )
+        .join(GroupMessage, GroupMessage.id == GroupMessageSeen.message_id)
+        .where(GroupMessageSeen.seen == True)
+        .group_by(GroupMessage.group_id, GroupMessageSeen.user_id)
+    )
+    db.execute(
+        pg_insert(GroupReadWatermark)
+        .from_select(["group_id", "user_id", "last_read_message_id", "updated_at"], latest_seen)
+        .on_conflict_do_nothing()
+    )
+    db.commit()
+
+def handle_forward_message(
     db: Session,
     current_user_id: int,
     message_id: int,
@@ -224,7 +280,14 @@ async def handle_forward_message(
         )
 
         db.add(new_msg)
-        db.commit()
+        db.flush()
+        # The copy points at the same remote objects, so they now have one more user
+        if original.file_url and original.public_id:
+            share_media(db, original.public_id)
+        if original.voice_url and original.voice_public_id:
+            share_media(db, original.voice_public_id, "video")
+        record_group_message(db, new_msg)
+        db.flush()
         db.refresh(new_msg)
 
         msg_out = {
@@ -257,15 +320,25 @@ async def handle_forward_message(
             "created_at": to_local_iso(new_msg.created_at, tz_offset_hours=7)
         }
 
-        await manager.broadcast(chat_id, msg_out)
+        queue_broadcast(db, chat_id, msg_out)
         forwarded_messages.append(msg_out)
 
+    # One transaction for every copy; the frames go out once it commits
+    db.commit()
     return forwarded_messages
         
 def get_seen_messages(db: Session, message_id):
-    seen_messages = db.query(GroupMessageSeen).filter(
-        GroupMessageSeen.message_id == message_id
-    ).all()
+    message = db.query(GroupMessage).filter(GroupMessage.id == message_id).first()
+    seen_messages = []
+    if message:
+        # Everyone whose read position has reached this message has seen it
+        watermarks = db.query(GroupReadWatermark).options(
+            joinedload(GroupReadWatermark.user)
+        ).filter(
+            GroupReadWatermark.group_id == message.group_id,
+            GroupReadWatermark.last_read_message_id >= message.id
+        ).all()
+        seen_messages = seen_by_from_watermarks(message, watermarks)
     if not seen_messages:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Seen message not found")
@@ -285,13 +358,9 @@ async def upload_voice_message(group_id: int,
     
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     
-    content = await file.read()
-    file_size = len(content)
-    
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB")
+    content, _ = await spool_upload(file, MAX_FILE_SIZE, f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB")
     
-    upload_result = cloudinary.uploader.upload(
+    upload_result = await storage.upload_raw(
         content,
         resource_type="video",
         folder="whisper_space/group/voice_messages",
@@ -310,6 +379,8 @@ async def upload_voice_message(group_id: int,
     )
     
     db.add(new_message)
+    db.flush()
+    record_group_message(db, new_message)
     db.commit()
     db.refresh(new_message)
     
@@ -320,11 +391,7 @@ async def delete_voice_message(message: GroupMessage):
         return
 
     try:
-        result = cloudinary.uploader.destroy(
-            message.voice_public_id,
-            resource_type="video"
-        )
-        if result.get("result") != "ok":
+        if not await storage.delete(message.voice_public_id, resource_type="video"):
             print(f"[Warning] Cannot delete voice message from Cloudinary: {message.id}")
     except Exception as e:
         print(f"[Error] Failed to delete voice message id {message.id}: {str(e)}")
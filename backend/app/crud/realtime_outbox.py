@@ -0,0 +1,60 @@
+# app/crud/realtime_outbox.py
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+import orjson
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.orm import Session
+from app.helpers.frames import encode_frame
+from app.models.realtime_event import RealtimeEvent
+
+REALTIME_QUEUED = "realtime_queued"
+
+
+def queue_broadcast(db: Session, room: str, message: dict) -> None:
+    """
+    Broadcast `message` to `room` once the caller's transaction commits. Nothing is sent when
+    it rolls back, and a crash after the commit still leaves the row for the publisher.
+    """
+    db.execute(insert(RealtimeEvent).values(
+        room=room,
+        # Through the frame encoder so datetimes and enums are stored as they would be sent
+        payload=orjson.loads(encode_frame(message)),
+        created_at=datetime.now(timezone.utc),
+    ))
+    db.info[REALTIME_QUEUED] = True
+
+
+def claim_realtime_events(db: Session, limit: int, lease_seconds: int) -> List[Tuple[int, str, dict]]:
+    """Oldest unclaimed (or expired) events as (id, room, payload), held for lease_seconds"""
+    now = datetime.now(timezone.utc)
+    due = (
+        select(RealtimeEvent.id)
+        .where(or_(RealtimeEvent.claimed_until.is_(None), RealtimeEvent.claimed_until < now))
+        .order_by(RealtimeEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    try:
+        rows = db.execute(
+            update(RealtimeEvent)
+            .where(RealtimeEvent.id.in_(due))
+            .values(claimed_until=now + timedelta(seconds=lease_seconds))
+            .returning(RealtimeEvent.id, RealtimeEvent.room, RealtimeEvent.payload)
+        ).all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return sorted((tuple(row) for row in rows), key=lambda row: row[0])
+
+
+def delete_realtime_events(db: Session, ids: List[int]) -> None:
+    if not ids:
+        return
+    try:
+        db.execute(delete(RealtimeEvent).where(RealtimeEvent.id.in_(ids)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
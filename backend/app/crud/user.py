@@ -1,8 +1,9 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.schemas.auth import UserCreate
 from app.models.user import User
 from app.schemas.user import UserUpdate
-from app.core.security import hash_password
+from app.core.security import hash_password, invalidate_principal
 from typing import List
 
 
@@ -10,6 +11,10 @@ def get_by_id(db: Session, user_id: int) -> User:
     return db.query(User).filter(User.id == user_id).first()
 
 
+async def get_by_id_async(db: AsyncSession, user_id: int) -> User:
+    return await db.get(User, user_id)
+
+
 def get_by_email(db: Session, email: str) -> User:
     return db.query(User).filter(User.email == email).first()
 
@@ -33,6 +38,7 @@ def update(db: Session, user: User, user_in: UserUpdate) -> User:
     for key, value in update_data.items():
         setattr(user, key, value)
     db.commit()
+    invalidate_principal(user.id)
     db.refresh(user)
     return user
 
@@ -49,5 +55,6 @@ def verify(db: Session, user_id: int) -> User:
     if user:
         user.is_verified = True
         db.commit()
+        invalidate_principal(user_id)
         db.refresh(user)  # ✅ Refresh to get updated data
     return user  # ✅ Return the user object
\ No newline at end of file
@@ -0,0 +1,15 @@
+import orjson
+
+
+def _default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def encode_frame(message: dict) -> str:
+    """
+    Encode a WebSocket frame once so it can be pushed to every socket as-is.
+    datetimes become ISO-8601 strings and enums their value, same as the old hand-written calls.
+    """
+    return orjson.dumps(message, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
@@ -0,0 +1,27 @@
+from typing import Any, BinaryIO, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+
+from app.core.config import settings
+
+
+async def spool_upload(file: UploadFile, max_size: int, detail: str, hasher: Optional[Any] = None) -> Tuple[BinaryIO, int]:
+    """
+    Check an upload's size chunk by chunk and hand back its rewound file object with the size.
+    The multipart parser has already spooled the part to a SpooledTemporaryFile, so large
+    uploads sit on disk and at most one chunk is held in memory here.
+    A hashlib object passed as `hasher` is fed the chunks on the way.
+    """
+    size = 0
+    await file.seek(0)
+    while True:
+        chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+        if size > max_size:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+    await file.seek(0)
+    return file.file, size
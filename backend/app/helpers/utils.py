@@ -1,6 +1,7 @@
+import base64
 import uuid
 from datetime import datetime
-from typing import Any
+from typing import Any, Optional, Tuple
 
 def generate_id() -> str:
     return str(uuid.uuid4())
@@ -13,4 +14,18 @@ def paginate(query, page: int = 1, size: int = 20):
     total = query.count()
     items = query.offset(offset).limit(size).all()
     pages = (total + size - 1) // size
-    return items, total, page, size, pages
\ No newline at end of file
+    return items, total, page, size, pages
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Opaque keyset cursor for the (created_at, id) position of a row"""
+    raw = f"{created_at.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """Inverse of encode_cursor; None when the token is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, UnicodeDecodeError):
+        return None
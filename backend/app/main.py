@@ -2,21 +2,51 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
-from app.api.v1.routers import auth, users, chats, diaries, websockets, friends, groups, avatar, notes, message
-from app.models import base
-from app.core.database import engine
+from app.api.v1.routers import auth, users, chats, diaries, websockets, friends, groups, avatar, notes, message, health
+from app.migrate import check_schema
+from app.services.chat_event_pruner import chat_event_pruner
+from app.services.image_pipeline import image_pipeline
+from app.services.media_deleter import media_deleter
+from app.services.realtime_publisher import realtime_publisher
+from app.services.receipt_buffer import receipt_buffer
+from app.services.storage import storage
+from app.services.unread_counters import unread_counters
+from app.services.websocket_manager import manager
+from contextlib import asynccontextmanager
 import os
 
 from app.core.cloudinary import configure_cloudinary
 
-# Create database tables
-base.Base.metadata.create_all(bind=engine)
+# Tables, indexes and backfills are set up once per deploy by `python -m app.migrate`, not per worker;
+# workers only check on startup that it has run
 
 # Configure Cloudinary
 configure_cloudinary()  # ADDED
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fail fast rather than serve requests that would hit missing tables or indexes
+    check_schema()
+    # Join the WebSocket backplane before accepting sockets
+    await manager.start()
+    await unread_counters.start()
+    await chat_event_pruner.start()
+    await realtime_publisher.start()
+    await media_deleter.start()
+    yield
+    await media_deleter.stop()
+    await realtime_publisher.stop()
+    await chat_event_pruner.stop()
+    await unread_counters.stop()
+    # Write out buffered receipts while the backplane can still deliver them
+    await receipt_buffer.flush_all()
+    await manager.stop()
+    storage.shutdown()
+    image_pipeline.shutdown()
+
 app = FastAPI(
     title="Whisper Space",
+    lifespan=lifespan,
 )
 
 # CORS middleware - UPDATED with your React domain
@@ -31,6 +61,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"], 
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include API routers
@@ -44,6 +75,8 @@ app.include_router(websockets.router, prefix="/api/v1/ws", tags=["websockets"])
 app.include_router(notes.router, prefix="/api/v1/notes", tags=["notes"])
 app.include_router(avatar.router, prefix="/api/v1/avatars", tags=["avatars"])
 app.include_router(message.router, prefix="/api/v1/messages", tags=["messages"])
+# Internal diagnostics behind X-Health-Token; included before the static mount, which answers every other path
+app.include_router(health.router, prefix="/api/v1/health", tags=["health"])
 
 # Create static directories
 os.makedirs("static/avatars", exist_ok=True)
@@ -0,0 +1,65 @@
+"""
+Schema changes and one-off data backfills, run once per deploy before the workers start:
+
+    python -m app.migrate
+
+They used to run on import of app.main, i.e. in every worker at once. A Postgres advisory lock
+now serialises concurrent runs, and every step is idempotent, so a second run is a no-op.
+"""
+import importlib
+import pkgutil
+from sqlalchemy import func, select
+import app.models
+from app.core.database import engine, ensure_columns, ensure_indexes, get_session, missing_schema
+from app.crud.chat import backfill_reply_previews
+from app.crud.conversation import backfill_conversations
+from app.crud.message import backfill_read_watermarks
+from app.models.base import Base
+
+# Arbitrary key shared by every migrate run (pg_advisory_lock takes a bigint)
+MIGRATION_LOCK_ID = 0x77_68_69_73_70_65_72  # "whisper"
+
+
+def _import_models() -> None:
+    for module in pkgutil.iter_modules(app.models.__path__):
+        importlib.import_module(f"app.models.{module.name}")
+
+
+def check_schema() -> None:
+    """Called by each worker on startup: refuse to serve against a database migrate hasn't caught up"""
+    _import_models()
+    missing = missing_schema(Base.metadata)
+    if missing:
+        raise RuntimeError(f"Database schema is behind the models (missing {', '.join(missing)}); run `python -m app.migrate` first")
+
+
+def migrate() -> None:
+    _import_models()
+
+    with engine.connect() as lock:
+        # Held by this connection until unlocked, so concurrent runs wait instead of racing on DDL
+        lock.execute(select(func.pg_advisory_lock(MIGRATION_LOCK_ID)))
+        try:
+            Base.metadata.create_all(bind=engine)
+            ensure_columns(Base.metadata)
+            ensure_indexes(Base.metadata)
+
+            # Group receipts from per-message rows to read watermarks
+            with get_session() as db:
+                backfill_read_watermarks(db)
+
+            # Inbox summaries from existing history the first time the table exists
+            with get_session() as db:
+                backfill_conversations(db)
+
+            # Reply previews for replies written before they were stored on the row
+            with get_session() as db:
+                backfill_reply_previews(db)
+        finally:
+            lock.execute(select(func.pg_advisory_unlock(MIGRATION_LOCK_ID)))
+            lock.commit()
+
+
+if __name__ == "__main__":
+    migrate()
+    print("[DB] Migrations done")
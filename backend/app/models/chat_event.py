@@ -0,0 +1,27 @@
+# app/models/chat_event.py
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index, String, BigInteger
+from sqlalchemy.dialects.postgresql import JSONB
+from app.models.base import Base
+from datetime import datetime, timezone
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class ChatEvent(Base):
+    """
+    One change a user's clients need to catch up on after a reconnect: a message created,
+    edited or deleted, or a receipt, in any of the user's chats. Numbered per user by seq.
+    """
+    __tablename__ = "chat_events"
+    __table_args__ = (
+        Index("uq_chat_events_user_seq", "user_id", "seq", unique=True),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(BigInteger, nullable=False)
+    kind = Column(String(30), nullable=False)
+    chat_id = Column(String(50), nullable=False)  # same ids as the WebSocket rooms: private_<a>_<b> / group_<id>
+    message_id = Column(Integer, nullable=True)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=utcnow, index=True)
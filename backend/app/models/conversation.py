@@ -0,0 +1,40 @@
+# app/models/conversation.py
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index, String, text
+from sqlalchemy.orm import relationship
+from app.models.base import Base
+from datetime import datetime, timezone
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class Conversation(Base):
+    """
+    One inbox entry per user and chat: a friend (peer_id) or a group (group_id).
+    Kept current as messages and receipts are written, so the conversation list is one index scan.
+    """
+    __tablename__ = "conversations"
+    __table_args__ = (
+        Index("uq_conversations_user_peer", "user_id", "peer_id", unique=True),
+        Index("uq_conversations_user_group", "user_id", "group_id", unique=True),
+        # The inbox is read per user, most recent chat first
+        Index("ix_conversations_user_last_message", "user_id", "last_message_at", "id"),
+        # Badge counts only ever read the chats that have something unread
+        Index("ix_conversations_user_unread", "user_id", postgresql_where=text("unread_count > 0")),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    peer_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=True)
+
+    # Ids point into private_messages or group_messages depending on which of peer_id/group_id is set
+    last_message_id = Column(Integer, nullable=True)
+    last_sender_id = Column(Integer, nullable=True)
+    last_message_type = Column(String(20), nullable=True)
+    last_message_preview = Column(String(200), nullable=True)
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    unread_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+
+    peer = relationship("User", foreign_keys=[peer_id])
+    group = relationship("Group")
@@ -0,0 +1,27 @@
+# app/models/group_event.py
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index, String, BigInteger
+from sqlalchemy.dialects.postgresql import JSONB
+from app.models.base import Base
+from datetime import datetime, timezone
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class GroupEvent(Base):
+    """
+    One change in a group chat for its members to catch up on: a message created, edited or deleted,
+    or read watermarks moving. Numbered per group by seq, so a group write appends a single row
+    however many members there are; /chats/sync returns it next to each member's own events.
+    """
+    __tablename__ = "group_events"
+    __table_args__ = (
+        Index("uq_group_events_group_seq", "group_id", "seq", unique=True),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(BigInteger, nullable=False)
+    kind = Column(String(30), nullable=False)
+    message_id = Column(Integer, nullable=True)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=utcnow, index=True)
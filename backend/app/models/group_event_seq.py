@@ -0,0 +1,13 @@
+# app/models/group_event_seq.py
+from sqlalchemy import Column, Integer, ForeignKey, BigInteger
+from app.models.base import Base
+
+class GroupEventSeq(Base):
+    """
+    Head of each group's event sequence. Bumping it row-locks the group until commit,
+    so the group's events become visible in seq order with no gaps.
+    """
+    __tablename__ = "group_event_seqs"
+
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(BigInteger, nullable=False, default=0)
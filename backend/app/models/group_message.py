@@ -1,5 +1,5 @@
 # app/models/group_message.py
-from sqlalchemy import Column, Enum, Boolean, DateTime, ForeignKey, Text, Integer, String
+from sqlalchemy import Column, Enum, Boolean, DateTime, ForeignKey, Index, Text, Integer, String
 from sqlalchemy.orm import relationship
 from app.models.base import Base
 from datetime import datetime, timezone
@@ -19,6 +19,10 @@ class MessageType(enum.Enum):
 
 class GroupMessage(Base):
     __tablename__ = "group_messages"
+    __table_args__ = (
+        # Keyset pagination of a group's history walks this index backwards
+        Index("ix_group_messages_group_created_id", "group_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
@@ -0,0 +1,26 @@
+# app/models/group_read_watermark.py
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy.orm import relationship
+from app.models.base import Base
+from datetime import datetime, timezone
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class GroupReadWatermark(Base):
+    """
+    How far each member has read a group: every message with id <= last_read_message_id counts as seen.
+    One row per (group, user), so receipts grow with members instead of members x messages.
+    """
+    __tablename__ = "group_read_watermarks"
+    __table_args__ = (
+        UniqueConstraint("group_id", "user_id", name="uq_group_read_watermarks_group_user"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    last_read_message_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+
+    user = relationship("User")
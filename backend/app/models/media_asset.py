@@ -0,0 +1,34 @@
+# app/models/media_asset.py
+from sqlalchemy import BigInteger, Column, ForeignKey, Integer, DateTime, Index, String
+from app.models.base import Base
+from datetime import datetime, timezone
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class MediaAsset(Base):
+    """
+    One row per remote object: its content hash and how many messages use it. A fresh upload
+    starts at zero and is destroyed after a while unless a message claims it.
+    Re-uploading the same bytes reuses the row, and the remote object is only destroyed at zero.
+    Objects uploaded before the registry have no digest and get a row when first shared.
+    """
+    __tablename__ = "media_assets"
+    __table_args__ = (
+        # Same bytes uploaded with the same options produce the same object
+        Index("uq_media_assets_digest_kind", "digest", "kind", unique=True),
+        Index("uq_media_assets_public_id", "public_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    digest = Column(String(64), nullable=True)  # BLAKE2b-256 hex of the uploaded bytes
+    kind = Column(String(32), nullable=False)  # upload flavour, e.g. chat_image or group_image
+    public_id = Column(String(255), nullable=False)
+    resource_type = Column(String(16), nullable=False, default="image")
+    url = Column(String(1024), nullable=True)
+    size = Column(BigInteger, nullable=True)
+    # Who uploaded it, so they can discard it again before any message uses it
+    uploader_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
@@ -0,0 +1,28 @@
+# app/models/media_deletion.py
+from sqlalchemy import Column, Integer, DateTime, Index, String, Text, text
+from app.models.base import Base
+from datetime import datetime, timezone
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class MediaDeletion(Base):
+    """
+    Outbox of remote objects to destroy. Rows are written in the same transaction that stops
+    using the object and removed by the media deleter once Cloudinary confirms the delete.
+    """
+    __tablename__ = "media_deletions"
+    __table_args__ = (
+        Index("uq_media_deletions_public_id", "public_id", "resource_type", unique=True),
+        # The deleter only ever reads rows that are due
+        Index("ix_media_deletions_due", "next_attempt_at", postgresql_where=text("next_attempt_at IS NOT NULL")),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    public_id = Column(String(255), nullable=False)
+    resource_type = Column(String(16), nullable=False, default="image")
+    attempts = Column(Integer, nullable=False, default=0)
+    # NULL once the deleter has given up; the row stays for inspection
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True, default=utcnow)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=utcnow)
@@ -1,10 +1,15 @@
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Boolean, Index
 from sqlalchemy.orm import relationship
 from app.models.base import Base
 from datetime import datetime
 
 class MessageSeenStatus(Base):
     __tablename__ = "message_seen_status"
+    __table_args__ = (
+        # One receipt per reader; bulk inserts rely on it with ON CONFLICT DO NOTHING.
+        # Older databases hold repeated receipts, which ensure_indexes may delete (they carry nothing extra)
+        Index("uq_message_seen_status_message_user", "message_id", "user_id", unique=True, info={"dedupe": True}),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     message_id = Column(Integer, ForeignKey("private_messages.id", ondelete="CASCADE"), nullable=False)  # ADD CASCADE
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Enum, Boolean, DateTime, Float, ForeignKey, Text, Integer, String
+from sqlalchemy import Column, Enum, Boolean, DateTime, Float, ForeignKey, Index, Text, Integer, String, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from app.models.base import Base
 from datetime import datetime
@@ -12,6 +13,12 @@ class MessageType(enum.Enum):
 
 class PrivateMessage(Base):
     __tablename__ = "private_messages"
+    __table_args__ = (
+        # Chat history is read per (sender, receiver) direction, newest first
+        Index("ix_private_messages_pair_created", "sender_id", "receiver_id", "created_at"),
+        # Only unread rows, so "anything unread from this sender?" stays one small probe
+        Index("ix_private_messages_unread", "receiver_id", "sender_id", postgresql_where=text("is_read = false")),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     sender_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -28,6 +35,8 @@ class PrivateMessage(Base):
     original_sender = Column(String(255), nullable=True)
     voice_duration = Column(Float, nullable=True)
     file_size = Column(Integer, nullable=True)  
+    # ReplyPreview of reply_to, written with the message and kept current when the original is edited or deleted
+    reply_preview = Column(JSONB(none_as_null=True), nullable=True)
 
     # FIXED: Self-referencing relationship for replies
     reply_to = relationship(
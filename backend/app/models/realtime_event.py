@@ -0,0 +1,22 @@
+# app/models/realtime_event.py
+from sqlalchemy import Column, DateTime, String, BigInteger
+from sqlalchemy.dialects.postgresql import JSONB
+from app.models.base import Base
+from datetime import datetime, timezone
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+class RealtimeEvent(Base):
+    """
+    Outbox of WebSocket frames written by REST handlers in the same transaction as the change
+    they announce. The realtime publisher broadcasts them in id order and then deletes them.
+    """
+    __tablename__ = "realtime_outbox"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    room = Column(String(50), nullable=False)  # WebSocket room: private_<a>_<b> / group_<id> / inbox_<id>
+    payload = Column(JSONB, nullable=False)
+    # Set while a publisher holds the row; expired claims are picked up again
+    claimed_until = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=utcnow)
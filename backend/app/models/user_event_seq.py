@@ -0,0 +1,13 @@
+# app/models/user_event_seq.py
+from sqlalchemy import Column, Integer, ForeignKey, BigInteger
+from app.models.base import Base
+
+class UserEventSeq(Base):
+    """
+    Head of each user's chat event sequence. Bumping it row-locks the user until commit,
+    so a user's events become visible in seq order with no gaps.
+    """
+    __tablename__ = "user_event_seqs"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(BigInteger, nullable=False, default=0)
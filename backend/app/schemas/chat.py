@@ -171,6 +171,65 @@ class MarkMessagesAsReadResponse(BaseModel):
     message_ids: List[int]    
     
     
+class ConversationGroup(BaseModel):
+    id: int
+    name: str
+
+class ConversationOut(BaseModel):
+    """One inbox entry: a private chat (peer) or a group chat (group)"""
+    id: int
+    peer: Optional[AuthorResponse] = None
+    group: Optional[ConversationGroup] = None
+    last_message_id: Optional[int] = None
+    last_sender_id: Optional[int] = None
+    last_message_type: Optional[str] = None
+    last_message_preview: Optional[str] = None
+    last_message_at: Optional[datetime] = None
+    unread_count: int = 0
+
+    class Config:
+        from_attributes = True
+
+class ChatEventOut(BaseModel):
+    seq: int
+    kind: str
+    chat_id: str
+    message_id: Optional[int] = None
+    payload: dict
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class GroupEventOut(BaseModel):
+    seq: int
+    kind: str
+    message_id: Optional[int] = None
+    payload: dict
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class GroupSyncOut(BaseModel):
+    """Changes in one group's own sequence; reset means reload that group"""
+    group_id: int
+    events: List[GroupEventOut]
+    cursor: int
+    has_more: bool = False
+    reset: bool = False
+
+class ChatSyncOut(BaseModel):
+    """
+    Changes since the client's cursors; on reset the client reloads its chats and starts over from cursor.
+    Private chats come from the user's sequence, each group from its own; clients merge them by time.
+    """
+    events: List[ChatEventOut]
+    cursor: int
+    has_more: bool = False
+    reset: bool = False
+    groups: List[GroupSyncOut] = []
+
 class GroupMessageSeen(BaseModel):
     id: int
     user: AuthorResponse    
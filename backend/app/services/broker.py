@@ -0,0 +1,256 @@
+from __future__ import annotations
+import asyncio
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional, Set
+from app.core.config import settings
+
+MessageHandler = Callable[[str, str], None]
+
+
+class Broker(ABC):
+    """
+    Backplane shared by every worker: pub/sub channels for room frames and a presence registry.
+    A single-process deployment uses InMemoryBroker; more workers or replicas need RedisBroker.
+    """
+
+    # False when every socket lives in this process, so publishing would only echo back to us
+    distributed = False
+
+    @abstractmethod
+    async def start(self, on_message: MessageHandler) -> None: ...
+
+    @abstractmethod
+    async def stop(self) -> None: ...
+
+    @abstractmethod
+    async def publish(self, channel: str, data: str) -> None: ...
+
+    @abstractmethod
+    async def subscribe(self, channel: str) -> None: ...
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str) -> None: ...
+
+    @abstractmethod
+    async def presence_add(self, room: str, user_id: int) -> None: ...
+
+    @abstractmethod
+    async def presence_remove(self, room: str, user_id: int) -> None: ...
+
+    @abstractmethod
+    async def presence_members(self, room: str) -> Set[int]: ...
+
+
+class InMemoryBroker(Broker):
+    def __init__(self) -> None:
+        self._on_message: Optional[MessageHandler] = None
+        self._channels: Set[str] = set()
+        self._presence: Dict[str, Dict[int, int]] = {}
+
+    async def start(self, on_message: MessageHandler) -> None:
+        self._on_message = on_message
+
+    async def stop(self) -> None:
+        self._on_message = None
+
+    async def publish(self, channel: str, data: str) -> None:
+        if self._on_message and channel in self._channels:
+            self._on_message(channel, data)
+
+    async def subscribe(self, channel: str) -> None:
+        self._channels.add(channel)
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._channels.discard(channel)
+
+    async def presence_add(self, room: str, user_id: int) -> None:
+        counts = self._presence.setdefault(room, {})
+        counts[user_id] = counts.get(user_id, 0) + 1
+
+    async def presence_remove(self, room: str, user_id: int) -> None:
+        counts = self._presence.get(room)
+        if not counts or user_id not in counts:
+            return
+        counts[user_id] -= 1
+        if counts[user_id] <= 0:
+            del counts[user_id]
+        if not counts:
+            del self._presence[room]
+
+    async def presence_members(self, room: str) -> Set[int]:
+        return set(self._presence.get(room, {}))
+
+
+class RedisBroker(Broker):
+    """
+    Redis protocol backplane. Pass `client` to use an existing redis.asyncio-compatible client
+    (e.g. fakeredis.aioredis.FakeRedis in tests); otherwise one is created from `url`.
+    Presence is kept per worker: each one writes a hash of user_id -> open socket count per
+    room under its own node id and lists itself in the room's node set. The hashes expire after
+    presence_ttl unless the heartbeat refreshes them, so a worker that dies without cleaning up
+    drops out on its own, and readers sweep its id from the node sets once its hash is gone.
+    """
+
+    distributed = True
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        client=None,
+        prefix: str = "whisper:",
+        presence_ttl: int = 30,
+        node_id: Optional[str] = None,
+    ) -> None:
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as e:
+                raise RuntimeError("REDIS_URL is set but the redis package is not installed") from e
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+        self.node_id = node_id or uuid.uuid4().hex
+        self.presence_ttl = max(1, presence_ttl)
+        # This worker's share of presence; the heartbeat rewrites it so an expired hash comes back
+        self._presence: Dict[str, Dict[int, int]] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    def _presence_key(self, room: str, node_id: Optional[str] = None) -> str:
+        return f"{self.prefix}presence:{room}:{node_id or self.node_id}"
+
+    def _nodes_key(self, room: str) -> str:
+        return f"{self.prefix}presence-nodes:{room}"
+
+    async def start(self, on_message: MessageHandler) -> None:
+        self._pubsub = self.client.pubsub()
+        self._listener = asyncio.create_task(self._listen(on_message))
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def stop(self) -> None:
+        for task in (self._listener, self._heartbeat):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        # Leave straight away instead of waiting for the hashes to expire
+        try:
+            for room in list(self._presence):
+                await self.client.delete(self._presence_key(room))
+                await self.client.srem(self._nodes_key(room), self.node_id)
+        except Exception as e:
+            print(f"[Broker] Failed to clear presence: {e}")
+        self._presence.clear()
+
+    async def _beat(self) -> None:
+        while True:
+            await asyncio.sleep(self.presence_ttl / 3)
+            try:
+                await self.refresh_presence()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Broker] Presence heartbeat failed: {e}")
+
+    async def refresh_presence(self) -> None:
+        """Rewrite this worker's presence and push its expiry out by another presence_ttl"""
+        pipe = self.client.pipeline()
+        for room, counts in self._presence.items():
+            key = self._presence_key(room)
+            pipe.hset(key, mapping={str(user_id): count for user_id, count in counts.items()})
+            pipe.expire(key, self.presence_ttl)
+            pipe.sadd(self._nodes_key(room), self.node_id)
+        await pipe.execute()
+
+    async def _listen(self, on_message: MessageHandler) -> None:
+        while True:
+            await self._subscribed.wait()
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Broker] Redis listener error: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if not message or message.get("type") != "message":
+                continue
+
+            channel = message["channel"]
+            data = message["data"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            if isinstance(data, bytes):
+                data = data.decode()
+            on_message(channel[len(self.prefix):], data)
+
+    async def publish(self, channel: str, data: str) -> None:
+        await self.client.publish(self.prefix + channel, data)
+
+    async def subscribe(self, channel: str) -> None:
+        await self._pubsub.subscribe(self.prefix + channel)
+        self._subscribed.set()
+
+    async def unsubscribe(self, channel: str) -> None:
+        await self._pubsub.unsubscribe(self.prefix + channel)
+
+    async def presence_add(self, room: str, user_id: int) -> None:
+        counts = self._presence.setdefault(room, {})
+        counts[user_id] = counts.get(user_id, 0) + 1
+        key = self._presence_key(room)
+        pipe = self.client.pipeline()
+        pipe.hset(key, str(user_id), counts[user_id])
+        pipe.expire(key, self.presence_ttl)
+        pipe.sadd(self._nodes_key(room), self.node_id)
+        await pipe.execute()
+
+    async def presence_remove(self, room: str, user_id: int) -> None:
+        counts = self._presence.get(room)
+        if not counts or user_id not in counts:
+            return
+        counts[user_id] -= 1
+        key = self._presence_key(room)
+        if counts[user_id] > 0:
+            await self.client.hset(key, str(user_id), counts[user_id])
+            return
+        del counts[user_id]
+        await self.client.hdel(key, str(user_id))
+        if not counts:
+            del self._presence[room]
+            await self.client.srem(self._nodes_key(room), self.node_id)
+
+    async def presence_members(self, room: str) -> Set[int]:
+        nodes = [node.decode() if isinstance(node, bytes) else node for node in await self.client.smembers(self._nodes_key(room))]
+        if not nodes:
+            return set()
+        pipe = self.client.pipeline()
+        for node in nodes:
+            pipe.hgetall(self._presence_key(room, node))
+        members, dead = set(), []
+        for node, counts in zip(nodes, await pipe.execute()):
+            if not counts:
+                # Expired: the worker stopped heartbeating without leaving
+                dead.append(node)
+                continue
+            members.update(int(user_id) for user_id, count in counts.items() if int(count) > 0)
+        if dead:
+            await self.client.srem(self._nodes_key(room), *dead)
+        return members
+
+
+def create_broker() -> Broker:
+    if settings.REDIS_URL:
+        return RedisBroker(
+            url=settings.REDIS_URL,
+            prefix=settings.BROKER_CHANNEL_PREFIX,
+            presence_ttl=settings.BROKER_PRESENCE_TTL_SECONDS,
+        )
+    return InMemoryBroker()
@@ -0,0 +1,45 @@
+from __future__ import annotations
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.core.config import settings
+from app.core.database import get_session
+from app.core.db_executor import run_db
+from app.crud.chat_event import prune_chat_events
+
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+def _prune(retention_days: int) -> int:
+    with get_session() as db:
+        return prune_chat_events(db, datetime.now(timezone.utc) - timedelta(days=retention_days))
+
+
+class ChatEventPruner:
+    """Hourly delete of sync events past the retention window, so chat_events stays bounded"""
+
+    def __init__(self, retention_days: int = 14) -> None:
+        self.retention_days = retention_days
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.retention_days > 0:
+            self._task = asyncio.create_task(self._prune_forever())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _prune_forever(self) -> None:
+        while True:
+            try:
+                deleted = await run_db(_prune, self.retention_days)
+                if deleted:
+                    print(f"[Sync] Pruned {deleted} chat events")
+            except Exception as e:
+                print(f"[Sync] Pruning chat events failed: {e}")
+            await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+
+
+chat_event_pruner = ChatEventPruner(retention_days=settings.CHAT_EVENT_RETENTION_DAYS)
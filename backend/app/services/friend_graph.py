@@ -0,0 +1,71 @@
+from __future__ import annotations
+from typing import FrozenSet, NamedTuple
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.helpers.cache import TTLCache
+from app.models.friend import Friend, FriendshipStatus
+
+
+class Adjacency(NamedTuple):
+    """Everything one user's friends rows say, split by status and direction"""
+    friends: FrozenSet[int]
+    blocked: FrozenSet[int]       # users this user blocked
+    blocked_by: FrozenSet[int]    # users who blocked this user
+    pending_out: FrozenSet[int]   # requests this user sent
+    pending_in: FrozenSet[int]    # requests this user received
+
+
+# user id -> Adjacency. Entries are replaced, never mutated, and dropped by invalidate_friendship
+_cache = TTLCache(
+    "friend_graph",
+    max_size=settings.FRIEND_CACHE_SIZE,
+    ttl=settings.FRIEND_CACHE_TTL_SECONDS,
+)
+
+
+def _rows_statement(user_id: int):
+    return select(Friend.user_id, Friend.friend_id, Friend.status).where(
+        or_(Friend.user_id == user_id, Friend.friend_id == user_id)
+    )
+
+
+def _build(user_id: int, rows) -> Adjacency:
+    friends, blocked, blocked_by, pending_out, pending_in = set(), set(), set(), set(), set()
+    for requester_id, addressee_id, status in rows:
+        outgoing = requester_id == user_id
+        other = addressee_id if outgoing else requester_id
+        if status == FriendshipStatus.accepted:
+            friends.add(other)
+        elif status == FriendshipStatus.blocked:
+            (blocked if outgoing else blocked_by).add(other)
+        elif status == FriendshipStatus.pending:
+            (pending_out if outgoing else pending_in).add(other)
+    return Adjacency(
+        frozenset(friends), frozenset(blocked), frozenset(blocked_by),
+        frozenset(pending_out), frozenset(pending_in)
+    )
+
+
+def get_adjacency(db: Session, user_id: int) -> Adjacency:
+    adjacency = _cache.get(user_id)
+    if adjacency is None:
+        adjacency = _build(user_id, db.execute(_rows_statement(user_id)).all())
+        _cache.set(user_id, adjacency)
+    return adjacency
+
+
+async def get_adjacency_async(db: AsyncSession, user_id: int) -> Adjacency:
+    adjacency = _cache.get(user_id)
+    if adjacency is None:
+        result = await db.execute(_rows_statement(user_id))
+        adjacency = _build(user_id, result.all())
+        _cache.set(user_id, adjacency)
+    return adjacency
+
+
+def invalidate_friendship(user_id: int, other_id: int) -> None:
+    """Call after any change to the friends row between the two users"""
+    _cache.invalidate(user_id)
+    _cache.invalidate(other_id)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+from typing import FrozenSet, Iterable
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.helpers.cache import TTLCache
+from app.models.group_member import GroupMember
+
+
+# group id -> member ids, and user id -> group ids. Entries are replaced, never mutated
+_members = TTLCache(
+    "group_members",
+    max_size=settings.MEMBERSHIP_CACHE_SIZE,
+    ttl=settings.MEMBERSHIP_CACHE_TTL_SECONDS,
+)
+_groups = TTLCache(
+    "user_groups",
+    max_size=settings.MEMBERSHIP_CACHE_SIZE,
+    ttl=settings.MEMBERSHIP_CACHE_TTL_SECONDS,
+)
+
+
+def get_member_ids(db: Session, group_id: int) -> FrozenSet[int]:
+    member_ids = _members.get(group_id)
+    if member_ids is None:
+        member_ids = frozenset(db.execute(
+            select(GroupMember.user_id).where(GroupMember.group_id == group_id)
+        ).scalars())
+        _members.set(group_id, member_ids)
+    return member_ids
+
+
+async def get_member_ids_async(db: AsyncSession, group_id: int) -> FrozenSet[int]:
+    member_ids = _members.get(group_id)
+    if member_ids is None:
+        result = await db.execute(
+            select(GroupMember.user_id).where(GroupMember.group_id == group_id)
+        )
+        member_ids = frozenset(result.scalars())
+        _members.set(group_id, member_ids)
+    return member_ids
+
+
+def get_group_ids(db: Session, user_id: int) -> FrozenSet[int]:
+    group_ids = _groups.get(user_id)
+    if group_ids is None:
+        group_ids = frozenset(db.execute(
+            select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+        ).scalars())
+        _groups.set(user_id, group_ids)
+    return group_ids
+
+
+def is_member(db: Session, group_id: int, user_id: int) -> bool:
+    # Either index answers the question; use whichever is already warm before loading one
+    group_ids = _groups.get(user_id)
+    if group_ids is not None:
+        return group_id in group_ids
+    return user_id in get_member_ids(db, group_id)
+
+
+def invalidate_membership(group_id: int, user_ids: Iterable[int]) -> None:
+    """Call after members join or leave the group"""
+    _members.invalidate(group_id)
+    for user_id in user_ids:
+        _groups.invalidate(user_id)
+
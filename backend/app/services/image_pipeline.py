@@ -0,0 +1,136 @@
+from __future__ import annotations
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Dict, NamedTuple, Optional, Set
+from fastapi import HTTPException, status
+from app.core.config import settings
+
+# Leading bytes of the formats we accept, for when libmagic is unavailable
+SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+}
+
+# What the .png/.jpg/.jpeg uploads have to actually contain
+IMAGE_MIME_TYPES = {"image/png", "image/jpeg"}
+
+FORMATS = {"webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg")}
+
+
+class ProcessedImage(NamedTuple):
+    content: bytes
+    extension: str
+    mime: str
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """MIME type from the file's magic bytes, never from its name or the client's content type"""
+    try:
+        import magic
+        return magic.from_buffer(head, mime=True)
+    except Exception:
+        # python-magic is installed but libmagic may not be
+        pass
+    for signature, mime in SIGNATURES.items():
+        if head.startswith(signature):
+            return mime
+    return None
+
+
+def _render(data: bytes, size: int, fmt: str, quality: int, max_pixels: int) -> Optional[bytes]:
+    """
+    Runs in a worker process: decode, square-crop to size x size and re-encode.
+    Returns None when Pillow is missing, so the caller falls back to remote transformations.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        image = ImageOps.exif_transpose(image)
+        if fmt == "JPEG":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        image = ImageOps.fit(image, (size, size), method=Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format=fmt, quality=quality, optimize=True)
+        return out.getvalue()
+
+
+class ImagePipeline:
+    """
+    Local processing stage in front of image uploads: checks the magic bytes, then decodes and
+    resizes in a process pool so the CPU work neither blocks the event loop nor holds the GIL.
+    Only the small variant is uploaded instead of the full-size original.
+    """
+
+    def __init__(self, workers: int = 2, fmt: str = "webp", quality: int = 80, max_pixels: int = 40_000_000) -> None:
+        self.workers = max(1, workers)
+        self.format, self.extension = FORMATS.get(fmt, FORMATS["webp"])
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.stats: Dict[str, int] = {"processed": 0, "rejected": 0, "passthrough": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Created on first use, and spawned rather than forked from a process running threads
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def prepare(self, file: BinaryIO, allowed: Set[str], size: int) -> Optional[ProcessedImage]:
+        """
+        Validate an already size-checked upload and render its size x size variant.
+        Raises 400 for files that are not really one of the allowed image types; returns None
+        when local processing is unavailable and the original should be uploaded as before.
+        """
+        file.seek(0)
+        data = file.read()
+        file.seek(0)
+
+        if sniff_mime(data[:2048]) not in allowed:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="File content is not a PNG or JPG image")
+
+        loop = asyncio.get_running_loop()
+        try:
+            rendered = await loop.run_in_executor(
+                self._pool(), _render, data, size, self.format, self.quality, self.max_pixels
+            )
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. out of memory on a hostile file); start a fresh pool next time
+                self._executor = None
+            self.stats["rejected"] += 1
+            print(f"[Images] Could not decode upload: {e}")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Image could not be decoded")
+
+        if rendered is None:
+            self.stats["passthrough"] += 1
+            return None
+
+        self.stats["processed"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(rendered)
+        return ProcessedImage(rendered, self.extension, f"image/{self.format.lower()}")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_pipeline = ImagePipeline(
+    workers=settings.IMAGE_WORKERS,
+    fmt=settings.IMAGE_FORMAT,
+    quality=settings.IMAGE_QUALITY,
+    max_pixels=settings.IMAGE_MAX_PIXELS,
+)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.database import get_session
+from app.core.db_executor import run_db
+from app.crud.media import claim_media_deletions, count_pending_deletions, expire_unclaimed_media, finish_media_deletions
+from app.services.storage import storage
+
+# Cloudinary's limit for one delete_resources call
+MAX_BATCH = 100
+
+
+def _claim(limit: int, lease_seconds: int) -> List[Tuple[int, str, str, int]]:
+    with get_session() as db:
+        return claim_media_deletions(db, limit, lease_seconds)
+
+
+def _finish(done: List[int], failed: Dict[int, Tuple[int, str]], retry_base_seconds: int, max_attempts: int) -> int:
+    with get_session() as db:
+        return finish_media_deletions(db, done, failed, retry_base_seconds, max_attempts)
+
+
+def _expire(older_than_seconds: int) -> int:
+    with get_session() as db:
+        return expire_unclaimed_media(db, older_than_seconds)
+
+
+def _pending() -> int:
+    with get_session() as db:
+        return count_pending_deletions(db)
+
+
+class MediaDeleter:
+    """
+    Drains the media_deletions outbox: claims due rows, destroys them on Cloudinary in batches
+    per resource type and reschedules failures with backoff. Delete requests only write the row.
+    Uploads that no message claimed within unclaimed_ttl_seconds are queued here as well.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: int = 10,
+        batch_size: int = 100,
+        max_attempts: int = 8,
+        retry_base_seconds: int = 60,
+        unclaimed_ttl_seconds: int = 3600,
+    ) -> None:
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(1, min(batch_size, MAX_BATCH))
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_seconds = retry_base_seconds
+        self.unclaimed_ttl_seconds = unclaimed_ttl_seconds
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"batches": 0, "deleted": 0, "failed": 0, "gave_up": 0, "expired_uploads": 0}
+
+    async def start(self) -> None:
+        if self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._drain_forever())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def drain(self) -> int:
+        """Work through every due deletion; returns how many objects were destroyed"""
+        deleted = 0
+        while True:
+            # A claim outlives every storage attempt, so no other worker picks the rows up meanwhile
+            lease = int(storage.timeout * (storage.retries + 1)) + 60
+            claimed = await run_db(_claim, self.batch_size, lease)
+            if not claimed:
+                return deleted
+            deleted += await self._destroy(claimed)
+            if len(claimed) < self.batch_size:
+                return deleted
+
+    async def _destroy(self, claimed: List[Tuple[int, str, str, int]]) -> int:
+        by_type: Dict[str, List[Tuple[int, str, int]]] = defaultdict(list)
+        for deletion_id, public_id, resource_type, attempts in claimed:
+            by_type[resource_type].append((deletion_id, public_id, attempts))
+
+        done: List[int] = []
+        failed: Dict[int, Tuple[int, str]] = {}
+        for resource_type, rows in by_type.items():
+            self.stats["batches"] += 1
+            try:
+                gone = await storage.delete_many([public_id for _, public_id, _ in rows], resource_type)
+                error = "not deleted"
+            except Exception as e:
+                gone, error = {}, str(e)
+            for deletion_id, public_id, attempts in rows:
+                if gone.get(public_id):
+                    done.append(deletion_id)
+                else:
+                    failed[deletion_id] = (attempts, error)
+
+        gave_up = await run_db(_finish, done, failed, self.retry_base_seconds, self.max_attempts)
+        self.stats["deleted"] += len(done)
+        self.stats["failed"] += len(failed)
+        self.stats["gave_up"] += gave_up
+        if failed:
+            print(f"[Media] {len(failed)} deletions failed, {gave_up} given up")
+        return len(done)
+
+    async def pending(self) -> int:
+        return await run_db(_pending)
+
+    async def _drain_forever(self) -> None:
+        while True:
+            try:
+                self.stats["expired_uploads"] += await run_db(_expire, self.unclaimed_ttl_seconds)
+                await self.drain()
+            except Exception as e:
+                print(f"[Media] Draining deletions failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+
+media_deleter = MediaDeleter(
+    interval_seconds=settings.MEDIA_DELETE_INTERVAL_SECONDS,
+    batch_size=settings.MEDIA_DELETE_BATCH_SIZE,
+    max_attempts=settings.MEDIA_DELETE_MAX_ATTEMPTS,
+    retry_base_seconds=settings.MEDIA_DELETE_RETRY_SECONDS,
+    unclaimed_ttl_seconds=settings.MEDIA_UNCLAIMED_TTL_SECONDS,
+)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import get_session
+from app.core.db_executor import run_db
+from app.crud.realtime_outbox import REALTIME_QUEUED, claim_realtime_events, delete_realtime_events
+from app.services.websocket_manager import manager
+
+# A claimed batch is broadcast in well under this; expired claims are retried
+CLAIM_LEASE_SECONDS = 30
+
+
+def _claim(limit: int) -> List[Tuple[int, str, dict]]:
+    with get_session() as db:
+        return claim_realtime_events(db, limit, CLAIM_LEASE_SECONDS)
+
+
+def _delete(ids: List[int]) -> None:
+    with get_session() as db:
+        delete_realtime_events(db, ids)
+
+
+class RealtimePublisher:
+    """
+    Broadcasts the frames REST handlers queued with queue_broadcast. A commit that queued
+    frames wakes it straight away; the poll interval only matters for rows left by a crash.
+    Delivery is at least once: a frame may repeat if a publisher dies between send and delete.
+    """
+
+    def __init__(self, batch_size: int = 200, poll_seconds: float = 2.0) -> None:
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"published": 0, "batches": 0, "errors": 0}
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._publish_forever())
+
+    async def stop(self) -> None:
+        self._loop = None
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        # Flush while the backplane is still up; anything left is sent by the next publisher to start
+        try:
+            await self.publish()
+        except Exception as e:
+            print(f"[Realtime] Final outbox flush failed: {e}")
+
+    def committed(self) -> None:
+        """Called from whichever thread committed"""
+        loop, wake = self._loop, self._wake
+        if loop and wake and not loop.is_closed():
+            loop.call_soon_threadsafe(wake.set)
+
+    async def publish(self) -> int:
+        """Broadcast queued frames until the outbox is empty; returns how many went out"""
+        published = 0
+        while True:
+            rows = await run_db(_claim, self.batch_size)
+            if not rows:
+                return published
+            self.stats["batches"] += 1
+            for _, room, payload in rows:
+                await manager.broadcast(room, payload)
+            await run_db(_delete, [row[0] for row in rows])
+            published += len(rows)
+            self.stats["published"] += len(rows)
+            if len(rows) < self.batch_size:
+                return published
+
+    async def _publish_forever(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.publish()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[Realtime] Publishing outbox failed: {e}")
+
+
+realtime_publisher = RealtimePublisher(
+    batch_size=settings.REALTIME_OUTBOX_BATCH_SIZE,
+    poll_seconds=settings.REALTIME_OUTBOX_POLL_SECONDS,
+)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    if session.info.pop(REALTIME_QUEUED, False):
+        realtime_publisher.committed()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session) -> None:
+    session.info.pop(REALTIME_QUEUED, None)
@@ -0,0 +1,126 @@
+from __future__ import annotations
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+from app.core.config import settings
+from app.core.database import get_session
+from app.core.db_executor import run_db
+from app.crud.chat import bulk_mark_as_read
+from app.crud.message import advance_read_watermarks
+from app.helpers.to_utc_iso import to_local_iso
+from app.services.websocket_manager import manager
+from app.utils.chat_helpers import messages_read_frame
+
+
+class _PrivateReader:
+    __slots__ = ("username", "avatar_url", "message_ids")
+
+    def __init__(self, username: str, avatar_url: Optional[str]) -> None:
+        self.username = username
+        self.avatar_url = avatar_url
+        self.message_ids: Set[int] = set()
+
+
+class ReceiptBuffer:
+    """
+    Write-behind buffer for read/seen receipts. Receipts for a chat are collected for
+    RECEIPT_FLUSH_MS, then written in one transaction and broadcast once per reader.
+    Callers flush a chat when a socket leaves it, and everything on shutdown.
+    """
+
+    def __init__(self, interval_ms: int = 150) -> None:
+        self.interval = max(interval_ms, 0) / 1000
+        self._private: Dict[str, Dict[int, _PrivateReader]] = {}
+        self._group: Dict[str, Tuple[int, Dict[int, int]]] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self.stats: Dict[str, int] = {"received": 0, "flushes": 0, "failed_flushes": 0}
+
+    def add_private(self, chat_id: str, reader_id: int, username: str, avatar_url: Optional[str], message_id: int) -> None:
+        readers = self._private.setdefault(chat_id, {})
+        reader = readers.get(reader_id)
+        if reader is None:
+            reader = readers[reader_id] = _PrivateReader(username, avatar_url)
+        reader.message_ids.add(message_id)
+        self._received(chat_id)
+
+    def add_group(self, chat_id: str, group_id: int, user_id: int, message_id: int) -> None:
+        _, positions = self._group.setdefault(chat_id, (group_id, {}))
+        # Watermarks only move forward, so the highest id per user is all that needs writing
+        if message_id > positions.get(user_id, 0):
+            positions[user_id] = message_id
+        self._received(chat_id)
+
+    def _received(self, chat_id: str) -> None:
+        self.stats["received"] += 1
+        if chat_id not in self._timers:
+            self._timers[chat_id] = asyncio.create_task(self._flush_later(chat_id))
+
+    async def _flush_later(self, chat_id: str) -> None:
+        await asyncio.sleep(self.interval)
+        self._timers.pop(chat_id, None)
+        await self._flush(chat_id)
+
+    async def flush(self, chat_id: str) -> None:
+        timer = self._timers.pop(chat_id, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+        await self._flush(chat_id)
+
+    async def flush_all(self) -> None:
+        for chat_id in set(self._private) | set(self._group) | set(self._timers):
+            await self.flush(chat_id)
+
+    async def _flush(self, chat_id: str) -> None:
+        readers = self._private.pop(chat_id, None)
+        group = self._group.pop(chat_id, None)
+        if not readers and not group:
+            return
+
+        self.stats["flushes"] += 1
+        try:
+            if readers:
+                await self._flush_private(chat_id, readers)
+            if group:
+                await self._flush_group(chat_id, *group)
+        except Exception as e:
+            self.stats["failed_flushes"] += 1
+            print(f"[Receipts] Flush failed for {chat_id}: {e}")
+
+    async def _flush_private(self, chat_id: str, readers: Dict[int, _PrivateReader]) -> None:
+        batches = {reader_id: list(reader.message_ids) for reader_id, reader in readers.items()}
+        results = await run_db(_write_private, batches)
+        for reader_id, (read_at, message_ids) in results.items():
+            if message_ids:
+                reader = readers[reader_id]
+                await manager.broadcast(
+                    chat_id,
+                    messages_read_frame(reader_id, reader.username, reader.avatar_url, message_ids, read_at)
+                )
+
+    async def _flush_group(self, chat_id: str, group_id: int, positions: Dict[int, int]) -> None:
+        now, moved = await run_db(_write_group, group_id, positions)
+        for user_id, message_id in moved:
+            await manager.broadcast(chat_id, {
+                "action": "seen",
+                "message_id": message_id,
+                "user_id": user_id,
+                "seen_at": to_local_iso(now, tz_offset_hours=7)
+            })
+
+
+# Flushes run on the DB pool with their own session: the socket's session may be busy meanwhile
+
+def _write_private(batches: Dict[int, List[int]]):
+    with get_session() as db:
+        results = {}
+        for reader_id, message_ids in batches.items():
+            read_at, marked = bulk_mark_as_read(db, reader_id, message_ids=message_ids)
+            results[reader_id] = (read_at, [message_id for message_id, _ in marked])
+        return results
+
+
+def _write_group(group_id: int, positions: Dict[int, int]):
+    with get_session() as db:
+        return advance_read_watermarks(db, group_id, positions)
+
+
+receipt_buffer = ReceiptBuffer(interval_ms=settings.RECEIPT_FLUSH_MS)
@@ -0,0 +1,102 @@
+from __future__ import annotations
+import asyncio
+import functools
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from cloudinary import api, uploader
+from app.core.cloudinary import upload_file, upload_to_cloudinary, upload_voice_message
+from app.core.config import settings
+
+
+def _destroy(public_id: str, resource_type: str = "image") -> bool:
+    result = uploader.destroy(public_id, resource_type=resource_type)
+    return result.get("result") in ("ok", "not found")
+
+
+def _destroy_many(public_ids: List[str], resource_type: str = "image") -> Dict[str, bool]:
+    # The Admin API deletes up to 100 objects per request
+    result = api.delete_resources(public_ids, resource_type=resource_type)
+    deleted = result.get("deleted", {})
+    return {public_id: deleted.get(public_id) in ("deleted", "not_found") for public_id in public_ids}
+
+
+class Storage:
+    """
+    Async facade over the blocking Cloudinary SDK. Calls run on a bounded thread pool of their
+    own, each attempt has a timeout and failures are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, workers: int = 8, timeout: float = 30.0, retries: int = 2, backoff_ms: int = 200) -> None:
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff_ms = backoff_ms
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="storage")
+        self.stats: Dict[str, int] = {"calls": 0, "retries": 0, "timeouts": 0, "failures": 0}
+
+    async def _call(self, fn: Callable[..., Any], *args, retry_timeouts: bool = False, **kwargs) -> Any:
+        """
+        A timed out attempt keeps running on its thread, so it is only retried when asked:
+        a second upload reading the same file object at the same time would corrupt both.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        self.stats["calls"] += 1
+        for attempt in range(self.retries + 1):
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(self._executor, call), self.timeout)
+            except Exception as e:
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                if timed_out:
+                    self.stats["timeouts"] += 1
+                if attempt == self.retries or (timed_out and not retry_timeouts):
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                delay = self.backoff_ms * (2 ** attempt) / 1000
+                print(f"[Storage] {getattr(fn, '__name__', fn)} failed ({e!r}), retrying in ~{delay:.2f}s")
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    async def upload(
+        self,
+        file_content,
+        public_id: Optional[str] = None,
+        folder: Optional[str] = None,
+        resource_type: str = "image",
+        transform: bool = True,
+    ) -> dict:
+        """upload_to_cloudinary: images get the avatar/cover transformation unless transform=False"""
+        return await self._call(
+            upload_to_cloudinary, file_content,
+            public_id=public_id, folder=folder, resource_type=resource_type, transform=transform,
+        )
+
+    async def upload_voice(self, file_content, public_id: Optional[str] = None, folder: str = "voice_messages") -> dict:
+        return await self._call(upload_voice_message, file_content, public_id=public_id, folder=folder)
+
+    async def upload_raw(self, file_content, **options) -> dict:
+        """Upload with explicit Cloudinary options"""
+        return await self._call(upload_file, file_content, **options)
+
+    async def delete(self, public_id: str, resource_type: str = "image") -> bool:
+        """Remove an asset; failures are logged and reported as False, like delete_from_cloudinary"""
+        try:
+            return await self._call(_destroy, public_id, resource_type, retry_timeouts=True)
+        except Exception as e:
+            print(f"Failed to delete from Cloudinary: {e}")
+            return False
+
+    async def delete_many(self, public_ids: List[str], resource_type: str = "image") -> Dict[str, bool]:
+        """Destroy up to 100 objects in one request; maps each public_id to whether it is gone. Raises on failure"""
+        return await self._call(_destroy_many, public_ids, resource_type, retry_timeouts=True)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+storage = Storage(
+    workers=settings.STORAGE_WORKERS,
+    timeout=settings.STORAGE_TIMEOUT_SECONDS,
+    retries=settings.STORAGE_RETRIES,
+    backoff_ms=settings.STORAGE_RETRY_BACKOFF_MS,
+)
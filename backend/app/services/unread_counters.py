@@ -0,0 +1,129 @@
+from __future__ import annotations
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import get_session
+from app.core.db_executor import run_db
+from app.crud.conversation import UNREAD_CHANGED, get_unread_counts, reconcile_unread_counts
+from app.services.websocket_manager import manager
+
+INBOX_ROOM_PREFIX = "inbox_"
+
+# (user_id, peer_id, group_id): which counter of which user changed
+ChangedKey = Tuple[int, Optional[int], Optional[int]]
+
+
+def inbox_room(user_id: int) -> str:
+    """Room of a user's inbox socket; every counter change for the user is pushed there"""
+    return f"{INBOX_ROOM_PREFIX}{user_id}"
+
+
+def unread_counts_frame(user_id: int, rows: List[Tuple[Optional[int], Optional[int], int]]) -> dict:
+    """Full badge state, sent when the inbox socket connects"""
+    return {
+        "action": "unread_counts",
+        "user_id": user_id,
+        "total_unread": sum(count for _, _, count in rows),
+        "private": {str(peer_id): count for peer_id, _, count in rows if peer_id is not None},
+        "groups": {str(group_id): count for _, group_id, count in rows if group_id is not None},
+    }
+
+
+def _changed_frames(changed: Set[ChangedKey]) -> List[Tuple[int, dict]]:
+    with get_session() as db:
+        counts = get_unread_counts(db, {user_id for user_id, _, _ in changed})
+
+    frames = []
+    for user_id, peer_id, group_id in changed:
+        rows = counts[user_id]
+        unread = next((count for p, g, count in rows if p == peer_id and g == group_id), 0)
+        frames.append((user_id, {
+            "action": "unread_changed",
+            "user_id": user_id,
+            "peer_id": peer_id,
+            "group_id": group_id,
+            "unread_count": unread,
+            "total_unread": sum(count for _, _, count in rows),
+        }))
+    return frames
+
+
+class UnreadCounters:
+    """
+    Pushes unread_changed frames to inbox sockets once the transaction that moved a counter
+    commits, and periodically recomputes every counter from the source tables.
+    """
+
+    def __init__(self, reconcile_seconds: int = 900) -> None:
+        self.reconcile_seconds = reconcile_seconds
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconciler: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"pushed": 0, "reconciled": 0, "drifted": 0}
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        if self.reconcile_seconds > 0:
+            self._reconciler = asyncio.create_task(self._reconcile_forever())
+
+    async def stop(self) -> None:
+        self._loop = None
+        if self._reconciler:
+            self._reconciler.cancel()
+            self._reconciler = None
+
+    def committed(self, changed: Set[ChangedKey]) -> None:
+        """Called from whichever thread committed; hands the work to the event loop"""
+        loop = self._loop
+        if loop and not loop.is_closed():
+            loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.push(changed)))
+
+    async def push(self, changed: Set[ChangedKey]) -> None:
+        # With an in-process broker only local inbox sockets can receive the frame
+        if not manager.broker.distributed:
+            changed = {key for key in changed if inbox_room(key[0]) in manager.active_connections}
+        if not changed:
+            return
+        try:
+            for user_id, frame in await run_db(_changed_frames, changed):
+                await manager.broadcast(inbox_room(user_id), frame)
+                self.stats["pushed"] += 1
+        except Exception as e:
+            print(f"[Unread] Push failed: {e}")
+
+    async def reconcile(self) -> int:
+        drifted = await run_db(_reconcile)
+        self.stats["reconciled"] += 1
+        self.stats["drifted"] += drifted
+        if drifted:
+            print(f"[Unread] Reconciled {drifted} drifted counters")
+        return drifted
+
+    async def _reconcile_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.reconcile_seconds)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"[Unread] Reconciliation failed: {e}")
+
+
+def _reconcile() -> int:
+    with get_session() as db:
+        return reconcile_unread_counts(db)
+
+
+unread_counters = UnreadCounters(reconcile_seconds=settings.UNREAD_RECONCILE_SECONDS)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    changed = session.info.pop(UNREAD_CHANGED, None)
+    if changed:
+        unread_counters.committed(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session) -> None:
+    session.info.pop(UNREAD_CHANGED, None)
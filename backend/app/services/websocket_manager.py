@@ -1,67 +1,349 @@
 from __future__ import annotations
-from typing import Dict, Set
+import asyncio
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+import orjson
 from fastapi import WebSocket
+from app.core.config import settings
+from app.helpers.frames import encode_frame
+from app.services.broker import Broker, InMemoryBroker, create_broker
+
+SLOW_CONSUMER_POLICIES = {"drop_oldest", "coalesce", "disconnect"}
+ROOM_CHANNEL_PREFIX = "room:"
+
+# Presence, typing and call signalling mean nothing once missed, so they are never replayed
+EPHEMERAL_KINDS = {
+    "user_online", "online_users", "typing", "ping", "pong",
+    "call_offer", "call_answer", "call_ice", "call_join", "call_leave",
+}
+
+
+def _room_channel(chat_id: str) -> str:
+    return ROOM_CHANNEL_PREFIX + chat_id
+
+
+def _coalesce_key(message: dict) -> tuple:
+    """
+    Frames with the same key describe the same thing, so only the newest one matters.
+    Keys are flat so they survive the JSON round trip through the broker unchanged.
+    """
+    kind = message.get("type") or message.get("action")
+    if "message_ids" in message:
+        # A receipt batch: another batch from the same reader covers other messages
+        return (kind, message.get("reader_id"), ",".join(str(message_id) for message_id in message["message_ids"]))
+    return (
+        kind,
+        message.get("message_id") or message.get("id"),
+        message.get("user_id"),
+        message.get("peer_id"),
+        message.get("group_id"),
+    )
+
+
+def _coalescable(key: tuple) -> bool:
+    """A frame that names nothing beyond its kind can't be told apart from others, so it is never replaced"""
+    return any(part is not None for part in key[1:])
+
+
+class _RoomLog:
+    """
+    The last frames broadcast to one room, numbered from 1, so a reconnecting socket can be
+    replayed what it missed. `epoch` changes whenever the numbering restarts.
+
+    Logs belong to one worker: the numbering and epoch are local, so replay only works when a
+    socket reconnects to the worker it left. Behind a load balancer the epoch of another worker
+    never matches and the client resyncs through /chats/sync instead.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.frames: Deque[Tuple[int, tuple, str]] = deque(maxlen=max(1, size))
+
+    def append(self, message: dict, key: tuple) -> str:
+        self.seq += 1
+        frame = encode_frame({**message, "seq": self.seq})
+        self.frames.append((self.seq, key, frame))
+        return frame
+
+    def since(self, seq: int) -> Optional[List[Tuple[int, tuple, str]]]:
+        """Frames after seq, or None when some of them have already been dropped"""
+        if seq > self.seq:
+            return None
+        oldest = self.frames[0][0] if self.frames else self.seq + 1
+        if seq + 1 < oldest:
+            return None
+        return [entry for entry in self.frames if entry[0] > seq]
+
+
+class _Connection:
+    """
+    Outbound side of a single socket: a bounded frame queue drained by its own writer task,
+    so a slow client only ever delays itself.
+    """
+
+    def __init__(self, manager: "WebSocketManager", chat_id: str, websocket: WebSocket, user_id: int, presence: bool = True) -> None:
+        self.manager = manager
+        self.chat_id = chat_id
+        self.websocket = websocket
+        self.user_id = user_id
+        self.presence = presence
+        self.queue: Deque[Tuple[tuple, str]] = deque()
+        self.max_size = max(1, settings.WS_SEND_QUEUE_SIZE)
+        self.policy = settings.WS_SLOW_CONSUMER_POLICY if settings.WS_SLOW_CONSUMER_POLICY in SLOW_CONSUMER_POLICIES else "drop_oldest"
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    def enqueue(self, frame: str, key: tuple) -> None:
+        if self.closed:
+            return
+
+        if len(self.queue) >= self.max_size:
+            if self.policy == "disconnect":
+                self.manager.stats["slow_disconnects"] += 1
+                self.manager._drop(self)
+                asyncio.create_task(self._close_slow())
+                return
+
+            if self.policy == "coalesce" and self._coalesce(frame, key):
+                self.manager.stats["coalesced"] += 1
+                return
+
+            self.queue.popleft()
+            self.manager.stats["dropped"] += 1
+
+        self.queue.append((key, frame))
+        self._ready.set()
+
+    def _coalesce(self, frame: str, key: tuple) -> bool:
+        # Replace the newest frame with this key so frames for the same thing stay in order
+        if not _coalescable(key):
+            return False
+        for index in range(len(self.queue) - 1, -1, -1):
+            if self.queue[index][0] == key:
+                self.queue[index] = (key, frame)
+                return True
+        return False
+
+    async def _writer(self) -> None:
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                _, frame = self.queue.popleft()
+                await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket is gone; the receive loop of the endpoint will notice as well
+            self.manager._drop(self)
+
+    async def _close_slow(self) -> None:
+        try:
+            await self.websocket.close(code=1013, reason="Client too slow")
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        self.closed = True
+        self.queue.clear()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
 
 class WebSocketManager:
-    def __init__(self) -> None:
-        self.active_connections: Dict[str, Set[WebSocket, dict]] = {}
-        self.online_users: Dict[str, Set[int]] = {}
-
-    async def connect(self, chat_id: str, websocket: WebSocket, user_id: int) -> None:
-        self.active_connections.setdefault(chat_id, {})[websocket] = {"user_id": user_id}
-        self.online_users.setdefault(chat_id, set()).add(user_id)
-        
+    """
+    Local sockets per room plus a Broker that carries frames and presence between workers.
+    Frames are delivered to local sockets straight away and published to the broker only
+    when other workers can be listening.
+    """
+
+    def __init__(self, broker: Optional[Broker] = None) -> None:
+        self.active_connections: Dict[str, Dict[WebSocket, _Connection]] = {}
+        self.broker = broker or InMemoryBroker()
+        self.node_id = uuid.uuid4().hex
+        self.stats: Dict[str, int] = {"dropped": 0, "coalesced": 0, "slow_disconnects": 0, "replayed": 0, "resyncs": 0}
+        self._logs: "OrderedDict[str, _RoomLog]" = OrderedDict()
+
+    async def start(self) -> None:
+        await self.broker.start(self._on_broker_message)
+
+    async def stop(self) -> None:
+        await self.broker.stop()
+
+    async def connect(
+        self,
+        chat_id: str,
+        websocket: WebSocket,
+        user_id: int,
+        resume_from: Optional[int] = None,
+        epoch: Optional[str] = None,
+    ) -> None:
+        conn = _Connection(self, chat_id, websocket, user_id)
+        first_in_room = chat_id not in self.active_connections
+        self.active_connections.setdefault(chat_id, {})[websocket] = conn
+        # Replay before the first await, so no live frame can overtake the missed ones
+        self._resume(conn, resume_from, epoch)
+        if first_in_room:
+            await self.broker.subscribe(_room_channel(chat_id))
+        await self.broker.presence_add(chat_id, user_id)
+
         await self.broadcast(chat_id, {
             "action": "user_online",
             "user_id": user_id
         }, exclude={websocket})
-        
-        await websocket.send_json({
+
+        message = {
             "action": "online_users",
-            "user_ids": list(self.online_users[chat_id])
+            "user_ids": list(await self.get_online_users(chat_id))
+        }
+        conn.enqueue(encode_frame(message), _coalesce_key(message))
+
+    async def attach(self, chat_id: str, websocket: WebSocket, user_id: int) -> None:
+        """
+        Register a socket that only listens to the room: it gets the room's frames but takes no
+        part in presence, so nobody is told it came online and it is sent no resume frame.
+        """
+        conn = _Connection(self, chat_id, websocket, user_id, presence=False)
+        first_in_room = chat_id not in self.active_connections
+        self.active_connections.setdefault(chat_id, {})[websocket] = conn
+        if first_in_room:
+            await self.broker.subscribe(_room_channel(chat_id))
+
+    def _room_log(self, chat_id: str) -> _RoomLog:
+        log = self._logs.get(chat_id)
+        if log is None:
+            log = self._logs[chat_id] = _RoomLog(settings.WS_REPLAY_BUFFER_SIZE)
+            while len(self._logs) > max(1, settings.WS_REPLAY_ROOMS):
+                self._logs.popitem(last=False)
+        else:
+            self._logs.move_to_end(chat_id)
+        return log
+
+    def _record(self, chat_id: str, message: dict, key: tuple) -> str:
+        """Encode a room frame, numbering and keeping it for replay unless it is ephemeral"""
+        if key[0] in EPHEMERAL_KINDS:
+            return encode_frame(message)
+        return self._room_log(chat_id).append(message, key)
+
+    def _resume(self, conn: _Connection, resume_from: Optional[int], epoch: Optional[str]) -> None:
+        """
+        Queue the frames the socket missed, then a resume frame with the room's current position.
+        When they can't be replayed the client gets resync_required and catches up via /chats/sync.
+        """
+        log = self._room_log(conn.chat_id)
+        action, replay = "resume", []
+        if resume_from is not None:
+            missed = log.since(resume_from) if epoch in (None, log.epoch) else None
+            if missed is None:
+                action = "resync_required"
+                self.stats["resyncs"] += 1
+            else:
+                replay = missed
+
+        for _, key, frame in replay:
+            conn.enqueue(frame, key)
+        self.stats["replayed"] += len(replay)
+
+        message = {"action": action, "epoch": log.epoch, "seq": log.seq, "replayed": len(replay)}
+        conn.enqueue(encode_frame(message), _coalesce_key(message))
+
+    async def disconnect(self, chat_id: str, websocket: WebSocket, user_id: Optional[int] = None) -> None:
+        conn = self.active_connections.get(chat_id, {}).get(websocket)
+        if conn:
+            await self._release(conn, self._remove_local(conn))
+
+    def _remove_local(self, conn: _Connection) -> bool:
+        """Forget the socket locally; returns True when it was the last one in its room on this worker"""
+        conn.close()
+        room = self.active_connections.get(conn.chat_id, {})
+        room.pop(conn.websocket, None)
+        if conn.chat_id in self.active_connections and not room:
+            del self.active_connections[conn.chat_id]
+            return True
+        return False
+
+    async def _release(self, conn: _Connection, room_empty: bool) -> None:
+        try:
+            if conn.presence:
+                await self.broker.presence_remove(conn.chat_id, conn.user_id)
+            if room_empty and conn.chat_id not in self.active_connections:
+                await self.broker.unsubscribe(_room_channel(conn.chat_id))
+                # Frames from other workers stop arriving here, so this log can no longer be complete.
+                # Dropping it gives the room a new epoch when it is next joined, and sockets resuming
+                # from the old one resync rather than miss whatever was sent while nobody listened.
+                if self.broker.distributed:
+                    self._logs.pop(conn.chat_id, None)
+        except Exception as e:
+            print(f"[WS] Failed to release {conn.chat_id} for user {conn.user_id}: {e}")
+
+    def _drop(self, conn: _Connection) -> None:
+        if self.active_connections.get(conn.chat_id, {}).get(conn.websocket) is conn:
+            asyncio.create_task(self._release(conn, self._remove_local(conn)))
+        else:
+            conn.close()
+
+    def _deliver(self, chat_id: str, frame: str, key: tuple, user_id: Optional[int] = None, exclude: Set[int] = frozenset()) -> None:
+        for conn in list(self.active_connections.get(chat_id, {}).values()):
+            if id(conn.websocket) in exclude:
+                continue
+            if user_id is not None and conn.user_id != user_id:
+                continue
+            conn.enqueue(frame, key)
+
+    async def _publish(self, chat_id: str, frame: str, key: tuple, user_id: Optional[int] = None, exclude: Set[int] = frozenset()) -> None:
+        if not self.broker.distributed:
+            return
+        envelope = orjson.dumps({
+            "origin": self.node_id,
+            "frame": frame,
+            "key": key,
+            "user_id": user_id,
         })
+        try:
+            await self.broker.publish(_room_channel(chat_id), envelope.decode())
+        except Exception as e:
+            print(f"[WS] Broker publish failed for {chat_id}: {e}")
 
-    def disconnect(self, chat_id: str, websocket: WebSocket, user_id: int) -> None:
-        if chat_id in self.active_connections and websocket in self.active_connections[chat_id]:
-            info = self.active_connections[chat_id].pop(websocket)
-            user_id = user_id or info["user_id"]
-            
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-                
-        if chat_id in self.online_users:
-                self.online_users[chat_id].discard(user_id)
-                if not self.online_users[chat_id]:
-                    del self.online_users[chat_id]
+    def _on_broker_message(self, channel: str, data: str) -> None:
+        envelope = orjson.loads(data)
+        if envelope.get("origin") == self.node_id:
+            return  # already delivered locally
+        chat_id = channel[len(ROOM_CHANNEL_PREFIX):]
+        key, user_id = tuple(envelope["key"]), envelope.get("user_id")
+        frame = envelope["frame"]
+        if user_id is None:
+            # Sequence numbers are per worker: renumber the frame into this worker's room log
+            frame = self._record(chat_id, orjson.loads(frame), key)
+        self._deliver(chat_id, frame, key, user_id)
 
     async def broadcast(self, chat_id: str, message: dict, exclude: Set[WebSocket] = None) -> None:
-        if chat_id not in self.active_connections:
-            return
-        exclude = exclude or set()
-        dead = set()
-        for ws in list(self.active_connections[chat_id].keys()):
-            if ws in exclude:
-                continue
-            try:
-                await ws.send_json(message)
-            except Exception:
-                dead.add(ws)
-
-        for ws in dead:
-            self.disconnect(chat_id, ws, user_id)
-            
+        """Encode once and queue the frame for every socket in the room; never waits on socket writes"""
+        key = _coalesce_key(message)
+        frame = self._record(chat_id, message, key)
+        self._deliver(chat_id, frame, key, exclude={id(ws) for ws in exclude or ()})
+        await self._publish(chat_id, frame, key)
+
+    def send_direct(self, chat_id: str, websocket: WebSocket, message: dict) -> bool:
+        """
+        Queue a frame for this one socket (pong, errors, its initial state) behind the frames it is
+        already due, so only its writer ever writes to it. False when the socket is no longer registered.
+        """
+        conn = self.active_connections.get(chat_id, {}).get(websocket)
+        if conn is None or conn.closed:
+            return False
+        conn.enqueue(encode_frame(message), _coalesce_key(message))
+        return True
+
     async def send_to_user(self, chat_id: str, user_id: int, message: dict) -> None:
-        if chat_id not in self.active_connections:
-            return
+        frame, key = encode_frame(message), _coalesce_key(message)
+        self._deliver(chat_id, frame, key, user_id=user_id)
+        await self._publish(chat_id, frame, key, user_id=user_id)
+
+    async def get_online_users(self, chat_id: str) -> Set[int]:
+        return await self.broker.presence_members(chat_id)
 
-        for ws, info in self.active_connections[chat_id].items():
-            if info["user_id"] == user_id:
-                try:
-                    await ws.send_json(message)
-                except:
-                    self.disconnect(chat_id, ws, user_id)
-            
-    def get_online_users(self, chat_id: str) -> Set[int]:
-        return self.online_users.get(chat_id, set())
-
-manager = WebSocketManager()
\ No newline at end of file
+manager = WebSocketManager(broker=create_broker())
@@ -1,4 +1,6 @@
 from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
 from fastapi import HTTPException, status
 from datetime import datetime, timezone
@@ -6,13 +8,53 @@ from datetime import datetime, timezone
 from app.models.private_message import PrivateMessage, MessageType
 from app.models.message_seen_status import MessageSeenStatus
 from app.models.group_message import GroupMessage
-from app.models.group_member import GroupMember
+from app.services.group_membership import is_member
+
+# What a reply shows of the message it answers; backfill_reply_previews mirrors this in SQL
+REPLY_PREVIEW_LENGTH = 100
+REPLY_PREVIEW_LABELS = {
+    MessageType.voice: "🎤 Voice message",
+    MessageType.image: "🖼️ Photo",
+    MessageType.file: "📎 File",
+}
 
 def _chat_id(user_a: int, user_b: int) -> str:
     """Generate consistent chat room ID for private conversations"""
     a, b = sorted([user_a, user_b])
     return f"private_{a}_{b}"
 
+def messages_read_frame(reader_id: int, username: str, avatar_url: Optional[str], message_ids: List[int], read_at: datetime) -> dict:
+    """One frame for a whole batch of read receipts, instead of a message_updated per message"""
+    return {
+        "type": "messages_read",
+        "message_ids": message_ids,
+        "reader_id": reader_id,
+        "is_read": True,
+        "read_at": read_at,
+        "reader": {
+            "user_id": reader_id,
+            "username": username,
+            "avatar_url": avatar_url,
+            "seen_at": read_at
+        }
+    }
+
+def build_reply_preview(reply: PrivateMessage, sender_username: Optional[str]) -> dict:
+    """ReplyPreview of `reply` as stored in PrivateMessage.reply_preview"""
+    content = REPLY_PREVIEW_LABELS.get(reply.message_type)
+    if content is None:
+        content = reply.content or ""
+        if len(content) > REPLY_PREVIEW_LENGTH:
+            content = content[:REPLY_PREVIEW_LENGTH] + "..."
+    return {
+        "id": reply.id,
+        "sender_username": sender_username or "Unknown",
+        "content": content,
+        "message_type": (reply.message_type or MessageType.text).value,
+        "voice_duration": reply.voice_duration,
+        "file_size": reply.file_size
+    }
+
 def extract_public_id_from_url(url: str) -> Optional[str]:
     """Extract Cloudinary public_id from URL"""
     if not url:
@@ -32,17 +74,9 @@ def extract_public_id_from_url(url: str) -> Optional[str]:
         return None
 
 def is_group_member(db: Session, group_id: int, user_id: int) -> bool:
-    return db.query(GroupMember).filter_by(group_id=group_id, user_id=user_id).first() is not None
+    return is_member(db, group_id, user_id)
 
-def validate_reply_message(db: Session, reply_to_id: int, sender_id: int, receiver_id: int) -> PrivateMessage:
-    """Validate that a reply message belongs to the same conversation"""
-    if not reply_to_id:
-        return None
-        
-    replied_message = db.query(PrivateMessage).options(
-        joinedload(PrivateMessage.sender)
-    ).filter(PrivateMessage.id == reply_to_id).first()
-    
+def _check_reply_conversation(replied_message: Optional[PrivateMessage], sender_id: int, receiver_id: int) -> PrivateMessage:
     if not replied_message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -61,4 +95,27 @@ def validate_reply_message(db: Session, reply_to_id: int, sender_id: int, receiv
             detail="Cannot reply to a message from a different conversation"
         )
     
-    return replied_message
\ No newline at end of file
+    return replied_message
+
+def validate_reply_message(db: Session, reply_to_id: int, sender_id: int, receiver_id: int) -> PrivateMessage:
+    """Validate that a reply message belongs to the same conversation"""
+    if not reply_to_id:
+        return None
+        
+    replied_message = db.query(PrivateMessage).options(
+        joinedload(PrivateMessage.sender)
+    ).filter(PrivateMessage.id == reply_to_id).first()
+    
+    return _check_reply_conversation(replied_message, sender_id, receiver_id)
+
+async def validate_reply_message_async(db: AsyncSession, reply_to_id: int, sender_id: int, receiver_id: int) -> PrivateMessage:
+    """Async counterpart of validate_reply_message"""
+    if not reply_to_id:
+        return None
+
+    result = await db.execute(
+        select(PrivateMessage)
+        .options(joinedload(PrivateMessage.sender))
+        .where(PrivateMessage.id == reply_to_id)
+    )
+    return _check_reply_conversation(result.scalars().first(), sender_id, receiver_id)
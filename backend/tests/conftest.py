@@ -0,0 +1,115 @@
+import importlib
+import os
+import pkgutil
+
+import pytest
+
+# Settings are read on import, so fill them in before anything from app is imported.
+# Database tests only run against TEST_DATABASE_URL: every table is truncated after each test.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or "postgresql://localhost/whisper_test"
+os.environ["REDIS_URL"] = ""
+for key, value in {
+    "JWT_SECRET": "test-secret",
+    "SMTP_HOST": "localhost",
+    "SMTP_PORT": "25",
+    "SMTP_USER": "test",
+    "SMTP_PASS": "test",
+    "SMTP_FROM": "test@example.com",
+    "FRONTEND_URL": "http://localhost:5173",
+    "CLOUDINARY_CLOUD_NAME": "test",
+    "CLOUDINARY_API_KEY": "test",
+    "CLOUDINARY_API_SECRET": "test",
+}.items():
+    os.environ.setdefault(key, value)
+
+
+@pytest.fixture(scope="session")
+def schema():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    import app.models
+    from app.core.database import engine
+    from app.models.base import Base
+
+    for module in pkgutil.iter_modules(app.models.__path__):
+        importlib.import_module(f"app.models.{module.name}")
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return Base.metadata
+
+
+@pytest.fixture
+def db(schema):
+    from sqlalchemy import text
+    from app.core.database import SessionLocal, engine
+    from app.helpers.cache import _registry
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        tables = ", ".join(f'"{table.name}"' for table in schema.sorted_tables)
+        with engine.begin() as conn:
+            conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+        for cache in _registry.values():
+            cache.clear()
+
+
+@pytest.fixture
+def make_user(db):
+    from app.models.user import User
+
+    def make(username: str) -> User:
+        user = User(username=username, email=f"{username}@example.com", password_hash="x", is_verified=True)
+        db.add(user)
+        db.commit()
+        return user
+    return make
+
+
+@pytest.fixture
+def befriend(db):
+    from app.models.friend import Friend, FriendshipStatus
+
+    def befriend(a, b) -> None:
+        db.add(Friend(user_id=a.id, friend_id=b.id, status=FriendshipStatus.accepted))
+        db.commit()
+    return befriend
+
+
+@pytest.fixture
+def make_group(db):
+    from app.models.group import Group
+    from app.models.group_member import GroupMember
+
+    def make(creator, *members) -> Group:
+        group = Group(name="group", creator_id=creator.id)
+        db.add(group)
+        db.flush()
+        for user in (creator, *members):
+            db.add(GroupMember(group_id=group.id, user_id=user.id))
+        db.commit()
+        return group
+    return make
+
+
+@pytest.fixture
+def token():
+    from app.core.security import create_access_token
+    return lambda user: create_access_token(user.id)
+
+
+@pytest.fixture
+def client(db):
+    """The chat routers without main's lifespan, so no background services start"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api.v1.routers import chats, websockets
+
+    app = FastAPI()
+    app.include_router(chats.router, prefix="/api/v1/chats")
+    app.include_router(websockets.router, prefix="/api/v1/ws")
+    with TestClient(app) as client:
+        yield client
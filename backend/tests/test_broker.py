@@ -0,0 +1,87 @@
+import asyncio
+
+import orjson
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, frame):
+        self.sent.append(orjson.loads(frame))
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+def _managers(server, presence_ttl=30):
+    from fakeredis.aioredis import FakeRedis
+    from app.services.broker import RedisBroker
+    from app.services.websocket_manager import WebSocketManager
+
+    return [
+        WebSocketManager(broker=RedisBroker(client=FakeRedis(server=server), presence_ttl=presence_ttl))
+        for _ in range(2)
+    ]
+
+
+async def _wait_for(predicate, timeout=3.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def test_frames_and_presence_cross_workers():
+    server = fakeredis.FakeServer()
+
+    async def run():
+        first, second = _managers(server)
+        await first.start()
+        await second.start()
+        alice, bob = RecordingSocket(), RecordingSocket()
+        try:
+            await first.connect("group_1", alice, user_id=1)
+            await second.connect("group_1", bob, user_id=2)
+            assert await first.get_online_users("group_1") == {1, 2}
+            assert await second.get_online_users("group_1") == {1, 2}
+
+            await second.broadcast("group_1", {"action": "edit", "message_id": 7, "new_content": "hi"})
+            await _wait_for(lambda: any(frame.get("action") == "edit" for frame in alice.sent))
+
+            await second.disconnect("group_1", bob, user_id=2)
+            assert await first.get_online_users("group_1") == {1}
+        finally:
+            await first.stop()
+            await second.stop()
+        # A clean stop leaves nothing behind
+        assert await first.get_online_users("group_1") == set()
+
+    asyncio.run(run())
+
+
+def test_presence_of_a_dead_worker_expires():
+    server = fakeredis.FakeServer()
+
+    async def run():
+        first, second = _managers(server, presence_ttl=1)
+        await first.start()
+        await first.connect("group_1", RecordingSocket(), user_id=1)
+        # The second worker registers presence and then dies: no heartbeat, no cleanup
+        await second.broker.presence_add("group_1", 2)
+        assert await first.get_online_users("group_1") == {1, 2}
+
+        await asyncio.sleep(1.5)
+        try:
+            # The first worker's heartbeat kept its own entry alive; the dead one is swept
+            assert await first.get_online_users("group_1") == {1}
+            nodes = await first.broker.client.smembers(first.broker._nodes_key("group_1"))
+            assert nodes == {first.broker.node_id.encode()}
+        finally:
+            await first.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,226 @@
+import json
+
+
+def _headers(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _sync(client, token, since=None, groups=None):
+    params = {} if since is None else {"since": since}
+    if groups is not None:
+        params["groups"] = groups
+    response = client.get("/api/v1/chats/sync", params=params, headers=_headers(token))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _send(client, token, friend, content):
+    response = client.post(f"/api/v1/chats/private/{friend.id}", json={"content": content}, headers=_headers(token))
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _conversation(client, token):
+    response = client.get("/api/v1/chats/conversations", headers=_headers(token))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_sync_returns_rest_delete(client, make_user, befriend, token):
+    alice, bob = make_user("alice"), make_user("bob")
+    befriend(alice, bob)
+    alice_token, bob_token = token(alice), token(bob)
+    cursor = _sync(client, bob_token)["cursor"]
+
+    _send(client, alice_token, bob, "first")
+    message_id = _send(client, alice_token, bob, "secret")
+    response = client.delete(f"/api/v1/chats/private/{message_id}", headers=_headers(alice_token))
+    assert response.status_code == 200, response.text
+
+    result = _sync(client, bob_token, cursor)
+    assert [event["kind"] for event in result["events"]] == ["message_created", "message_created", "message_deleted"]
+    assert result["events"][-1]["message_id"] == message_id
+
+    # The inbox falls back to the previous message and the unread counter drops with it
+    [row] = _conversation(client, bob_token)
+    assert row["last_message_preview"] == "first"
+    assert row["unread_count"] == 1
+
+
+def test_sync_returns_websocket_delete(client, make_user, befriend, token):
+    alice, bob = make_user("alice"), make_user("bob")
+    befriend(alice, bob)
+    alice_token, bob_token = token(alice), token(bob)
+    message_id = _send(client, alice_token, bob, "secret")
+    cursor = _sync(client, bob_token)["cursor"]
+
+    with client.websocket_connect(f"/api/v1/ws/private/{bob.id}?token={alice_token}") as websocket:
+        websocket.send_text(json.dumps({"type": "delete", "message_id": message_id}))
+        for _ in range(10):
+            frame = websocket.receive_json()
+            if frame.get("type") in ("message_deleted", "error"):
+                break
+        assert frame["type"] == "message_deleted"
+
+    result = _sync(client, bob_token, cursor)
+    assert [(event["kind"], event["message_id"]) for event in result["events"]] == [("message_deleted", message_id)]
+    # The only message is gone, so the chat leaves the inbox and nothing is unread
+    assert _conversation(client, bob_token) == []
+    response = client.get("/api/v1/chats/unread", headers=_headers(bob_token))
+    assert response.json()["total_unread"] == 0
+
+
+def test_group_events_are_written_once_per_group(db, client, make_user, make_group, token):
+    from app.api.v1.routers.websockets import _save_group_message
+    from app.crud.message import advance_read_watermarks
+    from app.models.chat_event import ChatEvent
+    from app.models.group_event import GroupEvent
+
+    alice, bob, carol = make_user("alice"), make_user("bob"), make_user("carol")
+    group = make_group(alice, bob, carol)
+    start = _sync(client, token(bob))
+    assert start["groups"] == [{"group_id": group.id, "events": [], "cursor": 0, "has_more": False, "reset": False}]
+
+    first = _save_group_message(db, group.id, alice.id, "hello", "text", None)["id"]
+    second = _save_group_message(db, group.id, alice.id, "again", "text", None)["id"]
+    advance_read_watermarks(db, group.id, {bob.id: second, carol.id: first})
+
+    # One row per message and one per receipt batch, none per member
+    assert db.query(GroupEvent).count() == 3
+    assert db.query(ChatEvent).count() == 0
+
+    result = _sync(client, token(carol), groups=f"{group.id}:0")
+    [page] = result["groups"]
+    assert [event["kind"] for event in page["events"]] == ["message_created", "message_created", "seen"]
+    assert page["cursor"] == 3 and not page["reset"]
+    assert page["events"][-1]["payload"]["positions"] == [
+        {"user_id": bob.id, "message_id": second},
+        {"user_id": carol.id, "message_id": first},
+    ]
+
+    page = _sync(client, token(carol), groups=f"{group.id}:2")["groups"][0]
+    assert [event["seq"] for event in page["events"]] == [3]
+
+
+def test_group_cursor_ahead_of_head_resets(client, make_user, make_group, token):
+    alice = make_user("alice")
+    group = make_group(alice)
+    [page] = _sync(client, token(alice), groups=f"{group.id}:7")["groups"]
+    assert page["reset"] and page["cursor"] == 0
+
+    response = client.get("/api/v1/chats/sync", params={"groups": "x:1"}, headers=_headers(token(alice)))
+    assert response.status_code == 400
+
+
+def test_opening_a_chat_marks_unread_even_when_the_counter_is_stale(db, client, make_user, befriend, token):
+    from app.models.conversation import Conversation
+    from app.models.private_message import PrivateMessage
+
+    alice, bob = make_user("alice"), make_user("bob")
+    befriend(alice, bob)
+    message_id = _send(client, token(alice), bob, "hello")
+    # A counter that drifted to 0 must not stop the messages themselves from being marked
+    db.query(Conversation).filter_by(user_id=bob.id, peer_id=alice.id).update({"unread_count": 0})
+    db.commit()
+
+    # Marking happens before the socket joins the room, so look at the rows once it has
+    with client.websocket_connect(f"/api/v1/ws/private/{alice.id}?token={token(bob)}") as websocket:
+        assert websocket.receive_json()["action"] == "resume"
+
+    db.expire_all()
+    assert db.get(PrivateMessage, message_id).is_read
+
+
+def test_inbox_socket_gets_counts_without_joining_presence(client, make_user, befriend, token):
+    from app.services.unread_counters import inbox_room
+    from app.services.websocket_manager import manager
+
+    alice, bob = make_user("alice"), make_user("bob")
+    befriend(alice, bob)
+    _send(client, token(alice), bob, "hello")
+
+    with client.websocket_connect(f"/api/v1/ws/inbox?token={token(bob)}") as websocket:
+        frame = websocket.receive_json()
+        assert (frame["action"], frame["private"]) == ("unread_counts", {str(alice.id): 1})
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+        assert client.portal.call(manager.get_online_users, inbox_room(bob.id)) == set()
+
+    assert inbox_room(bob.id) not in manager.active_connections
+
+
+def test_get_events_since_pages_and_resets(db, make_user):
+    from app.crud.chat_event import event_statement, get_events_since
+    from app.models.chat_event import ChatEvent
+
+    alice = make_user("alice")
+    for message_id in range(1, 5):
+        db.execute(event_statement([alice.id], "message_created", "private_1_2", {"id": message_id}, message_id))
+    db.commit()
+
+    assert get_events_since(db, alice.id, None) == ([], 4, False, False)
+    assert get_events_since(db, alice.id, 4) == ([], 4, False, False)
+
+    events, cursor, has_more, reset = get_events_since(db, alice.id, 1, limit=2)
+    assert ([event.seq for event in events], cursor, has_more, reset) == ([2, 3], 3, True, False)
+    events, cursor, has_more, reset = get_events_since(db, alice.id, cursor, limit=2)
+    assert ([event.seq for event in events], cursor, has_more, reset) == ([4], 4, False, False)
+
+    # A cursor ahead of the head was never handed out here, so the client starts over
+    assert get_events_since(db, alice.id, 9) == ([], 4, False, True)
+
+    # Once the event right after the cursor is pruned, the client can't tell what it missed
+    db.query(ChatEvent).filter(ChatEvent.seq <= 2).delete()
+    db.commit()
+    assert get_events_since(db, alice.id, 1) == ([], 4, False, True)
+    assert [event.seq for event in get_events_since(db, alice.id, 2)[0]] == [3, 4]
+
+
+def test_outbox_claims_in_order_and_deletes_what_was_sent(db):
+    from datetime import datetime, timedelta, timezone
+    from app.crud.realtime_outbox import claim_realtime_events, delete_realtime_events, queue_broadcast
+    from app.models.realtime_event import RealtimeEvent
+
+    for n in range(3):
+        queue_broadcast(db, "private_1_2", {"type": "typing", "n": n})
+    db.rollback()
+    # Nothing is queued when the transaction that wrote the frames rolls back
+    assert claim_realtime_events(db, 10, 30) == []
+
+    for n in range(3):
+        queue_broadcast(db, "private_1_2", {"type": "typing", "n": n})
+    db.commit()
+
+    claimed = claim_realtime_events(db, 2, 30)
+    assert [payload["n"] for _, _, payload in claimed] == [0, 1]
+    # Claimed rows are skipped by the next publisher until their lease runs out
+    rest = claim_realtime_events(db, 10, 30)
+    assert [payload["n"] for _, _, payload in rest] == [2]
+
+    delete_realtime_events(db, [event_id for event_id, _, _ in claimed])
+    db.query(RealtimeEvent).update({"claimed_until": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    db.commit()
+    assert [payload["n"] for _, _, payload in claim_realtime_events(db, 10, 30)] == [2]
+
+
+def test_backfilled_reply_previews_match_the_ones_written_with_the_reply(db, make_user):
+    from app.crud.chat import backfill_reply_previews, create_private_message
+    from app.models.private_message import PrivateMessage
+
+    alice, bob = make_user("alice"), make_user("bob")
+    originals = [
+        create_private_message(db, alice.id, bob.id, "short"),
+        create_private_message(db, alice.id, bob.id, "x" * 150),
+        create_private_message(db, alice.id, bob.id, "https://res.cloudinary.com/test/image/upload/v1/a.jpg", "image"),
+        create_private_message(db, alice.id, bob.id, "https://res.cloudinary.com/test/video/upload/v1/v.webm", "voice", voice_duration=2.5, file_size=2048),
+    ]
+    replies = [create_private_message(db, bob.id, alice.id, "re", reply_to_id=original.id) for original in originals]
+    written = {reply.id: reply.reply_preview for reply in replies}
+    assert all(written.values())
+
+    db.query(PrivateMessage).filter(PrivateMessage.id.in_(written)).update({"reply_preview": None}, synchronize_session=False)
+    db.commit()
+    backfill_reply_previews(db)
+
+    db.expire_all()
+    assert {reply.id: db.get(PrivateMessage, reply.id).reply_preview for reply in replies} == written
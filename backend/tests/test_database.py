@@ -0,0 +1,55 @@
+import pytest
+
+
+def test_ensure_indexes_deletes_duplicate_receipts(db, make_user, befriend):
+    from sqlalchemy import text
+    from app.core.database import engine, ensure_indexes
+    from app.models.base import Base
+    from app.models.message_seen_status import MessageSeenStatus
+    from app.models.private_message import PrivateMessage
+
+    alice, bob = make_user("alice"), make_user("bob")
+    message = PrivateMessage(sender_id=alice.id, receiver_id=bob.id, content="hi")
+    db.add(message)
+    db.commit()
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_message_seen_status_message_user"))
+    for _ in range(3):
+        db.add(MessageSeenStatus(message_id=message.id, user_id=bob.id))
+    db.commit()
+
+    try:
+        ensure_indexes(Base.metadata)
+    finally:
+        with engine.begin() as conn:
+            created = conn.execute(text(
+                "SELECT count(*) FROM pg_indexes WHERE indexname = 'uq_message_seen_status_message_user'"
+            )).scalar()
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_message_seen_status_message_user ON message_seen_status (message_id, user_id)"
+            ))
+    assert created == 1
+    assert db.query(MessageSeenStatus).count() == 1
+
+
+def test_ensure_indexes_fails_loudly(db, make_user):
+    from sqlalchemy import text
+    from app.core.database import engine, ensure_indexes
+    from app.models.base import Base
+
+    make_user("alice")
+    # Unique without dedupe: duplicates must stop startup instead of leaving the index missing
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_chat_events_user_seq"))
+        conn.execute(text(
+            "INSERT INTO chat_events (user_id, seq, kind, chat_id, payload, created_at) "
+            "SELECT id, 1, 'message_created', 'c', '{}', now() FROM users, generate_series(1, 2)"
+        ))
+    try:
+        with pytest.raises(RuntimeError, match="uq_chat_events_user_seq"):
+            ensure_indexes(Base.metadata)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM chat_events"))
+            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_events_user_seq ON chat_events (user_id, seq)"))
@@ -0,0 +1,108 @@
+import pytest
+
+
+@pytest.fixture
+def groups_client(db):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api.v1.routers import groups
+
+    app = FastAPI()
+    app.include_router(groups.router, prefix="/api/v1/groups")
+    with TestClient(app) as client:
+        yield client
+
+
+def _headers(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _receive(websocket, key):
+    """Skip resume and presence frames until one carrying `key` arrives"""
+    for _ in range(10):
+        frame = websocket.receive_json()
+        if key in frame:
+            return frame
+    raise AssertionError(f"no frame with {key!r}")
+
+
+def test_join_needs_a_pending_invite(db, groups_client, make_user, make_group, token):
+    from app.models.group_invite import GroupInvite
+    from app.models.group_member import GroupMember
+
+    alice, bob = make_user("alice"), make_user("bob")
+    group = make_group(alice)
+
+    response = groups_client.post(f"/api/v1/groups/{group.id}/join", headers=_headers(token(bob)))
+    assert response.status_code == 403
+
+    db.add(GroupInvite(group_id=group.id, inviter_id=alice.id, invitee_id=bob.id, invite_token="t"))
+    db.commit()
+    response = groups_client.post(f"/api/v1/groups/{group.id}/join", headers=_headers(token(bob)))
+    assert response.status_code == 200, response.text
+    assert db.query(GroupMember).filter_by(group_id=group.id, user_id=bob.id).count() == 1
+
+    # The invite is used up
+    response = groups_client.post(f"/api/v1/groups/{group.id}/join", headers=_headers(token(bob)))
+    assert response.status_code == 403
+
+
+def test_send_group_message_stores_it(db, groups_client, make_user, make_group, token):
+    from app.models.group_message import GroupMessage
+    from app.models.realtime_event import RealtimeEvent
+
+    alice = make_user("alice")
+    group = make_group(alice)
+    response = groups_client.post(
+        f"/api/v1/groups/{group.id}/message", json={"content": "hi"}, headers=_headers(token(alice))
+    )
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["content"] == "hi" and body["sender"]["id"] == alice.id
+    assert db.query(GroupMessage).filter_by(id=body["id"]).one().content == "hi"
+    # The broadcast went out through the outbox, in the message's transaction
+    event = db.query(RealtimeEvent).one()
+    assert (event.room, event.payload["id"]) == (f"group_{group.id}", body["id"])
+
+
+def test_group_websocket_delete(db, client, make_user, make_group, token):
+    from app.api.v1.routers.websockets import _save_group_message
+    from app.models.group_event import GroupEvent
+    from app.models.group_message import GroupMessage
+
+    alice, bob = make_user("alice"), make_user("bob")
+    group = make_group(alice, bob)
+    message_id = _save_group_message(db, group.id, alice.id, "hello", "text", None)["id"]
+
+    with client.websocket_connect(f"/api/v1/ws/group/{group.id}?token={token(bob)}") as websocket:
+        websocket.send_json({"action": "delete", "message_id": message_id})
+        assert _receive(websocket, "error") == {"error": "Only sender can delete this message", "message_id": message_id}
+
+    with client.websocket_connect(f"/api/v1/ws/group/{group.id}?token={token(alice)}") as websocket:
+        websocket.send_json({"action": "delete", "message_id": message_id})
+        frame = _receive(websocket, "message_id")
+        assert (frame["action"], frame["message_id"]) == ("delete", message_id)
+
+    db.expire_all()
+    assert db.query(GroupMessage).count() == 0
+    assert [event.kind for event in db.query(GroupEvent).order_by(GroupEvent.seq)] == ["message_created", "message_deleted"]
+
+
+def test_read_watermarks_only_move_forward(db, make_user, make_group):
+    from app.crud.chat import create_group_message
+    from app.crud.message import advance_read_watermarks
+    from app.models.group_read_watermark import GroupReadWatermark
+
+    alice, bob, carol = make_user("alice"), make_user("bob"), make_user("carol")
+    group = make_group(alice, bob, carol)
+    first, second = (create_group_message(db, alice.id, group.id, text).id for text in ("one", "two"))
+
+    _, moved = advance_read_watermarks(db, group.id, {bob.id: second, carol.id: first})
+    assert sorted(moved) == sorted([(bob.id, second), (carol.id, first)])
+
+    # An older receipt is ignored, a newer one moves, a message from elsewhere is not a position
+    _, moved = advance_read_watermarks(db, group.id, {bob.id: first, carol.id: second, alice.id: second + 100})
+    assert moved == [(carol.id, second)]
+
+    marks = dict(db.query(GroupReadWatermark.user_id, GroupReadWatermark.last_read_message_id).filter_by(group_id=group.id))
+    assert marks == {bob.id: second, carol.id: second}
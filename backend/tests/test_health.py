@@ -0,0 +1,29 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def health_client(monkeypatch):
+    from app.api.v1.routers import health
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "HEALTH_TOKEN", "internal")
+    app = FastAPI()
+    app.include_router(health.router, prefix="/api/v1/health")
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("path", ["/api/v1/health/db", "/api/v1/health/caches"])
+def test_diagnostics_need_the_health_token(health_client, path):
+    assert health_client.get(path).status_code == 403
+    assert health_client.get(path, headers={"X-Health-Token": "wrong"}).status_code == 403
+    assert health_client.get(path, headers={"X-Health-Token": "internal"}).status_code == 200
+
+
+def test_diagnostics_are_off_without_a_token(health_client, monkeypatch):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "HEALTH_TOKEN", None)
+    response = health_client.get("/api/v1/health/caches", headers={"X-Health-Token": ""})
+    assert response.status_code == 403
@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+URL = "https://res.cloudinary.com/test/image/upload/v1/chat_images/cat.jpg"
+PUBLIC_ID = "chat_images/cat"
+
+
+def _register(db, digest="d1", uploader_id=None):
+    from app.crud.media import register_media
+
+    result = register_media(db, digest, "chat_image", {"public_id": PUBLIC_ID, "secure_url": URL}, 10, uploader_id=uploader_id)
+    db.commit()
+    return result
+
+
+def _asset(db):
+    from app.models.media_asset import MediaAsset
+
+    db.expire_all()
+    return db.query(MediaAsset).filter_by(public_id=PUBLIC_ID).first()
+
+
+def _queued(db):
+    from app.models.media_deletion import MediaDeletion
+
+    return [row.public_id for row in db.query(MediaDeletion)]
+
+
+def _send_image(db, sender, receiver, **kwargs):
+    from app.crud.chat import create_private_message
+
+    return create_private_message(db, sender.id, receiver.id, URL, "image", **kwargs)
+
+
+def test_upload_takes_no_reference_until_a_message_claims_it(db, make_user):
+    from app.crud.chat import remove_private_message
+    from app.crud.media import find_media
+
+    alice, bob = make_user("alice"), make_user("bob")
+    assert _register(db) == (PUBLIC_ID, URL, False)
+    assert _asset(db).ref_count == 0
+
+    # Uploading the same bytes again finds the object without taking a reference either
+    assert find_media(db, "d1", "chat_image") == (PUBLIC_ID, URL)
+    db.commit()
+    assert _asset(db).ref_count == 0
+
+    first = _send_image(db, alice, bob)
+    second = _send_image(db, bob, alice)
+    forward = _send_image(db, alice, bob, is_forwarded=True)
+    assert _asset(db).ref_count == 3
+
+    for msg in (first, second):
+        remove_private_message(db, msg)
+        db.commit()
+    assert _asset(db).ref_count == 1 and _queued(db) == []
+
+    remove_private_message(db, forward)
+    db.commit()
+    assert _asset(db) is None and _queued(db) == [PUBLIC_ID]
+
+
+def test_duplicate_upload_keeps_the_first_object(db):
+    from app.crud.media import register_media
+
+    _register(db)
+    other = {"public_id": "chat_images/copy", "secure_url": URL.replace("cat", "copy")}
+    assert register_media(db, "d1", "chat_image", other, 10) == (PUBLIC_ID, URL, True)
+
+
+def test_unclaimed_uploads_expire(db, make_user):
+    from fastapi import HTTPException
+    from app.crud.media import expire_unclaimed_media
+    from app.models.media_asset import MediaAsset
+
+    alice, bob = make_user("alice"), make_user("bob")
+    _register(db)
+    assert expire_unclaimed_media(db, 3600) == 0
+
+    db.query(MediaAsset).update({"updated_at": datetime.now(timezone.utc) - timedelta(hours=2)})
+    db.commit()
+    assert expire_unclaimed_media(db, 3600) == 1
+    assert _asset(db) is None and _queued(db) == [PUBLIC_ID]
+
+    # A message sent after the upload expired would point at an object being destroyed
+    with pytest.raises(HTTPException) as exc:
+        _send_image(db, alice, bob)
+    assert exc.value.status_code == 410
+
+
+def test_claimed_uploads_do_not_expire(db, make_user):
+    from app.crud.media import expire_unclaimed_media
+    from app.models.media_asset import MediaAsset
+
+    alice, bob = make_user("alice"), make_user("bob")
+    _register(db)
+    _send_image(db, alice, bob)
+    db.query(MediaAsset).update({"updated_at": datetime.now(timezone.utc) - timedelta(hours=2)})
+    db.commit()
+    assert expire_unclaimed_media(db, 3600) == 0
+    assert _asset(db).ref_count == 1
+
+
+def test_only_the_uploader_can_discard_an_unclaimed_upload(db, make_user):
+    from fastapi import HTTPException
+    from app.crud.media import discard_upload
+
+    alice, bob = make_user("alice"), make_user("bob")
+    _register(db, uploader_id=alice.id)
+
+    with pytest.raises(HTTPException) as exc:
+        discard_upload(db, PUBLIC_ID, bob.id)
+    assert exc.value.status_code == 403
+    db.rollback()
+
+    with pytest.raises(HTTPException) as exc:
+        discard_upload(db, "chat_images/unknown", alice.id)
+    assert exc.value.status_code == 404
+    db.rollback()
+
+    discard_upload(db, PUBLIC_ID, alice.id)
+    db.commit()
+    assert _asset(db) is None and _queued(db) == [PUBLIC_ID]
+
+
+def test_claimed_upload_cannot_be_discarded(db, make_user):
+    from fastapi import HTTPException
+    from app.crud.media import discard_upload
+
+    alice, bob = make_user("alice"), make_user("bob")
+    _register(db, uploader_id=alice.id)
+    _send_image(db, alice, bob)
+
+    with pytest.raises(HTTPException) as exc:
+        discard_upload(db, PUBLIC_ID, alice.id)
+    assert exc.value.status_code == 409
+    db.rollback()
+    assert _asset(db).ref_count == 1 and _queued(db) == []
+
+
+def test_forwarding_a_legacy_object_counts_the_original(db, make_user):
+    from app.crud.chat import remove_private_message
+
+    alice, bob = make_user("alice"), make_user("bob")
+    # Sent before the registry existed: no row, so nothing was claimed
+    original = _send_image(db, alice, bob)
+    assert _asset(db) is None
+
+    forward = _send_image(db, bob, alice, is_forwarded=True)
+    assert _asset(db).ref_count == 2
+
+    remove_private_message(db, original)
+    db.commit()
+    assert _asset(db).ref_count == 1 and _queued(db) == []
+
+    remove_private_message(db, forward)
+    db.commit()
+    assert _asset(db) is None and _queued(db) == [PUBLIC_ID]
+
+
+def test_release_media_reports_the_last_reference(db):
+    from app.crud.media import claim_media, release_media
+
+    _register(db)
+    claim_media(db, PUBLIC_ID)
+    claim_media(db, PUBLIC_ID)
+    db.commit()
+
+    assert release_media(db, PUBLIC_ID) is False
+    assert release_media(db, PUBLIC_ID) is True
+    db.commit()
+    assert _asset(db) is None
+
+    # Objects the registry never saw had a single user; no id means nothing to release
+    assert release_media(db, "chat_images/legacy") is True
+    assert release_media(db, None) is False
@@ -0,0 +1,35 @@
+import pytest
+
+
+def test_migrate_is_repeatable_and_releases_its_lock(db, make_user):
+    from sqlalchemy import text
+    from app.core.database import engine
+    from app.migrate import MIGRATION_LOCK_ID, migrate
+
+    make_user("alice")
+    migrate()
+    migrate()
+
+    with engine.connect() as conn:
+        held = conn.execute(
+            text("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = :key"),
+            {"key": MIGRATION_LOCK_ID & 0xFFFFFFFF},
+        ).scalar()
+    assert held == 0
+
+
+def test_check_schema_fails_until_migrate_has_run(db):
+    from sqlalchemy import text
+    from app.core.database import engine
+    from app.migrate import check_schema, migrate
+
+    check_schema()
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_private_messages_unread"))
+    try:
+        with pytest.raises(RuntimeError, match="ix_private_messages_unread"):
+            check_schema()
+    finally:
+        migrate()
+    check_schema()
@@ -0,0 +1,18 @@
+def test_revoking_a_refresh_token_evicts_only_that_users_access_tokens(db, make_user):
+    from app.core.security import _access_token_user_id, create_access_token, create_refresh_token, token_cache
+    from app.crud.auth import revoke_refresh_token, store_refresh_token
+
+    alice, bob = make_user("alice"), make_user("bob")
+    alice_access, bob_access = create_access_token(alice.id), create_access_token(bob.id)
+    _access_token_user_id(alice_access)
+    _access_token_user_id(bob_access)
+    assert token_cache.stats()["size"] == 2
+
+    refresh = create_refresh_token(alice.id)
+    store_refresh_token(db, alice.id, refresh)
+    revoke_refresh_token(db, refresh)
+    assert token_cache.stats()["size"] == 1
+
+    hits = token_cache.hits
+    assert _access_token_user_id(bob_access) == bob.id
+    assert token_cache.hits == hits + 1
@@ -0,0 +1,209 @@
+import asyncio
+
+import orjson
+import pytest
+
+
+class StalledSocket:
+    """Accepts frames but never finishes sending them, so the connection queue fills up"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+        self.release = asyncio.Event()
+
+    async def send_text(self, frame):
+        await self.release.wait()
+        self.sent.append(orjson.loads(frame))
+
+    async def close(self, code=1000, reason=""):
+        self.closed = code
+
+
+def _queued(conn):
+    return [orjson.loads(frame) for _, frame in conn.queue]
+
+
+@pytest.fixture
+def queue_settings(monkeypatch):
+    from app.core.config import settings
+
+    def configure(size, policy):
+        monkeypatch.setattr(settings, "WS_SEND_QUEUE_SIZE", size)
+        monkeypatch.setattr(settings, "WS_SLOW_CONSUMER_POLICY", policy)
+    return configure
+
+
+def _connect(manager, socket, chat_id="private_1_2", user_id=1):
+    """Register a socket without the resume frame connect() would queue"""
+    from app.services.websocket_manager import _Connection
+
+    conn = _Connection(manager, chat_id, socket, user_id)
+    manager.active_connections.setdefault(chat_id, {})[socket] = conn
+    return conn
+
+
+def test_messages_read_batches_are_not_coalesced(queue_settings):
+    from app.services.websocket_manager import WebSocketManager
+
+    queue_settings(2, "coalesce")
+
+    async def run():
+        manager = WebSocketManager()
+        conn = _connect(manager, StalledSocket())
+        await asyncio.sleep(0)
+        for message_ids in ([1, 2], [3], [4, 5]):
+            await manager.broadcast("private_1_2", {"type": "messages_read", "reader_id": 2, "message_ids": message_ids})
+        queued = _queued(conn)
+        conn.close()
+        return manager, queued
+
+    manager, queued = asyncio.run(run())
+    # Distinct batches fall back to dropping the oldest instead of overwriting each other
+    assert [frame["message_ids"] for frame in queued] == [[3], [4, 5]]
+    assert manager.stats["coalesced"] == 0 and manager.stats["dropped"] == 1
+
+
+def test_unread_changed_coalesces_per_chat(queue_settings):
+    from app.services.websocket_manager import WebSocketManager
+
+    queue_settings(2, "coalesce")
+
+    async def run():
+        manager = WebSocketManager()
+        conn = _connect(manager, StalledSocket(), chat_id="inbox_1")
+        await asyncio.sleep(0)
+        for peer_id, count in ((2, 1), (3, 1), (2, 2)):
+            await manager.send_to_user("inbox_1", 1, {"action": "unread_changed", "user_id": 1, "peer_id": peer_id, "group_id": None, "unread_count": count})
+        queued = _queued(conn)
+        conn.close()
+        return manager, queued
+
+    manager, queued = asyncio.run(run())
+    # The newer count for peer 2 replaces the older one; peer 3 is kept
+    assert [(frame["peer_id"], frame["unread_count"]) for frame in queued] == [(2, 2), (3, 1)]
+    assert manager.stats["coalesced"] == 1
+
+
+def test_room_log_since_boundaries():
+    from app.services.websocket_manager import _RoomLog
+
+    log = _RoomLog(3)
+    assert log.since(0) == []
+    for n in range(1, 6):
+        log.append({"action": "edit", "message_id": n}, ("edit", n))
+
+    # Frames 3..5 are kept: resuming from 2 is complete, from 1 has a gap, ahead of the head is unknown
+    assert [seq for seq, _, _ in log.since(2)] == [3, 4, 5]
+    assert log.since(5) == []
+    assert log.since(1) is None
+    assert log.since(6) is None
+
+
+def test_resume_replays_or_requires_resync():
+    from app.services.websocket_manager import WebSocketManager
+
+    async def run():
+        manager = WebSocketManager()
+        await manager.broadcast("group_1", {"action": "edit", "message_id": 1})
+        await manager.broadcast("group_1", {"action": "edit", "message_id": 2})
+        epoch = manager._logs["group_1"].epoch
+
+        resumed, other_epoch = StalledSocket(), StalledSocket()
+        resumed.release.set()
+        other_epoch.release.set()
+        await manager.connect("group_1", resumed, user_id=1, resume_from=1, epoch=epoch)
+        await manager.connect("group_1", other_epoch, user_id=2, resume_from=1, epoch="elsewhere")
+        await asyncio.sleep(0.05)
+        for conn in manager.active_connections["group_1"].values():
+            conn.close()
+        return manager, epoch, resumed.sent, other_epoch.sent
+
+    manager, epoch, resumed, other_epoch = asyncio.run(run())
+    # The missed frame comes first, then the position to continue from
+    assert resumed[0]["message_id"] == 2 and resumed[0]["seq"] == 2
+    assert resumed[1] == {"action": "resume", "epoch": epoch, "seq": 2, "replayed": 1}
+    assert other_epoch[0] == {"action": "resync_required", "epoch": epoch, "seq": 2, "replayed": 0}
+    assert manager.stats["replayed"] == 1 and manager.stats["resyncs"] == 1
+
+
+def test_room_logs_are_evicted_least_recently_used(monkeypatch):
+    from app.core.config import settings
+    from app.services.websocket_manager import WebSocketManager
+
+    monkeypatch.setattr(settings, "WS_REPLAY_ROOMS", 2)
+
+    async def run():
+        manager = WebSocketManager()
+        for room in ("a", "b", "a", "c"):
+            await manager.broadcast(room, {"action": "edit", "message_id": 1})
+        return manager
+
+    manager = asyncio.run(run())
+    assert list(manager._logs) == ["a", "c"]
+    # A room whose log was evicted starts a new epoch at 0, so old cursors resync
+    assert manager._room_log("b").seq == 0
+
+
+def test_send_direct_goes_through_the_connection_queue(queue_settings):
+    from app.services.websocket_manager import WebSocketManager
+
+    queue_settings(8, "drop_oldest")
+
+    async def run():
+        manager = WebSocketManager()
+        socket = StalledSocket()
+        conn = _connect(manager, socket)
+        await asyncio.sleep(0)
+        await manager.broadcast("private_1_2", {"type": "message_deleted", "message_id": 1})
+        queued_direct = manager.send_direct("private_1_2", socket, {"type": "pong"})
+        queued = _queued(conn)
+        conn.close()
+        return queued_direct, queued, manager.send_direct("private_1_2", socket, {"type": "pong"})
+
+    queued_direct, queued, after_close = asyncio.run(run())
+    # Only the writer task writes to the socket, so the pong waits behind the frame queued before it
+    assert queued_direct and [frame["type"] for frame in queued] == ["message_deleted", "pong"]
+    assert after_close is False
+
+
+def test_drop_oldest_keeps_the_newest_frames(queue_settings):
+    from app.services.websocket_manager import WebSocketManager
+
+    queue_settings(2, "drop_oldest")
+
+    async def run():
+        manager = WebSocketManager()
+        conn = _connect(manager, StalledSocket())
+        await asyncio.sleep(0)
+        for message_id in range(1, 5):
+            await manager.broadcast("private_1_2", {"type": "message_deleted", "message_id": message_id})
+        queued = _queued(conn)
+        conn.close()
+        return manager, queued
+
+    manager, queued = asyncio.run(run())
+    assert [frame["message_id"] for frame in queued] == [3, 4]
+    assert manager.stats["dropped"] == 2
+
+
+def test_disconnect_policy_closes_a_full_socket(queue_settings):
+    from app.services.websocket_manager import WebSocketManager
+
+    queue_settings(1, "disconnect")
+
+    async def run():
+        manager = WebSocketManager()
+        socket = StalledSocket()
+        _connect(manager, socket)
+        await asyncio.sleep(0)
+        for message_id in range(1, 4):
+            await manager.broadcast("private_1_2", {"type": "message_deleted", "message_id": message_id})
+        await asyncio.sleep(0.05)
+        return manager, socket
+
+    manager, socket = asyncio.run(run())
+    # The slow socket is closed and forgotten rather than holding frames for everyone else
+    assert socket.closed == 1013
+    assert "private_1_2" not in manager.active_connections
+    assert manager.stats["slow_disconnects"] == 1
@@ -93,10 +93,10 @@ const ForwardMessageDialog = ({
             <Typography variant="body2" sx={{ fontStyle: 'italic' }}>
               {getMessagePreview(message)}
             </Typography>
-            {message.reply_to && (
+            {(message.reply_preview || message.reply_to) && (
               <Box sx={{ mt: 1, p: 1, bgcolor: 'rgba(0,0,0,0.05)', borderRadius: '4px' }}>
                 <Typography variant="caption" color="text.secondary">
-                  Replying to: {message.reply_to.content}
+                  Replying to: {message.reply_preview?.content ?? message.reply_to.content}
                 </Typography>
               </Box>
             )}
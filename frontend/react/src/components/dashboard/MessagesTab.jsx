@@ -40,6 +40,9 @@ import {
 import ChatMessage from '../chat/ChatMessage';
 import ForwardMessageDialog from '../chat/ForwardMessageDialog';
 
+// Messages per history request; a full page means there may be older ones
+const HISTORY_PAGE_SIZE = 50;
+
 const getWebSocketBaseUrl = () => {
   const wsUrl = import.meta.env.VITE_WS_URL;
   if (!wsUrl) {
@@ -89,6 +92,8 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
   const [audioUrl, setAudioUrl] = useState(null);
   const [isUploadingVoice, setIsUploadingVoice] = useState(false);
   const [isDeleting, setIsDeleting] = useState(false);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
 
   useEffect(() => {
     const mobileStyles = `
@@ -149,6 +154,9 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
   const recordingIntervalRef = useRef(null);
   const audioBlobRef = useRef(null);
   const messagesContainerRef = useRef(null);
+  // scrollHeight before older history was prepended, so the view can stay on the same messages
+  const prependScrollRef = useRef(null);
+  const activeFriendIdRef = useRef(null);
   const typingTimeoutRef = useRef(null);
   const lastMessageCount = useRef(0);
   const theme = useTheme();
@@ -296,6 +304,27 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
           })
         );
 
+        // Batched read receipts: one frame for every message the reader just saw
+      } else if (type === "messages_read") {
+        const readIds = new Set(data.message_ids || []);
+        const reader = data.reader || {};
+
+        setMessages((prev) =>
+          prev.map((msg) => {
+            if (!readIds.has(msg.id)) return msg;
+
+            const currentSeenBy = msg.seen_by || [];
+            const alreadySeen = currentSeenBy.some(s => s.user_id === data.reader_id);
+
+            return {
+              ...msg,
+              is_read: true,
+              read_at: data.read_at || msg.read_at,
+              seen_by: alreadySeen ? currentSeenBy : [...currentSeenBy, reader],
+            };
+          })
+        );
+
         // 3. Message updated with seen_by information
       } else if (type === "message_updated") {
         console.log("🔄 Message updated with seen info:", data);
@@ -954,77 +983,80 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
   /* --------------------------------------------------------------------- */
   /* Load Initial Messages */
   /* --------------------------------------------------------------------- */
-  const loadInitialMessages = async () => {
-    if (!selectedFriend || messages.length > 0) return;
-    try {
-      const chatMessages = await getPrivateChat(selectedFriend.id);
-      const enhanced = chatMessages.map((msg) => {
-        const detectMessageType = (message) => {
-          // Use backend message_type first
-          if (message.message_type === 'image') return 'image';
-          if (message.message_type === 'voice') return 'voice';
-          if (message.message_type === 'file') return 'file';
-          if (message.message_type === 'text') return 'text';
-
-          const content = message.content || '';
-
-          // Voice message detection
-          const isVoiceUrl =
-            content.includes('/voice_messages/') ||
-            content.match(/\.(mp3|wav|ogg|webm|m4a|aac|opus|flac|3gp)$/i) ||
-            (content.includes('cloudinary.com') && content.includes('/video/upload/'));
-
-          if (isVoiceUrl) return "voice";
-
-          // Image detection
-          const isImageUrl =
-            content.match(/\.(jpg|jpeg|png|gif|webp|bmp|svg)$/i) ||
-            (content.includes('cloudinary.com') && content.includes('/image/upload/'));
+  const enhanceHistoryMessage = (msg) => {
+    const detectMessageType = (message) => {
+      // Use backend message_type first
+      if (message.message_type === 'image') return 'image';
+      if (message.message_type === 'voice') return 'voice';
+      if (message.message_type === 'file') return 'file';
+      if (message.message_type === 'text') return 'text';
+
+      const content = message.content || '';
+
+      // Voice message detection
+      const isVoiceUrl =
+        content.includes('/voice_messages/') ||
+        content.match(/\.(mp3|wav|ogg|webm|m4a|aac|opus|flac|3gp)$/i) ||
+        (content.includes('cloudinary.com') && content.includes('/video/upload/'));
+
+      if (isVoiceUrl) return "voice";
+
+      // Image detection
+      const isImageUrl =
+        content.match(/\.(jpg|jpeg|png|gif|webp|bmp|svg)$/i) ||
+        (content.includes('cloudinary.com') && content.includes('/image/upload/'));
+
+      return isImageUrl ? "image" : "text";
+    };
 
-          return isImageUrl ? "image" : "text";
-        };
+    const messageType = detectMessageType(msg);
 
-        const messageType = detectMessageType(msg);
+    // Use content directly - backend provides proper Cloudinary URL
+    const content = msg.content;
 
-        // Use content directly - backend provides proper Cloudinary URL
-        const content = msg.content;
+    const sender = {
+      id: msg.sender_id,
+      username: msg.sender_id === profile?.id ? profile.username : selectedFriend.username,
+      avatar_url: getUserAvatar(msg.sender_id === profile?.id ? profile : selectedFriend),
+    };
 
-        const sender = {
-          id: msg.sender_id,
-          username: msg.sender_id === profile?.id ? profile.username : selectedFriend.username,
-          avatar_url: getUserAvatar(msg.sender_id === profile?.id ? profile : selectedFriend),
-        };
+    const seen_by = msg.seen_by && Array.isArray(msg.seen_by)
+      ? msg.seen_by.map(s => ({
+        user_id: s.user_id || s.userId,
+        username: s.username,
+        avatar_url: s.avatar_url || s.avatarUrl,
+        seen_at: s.seen_at || s.seenAt,
+      }))
+      : msg.is_read
+        ? [{
+          user_id: msg.receiver_id === profile?.id ? selectedFriend.id : profile.id,
+          username: msg.receiver_id === profile?.id ? selectedFriend.username : profile.username,
+          avatar_url: msg.receiver_id === profile?.id ? getUserAvatar(selectedFriend) : getUserAvatar(profile),
+          seen_at: msg.read_at || new Date().toISOString(),
+        }]
+        : [];
+
+    return {
+      ...msg,
+      content,
+      is_temp: false,
+      message_type: messageType,
+      sender,
+      is_read: msg.is_read || false,
+      read_at: msg.read_at || null,
+      seen_by,
+      voice_duration: msg.voice_duration || 0,
+      file_size: msg.file_size || 0,
+    };
+  };
 
-        const seen_by = msg.seen_by && Array.isArray(msg.seen_by)
-          ? msg.seen_by.map(s => ({
-            user_id: s.user_id || s.userId,
-            username: s.username,
-            avatar_url: s.avatar_url || s.avatarUrl,
-            seen_at: s.seen_at || s.seenAt,
-          }))
-          : msg.is_read
-            ? [{
-              user_id: msg.receiver_id === profile?.id ? selectedFriend.id : profile.id,
-              username: msg.receiver_id === profile?.id ? selectedFriend.username : profile.username,
-              avatar_url: msg.receiver_id === profile?.id ? getUserAvatar(selectedFriend) : getUserAvatar(profile),
-              seen_at: msg.read_at || new Date().toISOString(),
-            }]
-            : [];
-
-        return {
-          ...msg,
-          content,
-          is_temp: false,
-          message_type: messageType,
-          sender,
-          is_read: msg.is_read || false,
-          read_at: msg.read_at || null,
-          seen_by,
-          voice_duration: msg.voice_duration || 0,
-          file_size: msg.file_size || 0,
-        };
-      });
+  const loadInitialMessages = async () => {
+    if (!selectedFriend || messages.length > 0) return;
+    try {
+      const chatMessages = await getPrivateChat(selectedFriend.id, { limit: HISTORY_PAGE_SIZE });
+      const enhanced = chatMessages.map(enhanceHistoryMessage);
 
+      setHasOlderMessages(chatMessages.length === HISTORY_PAGE_SIZE);
       setMessages(enhanced.sort((a, b) => new Date(a.created_at) - new Date(b.created_at)));
     } catch (err) {
       setError('Failed to load messages');
@@ -1032,6 +1064,33 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
     }
   };
 
+  /* --------------------------------------------------------------------- */
+  /* Load Older Messages (cursor = the oldest message shown) */
+  /* --------------------------------------------------------------------- */
+  const loadOlderMessages = async () => {
+    const oldest = messages.find((m) => !m.is_temp);
+    if (!selectedFriend || !oldest || !hasOlderMessages || loadingOlder) return;
+    const friendId = selectedFriend.id;
+    setLoadingOlder(true);
+    try {
+      const older = await getPrivateChat(friendId, { beforeId: oldest.id, limit: HISTORY_PAGE_SIZE });
+      if (activeFriendIdRef.current !== friendId) return;
+
+      setHasOlderMessages(older.length === HISTORY_PAGE_SIZE);
+      if (older.length === 0) return;
+      if (messagesContainerRef.current) prependScrollRef.current = messagesContainerRef.current.scrollHeight;
+      setMessages((prev) => {
+        const known = new Set(prev.map((m) => m.id));
+        return [...older.filter((m) => !known.has(m.id)).map(enhanceHistoryMessage), ...prev];
+      });
+    } catch (err) {
+      setError('Failed to load older messages');
+      console.error(err);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   /* --------------------------------------------------------------------- */
   /* Friend Selection */
   /* --------------------------------------------------------------------- */
@@ -1041,6 +1100,7 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
     if (selectedFriend) closeConnection(1000, 'Switching friends');
     setSelectedFriend(friend);
     setMessages([]);
+    setHasOlderMessages(false);
     setNewMessage('');
     setFriendTyping(false);
     setImagePreview(null);
@@ -1194,11 +1254,19 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
   useEffect(() => {
     if (messages.length !== lastMessageCount.current) {
       lastMessageCount.current = messages.length;
+      const container = messagesContainerRef.current;
+      if (prependScrollRef.current !== null && container) {
+        // Older history went in above: keep the same messages in view instead of jumping down
+        container.scrollTop += container.scrollHeight - prependScrollRef.current;
+        prependScrollRef.current = null;
+        return;
+      }
       scrollToBottom();
     }
   }, [messages, scrollToBottom]);
 
   useEffect(() => {
+    activeFriendIdRef.current = selectedFriend?.id ?? null;
     if (selectedFriend) scrollToBottom();
   }, [selectedFriend, scrollToBottom]);
 
@@ -1476,6 +1544,9 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
               <Box
                 ref={messagesContainerRef}
                 className="messages-area"
+                onScroll={(e) => {
+                  if (e.currentTarget.scrollTop < 80) loadOlderMessages();
+                }}
                 sx={{
                   flex: 1,
                   overflowY: 'auto',
@@ -1494,20 +1565,29 @@ const MessagesTab = ({ friends, profile, setError, setSuccess }) => {
                     <Typography color="text.secondary">Say hello to {selectedFriend.username}!</Typography>
                   </Box>
                 ) : (
-                  messages.map((message) => (
-                    <ChatMessage
-                      key={message.id}
-                      message={message}
-                      isMine={message.sender_id === profile?.id}
-                      onUpdate={handleEditMessage}
-                      onDelete={handleDeleteMessage}
-                      onForward={handleForward}
-                      profile={profile}
-                      currentFriend={selectedFriend}
-                      getAvatarUrl={getAvatarUrl}
-                      getUserInitials={getUserInitials}
-                    />
-                  ))
+                  <>
+                    {hasOlderMessages && (
+                      <Box sx={{ textAlign: 'center' }}>
+                        <Button size="small" onClick={loadOlderMessages} disabled={loadingOlder}>
+                          {loadingOlder ? <CircularProgress size={16} /> : 'Load older messages'}
+                        </Button>
+                      </Box>
+                    )}
+                    {messages.map((message) => (
+                      <ChatMessage
+                        key={message.id}
+                        message={message}
+                        isMine={message.sender_id === profile?.id}
+                        onUpdate={handleEditMessage}
+                        onDelete={handleDeleteMessage}
+                        onForward={handleForward}
+                        profile={profile}
+                        currentFriend={selectedFriend}
+                        getAvatarUrl={getAvatarUrl}
+                        getUserInitials={getUserInitials}
+                      />
+                    ))}
+                  </>
                 )}
               </Box>
 
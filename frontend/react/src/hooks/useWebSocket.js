@@ -20,6 +20,8 @@ export const useWebSocket = (url, options = {}) => {
   const heartbeatIntervalRef = useRef(null);
   const reconnectAttemptsRef = useRef(0);
   const isSubscribedRef = useRef(true);
+  // Position in the room's frame log, sent back on reconnect so missed frames get replayed
+  const resumeRef = useRef({ epoch: null, seq: null });
   const [readyState, setReadyState] = useState(WebSocket.CONNECTING);
 
   const log = useCallback((message, data) => {
@@ -38,8 +40,12 @@ export const useWebSocket = (url, options = {}) => {
     }
 
     try {
-      log('Connecting to:', url);
-      const ws = new WebSocket(url);
+      const { epoch, seq } = resumeRef.current;
+      const connectUrl = seq === null
+        ? url
+        : `${url}${url.includes('?') ? '&' : '?'}resume_from=${seq}&epoch=${epoch}`;
+      log('Connecting to:', connectUrl);
+      const ws = new WebSocket(connectUrl);
       wsRef.current = ws;
       setReadyState(WebSocket.CONNECTING);
 
@@ -71,6 +77,12 @@ export const useWebSocket = (url, options = {}) => {
           
           // Ignore heartbeat responses
           if (data.type === 'heartbeat') return;
+
+          if (data.action === 'resume' || data.action === 'resync_required') {
+            resumeRef.current = { epoch: data.epoch, seq: data.seq };
+          } else if (typeof data.seq === 'number') {
+            resumeRef.current = { ...resumeRef.current, seq: data.seq };
+          }
           
           log('Message received:', data);
           if (onMessage) onMessage(data);
@@ -162,6 +174,11 @@ export const useWebSocket = (url, options = {}) => {
     setReadyState(WebSocket.CLOSED);
   }, []);
 
+  // A different room has its own frame log
+  useEffect(() => {
+    resumeRef.current = { epoch: null, seq: null };
+  }, [url]);
+
   // Connection management
   useEffect(() => {
     isSubscribedRef.current = true;
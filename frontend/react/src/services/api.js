@@ -871,9 +871,11 @@ export const forwardMessage = async (friendId, messageData) => {
   }
 };
 
-export const getPrivateChat = async (friendId) => {
+export const getPrivateChat = async (friendId, { beforeId, afterId, limit } = {}) => {
   try {
-    const response = await api.get(`/api/v1/chats/private/${friendId}`);
+    const response = await api.get(`/api/v1/chats/private/${friendId}`, {
+      params: { before_id: beforeId, after_id: afterId, limit },
+    });
 
     const messages = Array.isArray(response.data) ? response.data : [];
 
@@ -902,11 +904,46 @@ export const getPrivateChat = async (friendId) => {
   }
 };
 
+// Inbox: one entry per friend/group chat with its last message and unread count, newest first
+export const getConversations = async ({ before, limit } = {}) => {
+  const res = await api.get(`/api/v1/chats/conversations`, {
+    params: { before, limit },
+  });
+  return { conversations: res.data, nextCursor: res.headers["x-next-cursor"] || null };
+};
+
+// Catch-up after a reconnect: private events since `since` plus each group's events since its
+// own cursor (groupCursors: {groupId: cursor} from the previous response's `groups`); omit both
+// to get the starting cursors
+export const syncChats = async ({ since, groupCursors, limit } = {}) => {
+  const groups = Object.entries(groupCursors || {})
+    .map(([groupId, cursor]) => `${groupId}:${cursor}`)
+    .join(",");
+  const res = await api.get(`/api/v1/chats/sync`, {
+    params: { since, groups: groups || undefined, limit },
+  });
+  return res.data;
+};
+
+// Badge counts: { total_unread, private: {friendId: n}, groups: {groupId: n} }
+export const getUnreadCounts = async () => {
+  const res = await api.get(`/api/v1/chats/unread`);
+  return res.data;
+};
+
 export const getGroupMessage = async (groupId) => {
   const res = await api.get(`/api/v1/groups/${groupId}/message`);
   return res.data;
 };
 
+// Cursor-paged history: pass the previous nextCursor as `before` to load older messages
+export const getGroupMessagePage = async (groupId, { before, limit } = {}) => {
+  const res = await api.get(`/api/v1/groups/${groupId}/message`, {
+    params: { before, limit },
+  });
+  return { messages: res.data, nextCursor: res.headers["x-next-cursor"] || null };
+};
+
 export const updateMessageById = async (messageId, content) => {
   try {
     const res = await api.put(`/api/v1/messages/${messageId}`, content, {